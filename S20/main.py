@@ -1,20 +1,21 @@
 import sys
 from os import path
 from sys import exit
-from numpy import nanmean, reshape
 from functools import partial
-from pydm import Display
 from pydm.widgets.channel import PyDMChannel
 from pyqtgraph import colormap
 from PyQt5.QtCore import QTimer
 from epics import get_pv
-from orbit import FacetOrbit, DiffOrbit, BaseOrbit, BPM, FacetSCPBPM
+from orbit import FacetOrbit, BPM, FacetSCPBPM
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 sys.path.append(REPO_ROOT)
 
-from core import beam_refs
+from core import beam_refs, image_pipeline
+from core.orbit_columns import OrbitColumns
+from core.centroid_tracker import CentroidTracker
+from core import ui_cache
 from widgets.InvertedPyDMImage import InvertedPyDMImage
 from widgets.orbit_view import OrbitView
 
@@ -31,23 +32,43 @@ PV_DTOTR_ESCALE_E0 = 'SIOC:SYS1:ML00:AO333'
 
 PV_DTOTR_TRACK_UPDATE = 'SIOC:SYS1:ML03:AO977'
 
-
-def calc_dtotr_centroid():
-    """ get the image centroid (x/y peaks) from DTOTR2 & determine CUD image ROI """
-    pv_img = get_pv(f'{PV_DTOTR}:Image:ArrayData')
-    pv_imgw = get_pv(f'{PV_DTOTR}:Image:ArraySize0_RBV')
-    pv_imgh = get_pv(f'{PV_DTOTR}:Image:ArraySize1_RBV')
-    imraw = pv_img.get()
-    w, h = pv_imgw.get(), pv_imgh.get()
-    image = reshape(imraw, (w,h), order='F')
-    image = image - min(image.flatten())
-    px = nanmean(image, axis=0)
-    py = nanmean(image, axis=1)
-    cx = px.argmax()
-    cy = py.argmax()
-    return cx, cy
-
-class F2_CUD_S20(Display):
+# BC20 - dump orbit BPMs, SCP BPMs are read through the 57 buffer
+S20_BPMS_SCP = [
+    'BPMS:LI20:2050', 'BPMS:LI20:2147', 'BPMS:LI20:2160', 'BPMS:LI20:2223',
+    'BPMS:LI20:2235', 'BPMS:LI20:2245', 'BPMS:LI20:2261', 'BPMS:LI20:2278', 
+    'BPMS:LI20:2340', 'BPMS:LI20:2360', 'BPMS:LI20:3013', 'BPMS:LI20:3036', 
+    'BPMS:LI20:3101', 'BPMS:LI20:3120', 'BPMS:LI20:3340',
+    ]
+S20_BPMS_EPICS = [
+    "BPMS:LI20:2445", "BPMS:LI20:3156", "BPMS:LI20:3218", "BPMS:LI20:3265",
+    "BPMS:LI20:3315"
+    ]
+
+
+def make_orbit_data():
+    """ unconnected BC20 - dump orbit, also used by core/orbit_stream.py """
+    live_orbit = FacetOrbit(
+        ignore_bad_bpms=True, rate_suffix='TH', scp_suffix='57',
+        name='FACET-II BC20 - DUMP orbit'
+        )
+    bpms = []
+    for bpm_name in S20_BPMS_EPICS:
+        bpm = BPM(bpm_name, edef='TH')
+        if bpm.name in FacetOrbit.energy_bpms(): bpm.is_energy_bpm = True
+        bpms.append(bpm)
+    for bpm_name in S20_BPMS_SCP:
+        bpm = FacetSCPBPM(bpm_name, suffix='57')
+        if bpm.name in FacetOrbit.energy_bpms(): bpm.is_energy_bpm = True
+        bpms.append(bpm)
+    live_orbit.bpms = bpms
+
+    # the orbit object only supplies BPM metadata, live values are
+    # monitored straight into columns
+    suffixes = {bpm_name: 'TH' for bpm_name in S20_BPMS_EPICS}
+    suffixes.update({bpm_name: '57' for bpm_name in S20_BPMS_SCP})
+    return OrbitColumns.from_orbit(live_orbit, suffixes=suffixes)
+
+class F2_CUD_S20(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(F2_CUD_S20, self).__init__(parent=parent, args=args)
@@ -56,17 +77,22 @@ class F2_CUD_S20(Display):
         SYAG_image = InvertedPyDMImage(
             im_ch=f'{PV_SYAG}:Image:ArrayData',
             w_ch=f'{PV_SYAG}:Image:ArraySize0_RBV',
-            parent=self.ui.frame_SYAG
+            parent=self.ui.frame_SYAG,
+            pipeline=image_pipeline.from_config(self, 'SYAG_image'),
             )
         SYAG_image.readingOrder = 1
         SYAG_image.colorMap = 4
         SYAG_image.setGeometry(5, 5, 490, 240)
         SYAG_image.setShowAxes(True)
+        # limits are in camera pixels, the flip only inverts the view:
+        # the lower half of the sensor, shown as the top half of the image
+        SYAG_W = get_pv(f'{PV_SYAG}:Image:ArraySize0_RBV').get()
+        SYAG_H = get_pv(f'{PV_SYAG}:Image:ArraySize1_RBV').get()
         SYAG_image.getView().getViewBox().setLimits(
-            xMin=0, xMax=get_pv(f'{PV_SYAG}:Image:ArraySize0_RBV').get(),
-            yMin=0, yMax=get_pv(f'{PV_SYAG}:Image:ArraySize1_RBV').get()/2.0
+            xMin=0, xMax=SYAG_W, yMin=SYAG_H/2.0, yMax=SYAG_H
             )
         SYAG_image.setColorMap(cmap=colormap.get('inferno'))
+        SYAG_image.lutRendering = True
         SYAG_image.setScaleXAxis(get_pv(f'{PV_SYAG}:RESOLUTION').value*1e-3)
         SYAG_image.setScaleYAxis(get_pv(f'{PV_SYAG}:RESOLUTION').value*1e-3)
 
@@ -76,23 +102,25 @@ class F2_CUD_S20(Display):
         self.ui.live_DTOTR2.setScaleXAxis(reso)
         self.ui.live_DTOTR2.setScaleYAxis(reso)
 
-        self.track_dtotr = QTimer(self)
+        # follow the DTOTR2 centroid using the frames live_DTOTR2 already gets,
+        # tracking is switched on/off with PV_DTOTR_TRACK_UPDATE
+        self.track_dtotr = CentroidTracker(self.ui.live_DTOTR2, interval_ms=500, parent=self)
+        self.track_dtotr.roi_changed.connect(self.set_DTOTR2_ROI)
+        dtotr_track_flag = PyDMChannel(
+            address=PV_DTOTR_TRACK_UPDATE,
+            value_slot=lambda v: self.track_dtotr.set_enabled(v == 1)
+            )
+        dtotr_track_flag.connect()
         self.track_dtotr.start()
-        self.track_dtotr.setInterval(500)
-        self.track_dtotr.timeout.connect(self.set_DTOTR2_ROI)
 
         # setup S20 orbit
         self.draw_orbit = QTimer(self)
-        self.live_orbit = FacetOrbit(
-            ignore_bad_bpms=True, rate_suffix='TH', scp_suffix='57',
-            name='FACET-II BC20 - DUMP orbit'
-            )
-        self.live_orbit.bpms = self.S20_BPMs()
-        self.live_orbit.connect()        
+        self.orbit_data = make_orbit_data()
+        self.orbit_data.connect()
 
         cud_orbit = partial(OrbitView,
-            parent=self, draw_timer=self.draw_orbit,
-            units="mm",  ymin=-ORBIT_POS_SCALE, ymax=ORBIT_POS_SCALE, orbit=self.live_orbit
+            parent=self, draw_timer=self.draw_orbit, max_draw_rate=ORBIT_DRAW_RATE,
+            units="mm",  ymin=-ORBIT_POS_SCALE, ymax=ORBIT_POS_SCALE, orbit=self.orbit_data
             )
         self.xOrbitView = cud_orbit(axis="x", name="X", label="X")
         self.yOrbitView = cud_orbit(axis="y", name="Y", label="Y")
@@ -103,7 +131,7 @@ class F2_CUD_S20(Display):
         self.draw_orbit.start()
 
         self.reference_orbit = None
-        self.difference_orbit = None
+        self.ref_watcher = beam_refs.RefWatcher(['orbit_s20'])
         ref_update_flag = PyDMChannel(address=PV_REF_UPDATE, value_slot=self.udpate_ref_orbit)
         ref_update_flag.connect()
 
@@ -122,58 +150,30 @@ class F2_CUD_S20(Display):
         return path.join(SELF_PATH, 'main.ui')
 
     def udpate_ref_orbit(self):
-        ref_dict = beam_refs.read_current_refs()
-        orbit_fpath, ftype = ref_dict['orbit_s20'], 'Absolute'
+        # only reload when the orbit_s20 reference was republished
+        changed = self.ref_watcher.changed()
+        if 'orbit_s20' not in changed: return
+        orbit_fpath, ftype = changed['orbit_s20']['path'], 'Absolute'
         if orbit_fpath != 'NOTSET':
             try:
-                self.reference_orbit = BaseOrbit.from_MATLAB_file(orbit_fpath)
-                fname = path.split(orbit_fpath)[-1]
+                self.reference_orbit = beam_refs.load_orbit_array(orbit_fpath)
                 ftype = 'Diff'
-                self.difference_orbit = DiffOrbit(self.live_orbit, self.reference_orbit)
                 print(f"Reference orbit loaded from file {orbit_fpath}")
             except Exception as e:
-                print("Couldn't load orbit from MATLAB file.")
-                print("Only MATLAB files created by Orbit Display are supported\n")
+                print("Couldn't load reference orbit file.")
+                print("Only MATLAB/JSON files created by Orbit Display are supported\n")
                 raise(e)
         self.ui.ref_orbit_name.setText(path.split(orbit_fpath)[-1])
         self.ui.label_orbit_type.setText(ftype)
 
-        orbit = self.live_orbit
-        if ftype == 'Diff': orbit = DiffOrbit(self.live_orbit, self.reference_orbit)
-        self.xOrbitView.set_orbit(orbit)
-        self.yOrbitView.set_orbit(orbit)
+        # the reference is aligned to the live BPMs once here, the views
+        # subtract it from the live columns on every redraw
+        if ftype != 'Diff': self.reference_orbit = None
+        self.orbit_data.set_reference(self.reference_orbit)
         return
 
-    def S20_BPMs(self):
-        s20_BPMs_SCP = [
-            'BPMS:LI20:2050', 'BPMS:LI20:2147', 'BPMS:LI20:2160', 'BPMS:LI20:2223',
-            'BPMS:LI20:2235', 'BPMS:LI20:2245', 'BPMS:LI20:2261', 'BPMS:LI20:2278', 
-            'BPMS:LI20:2340', 'BPMS:LI20:2360', 'BPMS:LI20:3013', 'BPMS:LI20:3036', 
-            'BPMS:LI20:3101', 'BPMS:LI20:3120', 'BPMS:LI20:3340',
-            ]
-        s20_BPMs_EPICS = [
-            "BPMS:LI20:2445", "BPMS:LI20:3156", "BPMS:LI20:3218", "BPMS:LI20:3265",
-            "BPMS:LI20:3315"
-            ]
-        bpms = []
-        for bpm_name in s20_BPMs_EPICS:
-            bpm = BPM(bpm_name, edef='TH')
-            if bpm.name in FacetOrbit.energy_bpms(): bpm.is_energy_bpm = True
-            bpms.append(bpm)
-        for bpm_name in s20_BPMs_SCP:
-            bpm = FacetSCPBPM(bpm_name, suffix='57')
-            if bpm.name in FacetOrbit.energy_bpms(): bpm.is_energy_bpm = True
-            bpms.append(bpm)
-        return bpms
-
-    def set_DTOTR2_ROI(self):
-        if get_pv(PV_DTOTR_TRACK_UPDATE).get() != 1: return
-        try:
-            cx,cy = calc_dtotr_centroid()
-            self.ui.live_DTOTR2.getView().getViewBox().setLimits(
-                xMin=cx-200, xMax=cx+200, yMin=cy-200, yMax=cy+200
-                )
-            return
-        except:
-            print('dtotr image processing failed')
-            return
+    def set_DTOTR2_ROI(self, cx, cy):
+        self.ui.live_DTOTR2.getView().getViewBox().setLimits(
+            xMin=cx-200, xMax=cx+200, yMin=cy-200, yMax=cy+200
+            )
+        return
@@ -1,10 +1,12 @@
 # remote launch/kill controls for ACR
 
-from os import environ
-from subprocess import call, check_output, CalledProcessError
+from os import environ, kill, path
+from subprocess import check_output, CalledProcessError
 from time import sleep
+from threading import Lock
+import yaml
 from epics import caget
-from core import launch, common
+from core import launch, common, pv_writer, window_tracker, supervisor
 
 
 # list of LM/SM machines in ACR quadrant 2
@@ -57,6 +59,10 @@ PVSTEM_DISP = CUD_PV_ROOT.format('DISPLAY')
 PVSTEM_PID  = CUD_PV_ROOT.format('PID')
 PVSTEM_WID  = CUD_PV_ROOT.format('WINDOWID')
 
+# published by the supervisor daemon, see core/supervisor.py
+PVSTEM_ALIVE    = CUD_PV_ROOT.format('ALIVE')
+PVSTEM_RESTARTS = CUD_PV_ROOT.format('RESTARTS')
+
 COMMAND_WMCTRL_LIST = 'wmctrl -lpG'
 COMMAND_WMCTRL_FIND = f'{COMMAND_WMCTRL_LIST} | grep "{{}}"'
 
@@ -64,8 +70,17 @@ COMMAND_WMCTRL_MOVE = 'wmctrl -i -r {}'
 COMMAND_WMCTRL_REPOSITION = f'{COMMAND_WMCTRL_MOVE} -e 0,{{}},0,{{}},{{}}' # args: x, w, h
 COMMAND_WMCTRL_FULLSCREEN = f'{COMMAND_WMCTRL_MOVE} -b add,fullscreen'
 
-# need physics user to write to ACR CUD PVs 
-PHYS_CAPUT = "ssh physics@lcls-srv01 'caput {} {}'"
+# named layout presets, see get_layouts
+LAYOUTS_PATH = path.join(common.SELF_PATH, 'layouts.yaml')
+
+# max number of monitors launched/killed at once by the CUD manager
+MAX_LAUNCH_WORKERS = 8
+
+# {(display, window ID): monitor} for windows assigned to a launched CUD, so two
+# concurrent launches of the same display can't grab the same window
+# released again when the monitor's display is killed
+_claimed_win_IDs = {}
+_claim_lock = Lock()
 
 def LM_names(): return LARGE_MONITORS
 
@@ -77,6 +92,10 @@ def CUD_PV_pid(monitor): return PVSTEM_PID.format(monitor)
 
 def CUD_PV_wid(monitor): return PVSTEM_WID.format(monitor)
 
+def CUD_PV_alive(monitor): return PVSTEM_ALIVE.format(monitor)
+
+def CUD_PV_restarts(monitor): return PVSTEM_RESTARTS.format(monitor)
+
 def get_display_name(monitor):
     """
     turns the ACR monitor name ("LM21L" etc) into sunray IDs
@@ -99,91 +118,234 @@ def kill_monitor(monitor):
     """
     kills the process labelled with CUD:ACR0:<monitor>:PID
     resets CUD:ACR0:<monitor> PVs
+    goes through the supervisor daemon if one is running
     """
+    if supervisor.available():
+        supervisor.request_kill(monitor)
+        return
+
     CUD_PID = caget(CUD_PV_pid(monitor))
     if CUD_PID:
-        try:
-            check_output(f'kill -9 {CUD_PID}', shell=True)
-        except CalledProcessError:
-            print('nothing running')
+        if not supervisor.terminate(int(CUD_PID)): print('nothing running')
 
         # unset display name, PID and windowID PVs
-        call(PHYS_CAPUT.format(CUD_PV_disp(monitor), '""'), shell=True)
-        call(PHYS_CAPUT.format(CUD_PV_pid(monitor), '""'), shell=True)
-        call(PHYS_CAPUT.format(CUD_PV_wid(monitor), '""'), shell=True)
-
-    # verify success somehow?
-
-    # # unset display name, PID and windowID PVs
-    # call(PHYS_CAPUT.format(CUD_PV_disp(monitor), '""'), shell=True)
-    # call(PHYS_CAPUT.format(CUD_PV_pid(monitor), '""'), shell=True)
-    # call(PHYS_CAPUT.format(CUD_PV_wid(monitor), '""'), shell=True)
+        set_monitor_PVs(monitor, '', '', '')
+    release_win_IDs(monitor)
 
     return
 
-def send_to_monitor(monitor, CUD_ID):
+def send_to_monitor(monitor, CUD_ID, check=None):
     """
     sends <CUD_ID> to <monistor>
+    handed to the supervisor daemon if one is running, so it gets restarted if it dies
+    <check>() is called between launch steps and can raise to abort the launch,
+    a launch handed to the supervisor can only be aborted before it's sent
+    """
+    if supervisor.available():
+        if check is not None: check()
+        supervisor.request_launch(monitor, CUD_ID)
+        return
+    start_on_monitor(monitor, CUD_ID, check=check)
+    return
+
+def start_on_monitor(monitor, CUD_ID, check=None):
+    """
+    launches <CUD_ID> on <monitor> without supervision
     fullscreens the display after launch
     sets CUD:ACR0:<monitor> PVs
+    <check>() is called between steps (and while waiting for the window) and can
+    raise to abort, the display is killed if the launch doesn't finish
+    returns the launched process
     """
+    if check is None: check = lambda: None
 
-    # set $DISPLAY env var to the relevant LM/SM sunray
-    init_disp = environ['DISPLAY']
-    environ['DISPLAY'] = get_display_name(monitor)
+    # launch with $DISPLAY set to the relevant LM/SM sunray
+    # this process's own environment is left alone so launches can run in parallel
+    env = dict(environ)
+    env['DISPLAY'] = get_display_name(monitor)
+    check()
 
-    p = launch.run_CUD(CUD_ID)
+    # watch the target display for the new window before it can appear
+    # falls back to polling wmctrl if X events aren't available
+    tracker = window_tracker.open_tracker(env['DISPLAY'])
+    if tracker is None: existing = set(_get_win_ID_list(env))
 
-    # wmctrl+grep to check for the new window & grab its ID
-    n, CUD_win_ID = 0, ''
-    while not CUD_win_ID and n < 60:
-        n = n+1
-        CUD_win_ID = _find_win_ID(CUD_ID)
-        if CUD_win_ID: break
-        sleep(0.5)
-    else:
-        raise RuntimeError('Display was not visible to window manager within 30s')
+    p = launch.run_CUD(CUD_ID, env=env)
 
-    # resposition/fullscreen with wmctrl
-    _reposition_CUD(CUD_win_ID, monitor)
+    CUD_win_ID = ''
+    try:
+        if tracker is not None:
+            with tracker:
+                # external displays are started through a shell, so only
+                # pydm launches know the PID their window will report
+                CUD_win_ID = tracker.wait_for(
+                    pid=p.pid if launch.is_hostable(CUD_ID) else None, titles=_CUD_titles(CUD_ID),
+                    accept=lambda win_ID: _claim_win_ID(win_ID, monitor, env), check=check
+                    )
+                if not CUD_win_ID:
+                    raise RuntimeError('Display was not visible to window manager within 30s')
+                check()
+                tracker.place(CUD_win_ID, get_x_coord(monitor), 0, 1920, 1080)
+        else:
+            # wmctrl+grep to check for the new window & grab its ID
+            n = 0
+            while not CUD_win_ID and n < 60:
+                n = n+1
+                check()
+                CUD_win_ID = _find_win_ID(CUD_ID, monitor, env, skip=existing)
+                if CUD_win_ID: break
+                sleep(0.5)
+            else:
+                raise RuntimeError('Display was not visible to window manager within 30s')
+
+            # resposition/fullscreen with wmctrl
+            check()
+            _reposition_CUD(CUD_win_ID, monitor, env)
+        check()
+    except BaseException:
+        # don't leave a display that nothing knows about on the monitor
+        p.kill()
+        if CUD_win_ID: _release_win_ID(CUD_win_ID, env)
+        raise
 
     # TO DO: verify success somehow?
 
     # caput to display name, PID and windowID PVs
-    call(PHYS_CAPUT.format(CUD_PV_disp(monitor), common.CUD_desc(CUD_ID)), shell=True)
-    call(PHYS_CAPUT.format(CUD_PV_pid(monitor), str(p.pid)), shell=True)
-    call(PHYS_CAPUT.format(CUD_PV_wid(monitor), CUD_win_ID), shell=True)
+    set_monitor_PVs(monitor, common.CUD_desc(CUD_ID), str(p.pid), CUD_win_ID)
+    return p
+
+def set_monitor_PVs(monitor, desc, pid, win_ID):
+    """ write the display name, PID and windowID PVs for <monitor> in one batch """
+    status = pv_writer.get_writer().write([
+        (CUD_PV_disp(monitor), desc),
+        (CUD_PV_pid(monitor), pid),
+        (CUD_PV_wid(monitor), win_ID),
+        ])
+    failed = [pv for pv, ok in status.items() if not ok]
+    if failed: raise RuntimeError(f'failed to write: {", ".join(failed)}')
+    return
 
-    # restore $DISPLAY to localhost
-    environ['DISPLAY'] = init_disp
+def set_monitor_health_PVs(monitor, alive, restarts):
+    """ write the supervisor's liveness flag and restart count for <monitor> """
+    status = pv_writer.get_writer().write([
+        (CUD_PV_alive(monitor), alive),
+        (CUD_PV_restarts(monitor), restarts),
+        ])
+    failed = [pv for pv, ok in status.items() if not ok]
+    if failed: raise RuntimeError(f'failed to write: {", ".join(failed)}')
     return
 
-def _get_win_ID_list():
+def get_layouts():
+    """
+    named layouts as {name: {monitor: CUD_ID}}, 'default' is the ACR section of
+    config.yaml and every preset in layouts.yaml is applied on top of it
+    """
+    default = {}
+    for mtype in ['lm', 'sm']: default.update(common.CONFIG['ACR'][mtype])
+    layouts = {'default': default}
+    if path.exists(LAYOUTS_PATH):
+        with open(LAYOUTS_PATH, 'r') as f:
+            presets = yaml.safe_load(f) or {}
+        for name, overrides in presets.items():
+            layouts[name] = {**default, **(overrides or {})}
+    return layouts
+
+def get_monitor_state(monitor):
+    """ (CUD_ID, PID) from the :DISPLAY/:PID PVs of <monitor>, None for unset values """
+    desc = caget(CUD_PV_disp(monitor), as_string=True)
+    CUD_ID = common.CUD_ID(desc) if desc else None
+    try:
+        pid = int(caget(CUD_PV_pid(monitor), as_string=True))
+    except (TypeError, ValueError):
+        pid = None
+    return CUD_ID, pid
+
+def is_running(pid):
+    """ True if there is a process with <pid> """
+    if not pid: return False
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def plan_layout(layout):
+    """
+    work out what has to change to get the monitors to <layout> ({monitor: CUD_ID}),
+    monitors already showing the right display in a live process are left alone
+    returns a dict of:
+    * keep: [monitors] already correct
+    * kill: [monitors] with a display that has to go (wrong, dead or cleared)
+    * launch: {monitor: CUD_ID} to start after the kills
+    """
+    plan = {'keep': [], 'kill': [], 'launch': {}}
+    for monitor, CUD_ID in layout.items():
+        current_ID, pid = get_monitor_state(monitor)
+        if current_ID == CUD_ID and (CUD_ID is None or is_running(pid)):
+            plan['keep'].append(monitor)
+            continue
+        if current_ID is not None or pid: plan['kill'].append(monitor)
+        if CUD_ID is not None: plan['launch'][monitor] = CUD_ID
+    return plan
+
+def check_alive(monitors):
+    """ monitors from <monitors> whose recorded display process is no longer running """
+    dead = []
+    for monitor in monitors:
+        CUD_ID, pid = get_monitor_state(monitor)
+        if CUD_ID is not None and not is_running(pid): dead.append(monitor)
+    return dead
+
+def _get_win_ID_list(env=None):
     """ helper function - calls wmctrl, parses output, returns winID """
-    init_win_list = check_output(COMMAND_WMCTRL_LIST, shell=True).decode('utf-8').strip()
+    init_win_list = check_output(COMMAND_WMCTRL_LIST, shell=True, env=env).decode('utf-8').strip()
     win_IDs = []
-    for r in init_win_list.split('\n'): win_IDs.append(r.split()[0])
+    for r in init_win_list.split('\n'):
+        if r: win_IDs.append(r.split()[0])
     return win_IDs
 
-def _find_win_ID(CUD_ID):
+def _CUD_titles(CUD_ID):
+    """ window titles a CUD might have, most specific first """
+    return [f'FACET-II CUD: {common.CUD_desc(CUD_ID)}', f'{common.CUD_desc(CUD_ID)}']
+
+def _find_win_ID(CUD_ID, monitor, env=None, skip=()):
     """
     use wmctrl and grep for the windowID of a CUD, if grep fails, return nothing
+    windows in <skip> or claimed by another launch are skipped, a found window
+    is claimed for <monitor>
     """
-    CUD_window_title = f'FACET-II CUD: {common.CUD_desc(CUD_ID)}'
-    CUD_window_title_alt = f'{common.CUD_desc(CUD_ID)}'
-    
-    try:
-        args = COMMAND_WMCTRL_FIND.format(CUD_window_title)
-        return check_output(args, shell=True).decode('utf-8').strip().split()[0]
-
-    except CalledProcessError:
+    for title in _CUD_titles(CUD_ID):
         try:
-            args = COMMAND_WMCTRL_FIND.format(CUD_window_title_alt)
-            return check_output(args, shell=True).decode('utf-8').strip().split()[0]
+            args = COMMAND_WMCTRL_FIND.format(title)
+            out = check_output(args, shell=True, env=env).decode('utf-8').strip()
         except CalledProcessError:
-            return ''
-
-def _reposition_CUD(win_ID, monitor):
+            continue
+        for line in out.split('\n'):
+            win_ID = line.split()[0]
+            if win_ID not in skip and _claim_win_ID(win_ID, monitor, env): return win_ID
+    return ''
+
+def release_win_IDs(monitor):
+    """ forget the windows claimed for <monitor>, call once its display is gone """
+    with _claim_lock:
+        for key in [k for k, m in _claimed_win_IDs.items() if m == monitor]:
+            del _claimed_win_IDs[key]
+
+def _release_win_ID(win_ID, env=None):
+    """ forget the claim on <win_ID> on env's $DISPLAY """
+    with _claim_lock: _claimed_win_IDs.pop(((env or environ).get('DISPLAY'), win_ID), None)
+
+def _claim_win_ID(win_ID, monitor, env=None):
+    """ claim <win_ID> on env's $DISPLAY for <monitor>, returns False if it was already taken """
+    key = ((env or environ).get('DISPLAY'), win_ID)
+    with _claim_lock:
+        if key in _claimed_win_IDs: return False
+        _claimed_win_IDs[key] = monitor
+    return True
+
+def _reposition_CUD(win_ID, monitor, env=None):
     """
     step 1: reposition with x offset for L/R, A/B/C/D & set to 1920x1080
     step 2: fullscreen
@@ -196,7 +358,7 @@ def _reposition_CUD(win_ID, monitor):
 
     for command in [cmd_reposition, cmd_fullscreen]:
         try:
-            out = check_output(command, shell=True)
+            out = check_output(command, shell=True, env=env)
         except CalledProcessError:
             raise RuntimeError('Display window adjustment failed.')
     return
@@ -1,11 +1,14 @@
 # code for collecting beam references
 # gets reference from relevant PV/device & saves to /beam_refs/
 
-from os import path, environ
+import json
+import fcntl
+from os import path, environ, makedirs, replace, stat, getpid, getuid
+from hashlib import sha1
 from datetime import datetime
 from epics import caput
+import numpy as np
 from numpy import loadtxt
-from time import sleep
 
 
 SELF_PATH = path.dirname(path.abspath(__file__))
@@ -23,41 +26,209 @@ REF_TYPES = [
 DATE_FMT_READABLE = '%d-%b-%Y %H:%M'
 DATE_FMT_TIMESTAMP = '%Y%m%d%H%M%S'
 
+# holds the registry sequence number, bumped after every published change
 PV_REF_UPDATE = 'SIOC:SYS1:ML03:AO976'
 
+# versioned reference registry, one small JSON file per <ref_type>:
+# {"version", "path", "sha1", "updated"}, versions are taken from a registry-wide
+# sequence so they only ever go up, current_refs.csv is only read as a fallback
+REF_REGISTRY_PATH = path.join(path.dirname(CURRENT_REFS_FILE), 'registry')
+REF_REGISTRY_LOCK = path.join(REF_REGISTRY_PATH, '.lock')
+
+# local store of converted reference orbits, so each CUD doesn't re-parse the
+# same MATLAB file over NFS, orbits are kept as memory-mappable .npy files named
+# by content hash and looked up through an index keyed by source path/mtime/size
+REF_CACHE_PATH = environ.get('F2_CUD_REF_CACHE', f'/tmp/F2-CUDs-refs-{getuid()}')
+REF_CACHE_INDEX = path.join(REF_CACHE_PATH, 'index.json')
+
+ORBIT_DTYPE = np.dtype([
+    ('name', 'U32'),
+    ('z', 'f8'),
+    ('x', 'f8'),
+    ('y', 'f8'),
+    ('tmit', 'f8'),
+    ])
+
+# (path, mtime, size) -> array, for repeat loads within one process
+_loaded_orbits = {}
+
 def clear(ref_type):
-    """ update current_refs.csv to unset <ref_type> """
+    """ unset <ref_type> in the registry """
     update_current_refs(ref_type, 'NOTSET')
     return
 
 def read_current_refs():
+    """ {ref_type: file path} for every REF_TYPES entry, 'NOTSET' if unset """
+    registry = read_registry()
+    legacy = None
+    ref_dict = {}
+    for ref_type in REF_TYPES:
+        if ref_type in registry:
+            ref_dict[ref_type] = registry[ref_type]['path']
+            continue
+        if legacy is None: legacy = _read_legacy_refs()
+        ref_dict[ref_type] = legacy.get(ref_type, 'NOTSET')
+    return ref_dict
+
+def read_registry(ref_types=REF_TYPES):
+    """ {ref_type: registry entry} for published <ref_types> """
+    registry = {}
+    for ref_type in ref_types:
+        try:
+            with open(_registry_file(ref_type), 'r') as f: registry[ref_type] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+    return registry
+
+def update_current_refs(ref_type, ref_fname):
+    """ publish a new version of <ref_type> and bump PV_REF_UPDATE """
+    if ref_type not in REF_TYPES: raise ValueError(f'unknown reference type: {ref_type}')
+    digest = None
+    if ref_fname != 'NOTSET':
+        with open(ref_fname, 'rb') as f: digest = sha1(f.read()).hexdigest()
+
+    makedirs(REF_REGISTRY_PATH, exist_ok=True)
+    with open(REF_REGISTRY_LOCK, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        version = max([e['version'] for e in read_registry().values()], default=0) + 1
+        entry = {
+            'version': version,
+            'path': ref_fname,
+            'sha1': digest,
+            'updated': datetime.now().strftime(DATE_FMT_TIMESTAMP),
+            }
+        # write-then-rename so readers see the old or the new entry, never half of one
+        tmp_file = f'{_registry_file(ref_type)}.{getpid()}.tmp'
+        with open(tmp_file, 'w') as f: json.dump(entry, f)
+        replace(tmp_file, _registry_file(ref_type))
+    caput(PV_REF_UPDATE, version)
+    return version
+
+
+class RefWatcher(object):
+    """
+    tracks the registry versions a display has loaded,
+    changed() returns only the entries that were republished since the last call
+    """
+    def __init__(self, ref_types=REF_TYPES):
+        self.ref_types = list(ref_types)
+        self.versions = {}
+
+    def changed(self):
+        changed = {}
+        registry = read_registry(self.ref_types)
+        legacy = None
+        for ref_type in self.ref_types:
+            entry = registry.get(ref_type)
+            if entry is None:
+                # not published yet, treat the legacy CSV as version 0
+                if legacy is None: legacy = _read_legacy_refs()
+                entry = {'version': 0, 'path': legacy.get(ref_type, 'NOTSET'), 'sha1': None}
+            if self.versions.get(ref_type) == entry['version']: continue
+            self.versions[ref_type] = entry['version']
+            changed[ref_type] = entry
+        return changed
+
+
+def _registry_file(ref_type): return path.join(REF_REGISTRY_PATH, f'{ref_type}.json')
+
+def _read_legacy_refs():
     """ load CURRENT_REFS_FILE to a dict """
     ref_dict = {}
-    r = loadtxt(CURRENT_REFS_FILE, delimiter=',', dtype=str)
+    try:
+        r = loadtxt(CURRENT_REFS_FILE, delimiter=',', dtype=str, ndmin=2)
+    except OSError:
+        return ref_dict
     for line in r: ref_dict[line[0]] = line[1]
     return ref_dict
 
-def update_current_refs(ref_type, ref_fname):
-    """ update CURRENT_REFS_FILE for ref_type"""
-    ref_dict = read_current_refs()
-    ref_dict[ref_type] = ref_fname
-    _write_current_refs(ref_dict)
-    _set_update_flag()
-    return
+def load_orbit(fpath):
+    """ reference orbit from a MATLAB/JSON orbit file as a BaseOrbit, through the local store """
+    return to_orbit(load_orbit_array(fpath), name=path.split(fpath)[-1])
 
-def _write_current_refs(ref_dict):
-    """ write CURRENT_REFS_FILE from dict """
-    out = ''
-    for ref_type, ref_fname in ref_dict.items(): out = out + f'{ref_type},{ref_fname}\n'
-    with open(CURRENT_REFS_FILE, 'w') as f: f.write(out)
-    return
+def load_orbit_array(fpath):
+    """
+    reference orbit as an ORBIT_DTYPE array (memory-mapped, read-only)
+    only converts <fpath> if its path/mtime/size isn't in the store yet
+    """
+    fpath = path.abspath(fpath)
+    st = stat(fpath)
+    key = (fpath, st.st_mtime_ns, st.st_size)
+    if key in _loaded_orbits: return _loaded_orbits[key]
+
+    entry = _read_index().get(fpath)
+    array_file = None
+    if entry and (entry['mtime_ns'], entry['size']) == key[1:]:
+        array_file = path.join(REF_CACHE_PATH, entry['file'])
+    if not (array_file and path.exists(array_file)):
+        array_file = _store_orbit(fpath, st)
+
+    arr = np.load(array_file, mmap_mode='r')
+    _loaded_orbits[key] = arr
+    return arr
+
+def to_orbit(arr, name=None):
+    """ build a BaseOrbit of static BPMs from an ORBIT_DTYPE array """
+    from orbit import BaseOrbit, BPM
+    orbit = BaseOrbit()
+    orbit.name = name
+    for row in arr:
+        bpm = BPM(str(row['name']))
+        bpm.z, bpm.x, bpm.y, bpm.tmit = (float(row[k]) for k in ['z', 'x', 'y', 'tmit'])
+        orbit.append(bpm)
+    return orbit
+
+def parse_orbit_file(fpath):
+    """ slow path, parse a MATLAB or JSON orbit file into an ORBIT_DTYPE array """
+    if fpath.endswith('.json'): return _parse_orbit_json(fpath)
+    from orbit import BaseOrbit
+    orbit = BaseOrbit.from_MATLAB_file(fpath)
+    return np.array(
+        [(bpm.name, bpm.z, bpm['x'], bpm['y'], bpm['tmit']) for bpm in orbit],
+        dtype=ORBIT_DTYPE
+        )
+
+def _parse_orbit_json(fpath):
+    """
+    JSON orbit files are either per-BPM records ({"name", "z", "x", "y", "tmit"},
+    optionally under "bpms") or columns ({"names": [...], "z": [...], ...})
+    """
+    with open(fpath, 'r') as f: data = json.load(f)
+    if isinstance(data, dict) and 'bpms' in data: data = data['bpms']
+    if isinstance(data, list):
+        return np.array(
+            [(d['name'], d['z'], d.get('x', np.nan), d.get('y', np.nan), d.get('tmit', np.nan)) for d in data],
+            dtype=ORBIT_DTYPE
+            )
+    arr = np.zeros(len(data['names']), dtype=ORBIT_DTYPE)
+    arr['name'] = data['names']
+    for k in ['z', 'x', 'y', 'tmit']: arr[k] = data.get(k, np.nan)
+    return arr
+
+def _store_orbit(fpath, st):
+    """ convert <fpath> into the store and index it, returns the array file """
+    with open(fpath, 'rb') as f: digest = sha1(f.read()).hexdigest()[:16]
+    array_file = path.join(REF_CACHE_PATH, f'{digest}.npy')
+    if not path.exists(array_file):
+        makedirs(REF_CACHE_PATH, exist_ok=True)
+        arr = parse_orbit_file(fpath)
+        # write-then-rename so concurrent CUDs never map a partial file
+        tmp_file = f'{array_file}.{getpid()}.tmp'
+        with open(tmp_file, 'wb') as f: np.save(f, arr)
+        replace(tmp_file, array_file)
 
-def _set_update_flag():
-    """ ping PV_REF_UPDATE to refresh all CUD reference displays """
-    caput(PV_REF_UPDATE, 1)
-    sleep(0.5)
-    caput(PV_REF_UPDATE, 0)
+    index = _read_index()
+    index[fpath] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'sha1': digest, 'file': f'{digest}.npy'}
+    tmp_index = f'{REF_CACHE_INDEX}.{getpid()}.tmp'
+    with open(tmp_index, 'w') as f: json.dump(index, f)
+    replace(tmp_index, REF_CACHE_INDEX)
+    return array_file
 
+def _read_index():
+    try:
+        with open(REF_CACHE_INDEX, 'r') as f: return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
 
 def ts_from_ref_fname(ref_fname):
     # ts_raw = ref_fname.split('_')[-1].split('.')
@@ -0,0 +1,248 @@
+# startup benchmarks for FACET-II CUDs
+# each display is launched offscreen in a fresh process against a fake pydm
+# data source, and timed from process start to a painted, connected window
+
+import sys
+import csv
+import json
+import time
+import argparse
+import subprocess
+from os import path, environ
+
+SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+sys.path.append(REPO_ROOT)
+
+from core import common, launch
+
+METRICS = [
+    'import_s',
+    'ui_load_s',
+    'init_s',
+    'first_paint_s',
+    'connected_s',
+    ]
+
+# per-display time limit, includes interpreter start-up
+CHILD_TIMEOUT = 120
+
+# how long to wait for paint/connections before giving up on a display
+PAINT_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 30.0
+
+# defaults, can be overridden by the 'bench' section of config.yaml
+THRESHOLDS = common.CONFIG.get('bench', {}).get('thresholds', {})
+REGRESSION_FACTOR = common.CONFIG.get('bench', {}).get('regression_factor', 1.25)
+
+# pydm protocols served by the fake data source
+FAKE_PROTOCOLS = ['ca', 'pva']
+
+
+def run(CUD_IDs, out_prefix, baseline=None):
+    """
+    benchmark each of <CUD_IDs>, write <out_prefix>.json & .csv
+    returns a list of regression messages (empty if all is well)
+    """
+    results = []
+    for CUD_ID in CUD_IDs:
+        print(f' -> benchmarking {CUD_ID} ...')
+        results.append(_bench_one(CUD_ID))
+
+    _write_report(results, out_prefix)
+
+    regressions = check_thresholds(results)
+    if baseline: regressions = regressions + compare_to_baseline(results, baseline)
+    for msg in regressions: print(f'REGRESSION: {msg}')
+    return regressions
+
+def check_thresholds(results):
+    """ flag any metric above its absolute limit from config.yaml """
+    msgs = []
+    for r in results:
+        limits = dict(THRESHOLDS.get('default', {}), **THRESHOLDS.get(r['CUD_ID'], {}))
+        for metric, limit in limits.items():
+            value = r.get(metric)
+            if value is not None and value > limit:
+                msgs.append(f'{r["CUD_ID"]} {metric} = {value:.3f}s (limit {limit:.3f}s)')
+    return msgs
+
+def compare_to_baseline(results, baseline_file):
+    """ flag any metric that got more than REGRESSION_FACTOR slower than last time """
+    with open(baseline_file, 'r') as f:
+        baseline = {r['CUD_ID']: r for r in json.load(f)}
+    msgs = []
+    for r in results:
+        old = baseline.get(r['CUD_ID'])
+        if old is None: continue
+        for metric in METRICS:
+            new_val, old_val = r.get(metric), old.get(metric)
+            if new_val is None or not old_val: continue
+            if new_val > REGRESSION_FACTOR*old_val:
+                msgs.append(
+                    f'{r["CUD_ID"]} {metric} {old_val:.3f}s -> {new_val:.3f}s'
+                    )
+    return msgs
+
+def _bench_one(CUD_ID):
+    """ run a single display in a fresh offscreen process """
+    env = dict(environ)
+    env['QT_QPA_PLATFORM'] = 'offscreen'
+    env['PYDM_DEFAULT_PROTOCOL'] = 'ca'
+    # keep any direct pyepics access local: either a stand-in IOC or fast failures
+    env.setdefault('EPICS_CA_ADDR_LIST', '127.0.0.1')
+    env.setdefault('EPICS_CA_AUTO_ADDR_LIST', 'NO')
+    env['F2_CUD_BENCH_T0'] = repr(time.time())
+    args = [sys.executable, path.join(SELF_PATH, 'bench.py'), '--child', CUD_ID]
+    try:
+        out = subprocess.run(
+            args, env=env, capture_output=True, timeout=CHILD_TIMEOUT, text=True
+            )
+        result = json.loads(out.stdout.strip().split('\n')[-1])
+    except subprocess.TimeoutExpired:
+        result = {'CUD_ID': CUD_ID, 'error': f'timed out after {CHILD_TIMEOUT}s'}
+    except (ValueError, IndexError):
+        result = {'CUD_ID': CUD_ID, 'error': out.stderr.strip().split('\n')[-1]}
+    return result
+
+def _write_report(results, out_prefix):
+    with open(f'{out_prefix}.json', 'w') as f:
+        json.dump(results, f, indent=2)
+    with open(f'{out_prefix}.csv', 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=['CUD_ID']+METRICS+['error'])
+        w.writeheader()
+        for r in results: w.writerow({k: r.get(k, '') for k in w.fieldnames})
+    print(f'results written to {out_prefix}.json/.csv')
+    return
+
+def _child(CUD_ID):
+    """
+    runs inside the benchmark process, prints one JSON line of timings
+    import_s, first_paint_s & connected_s are seconds since the parent spawned
+    this process, init_s & ui_load_s are durations of the display's constructor
+    and of the .ui load inside it (the ui cache when it's used)
+    """
+    T0 = float(environ['F2_CUD_BENCH_T0'])
+    since_start = lambda: time.time() - T0
+    result = {'CUD_ID': CUD_ID}
+    try:
+        from PyQt5.QtCore import QObject, QEvent
+        from pydm import PyDMApplication
+        from pydm import data_plugins
+        import numpy, pyqtgraph, epics
+        result['import_s'] = since_start()
+
+        app = PyDMApplication(
+            hide_nav_bar=True, hide_menu_bar=True, hide_status_bar=True
+            )
+        for protocol in FAKE_PROTOCOLS:
+            data_plugins.plugin_modules[protocol] = _fake_plugin(protocol)()
+
+        ui_load_times = _time_ui_loads()
+        t = time.time()
+        display = launch.load_CUD(CUD_ID)
+        result['init_s'] = time.time() - t
+        if ui_load_times: result['ui_load_s'] = sum(ui_load_times)
+
+        class PaintWatcher(QObject):
+            painted = None
+            def eventFilter(self, obj, event):
+                if event.type() == QEvent.Paint and self.painted is None:
+                    self.painted = since_start()
+                return False
+
+        watcher = PaintWatcher()
+        display.installEventFilter(watcher)
+        display.show()
+        while watcher.painted is None and since_start() < PAINT_TIMEOUT:
+            app.processEvents()
+        result['first_paint_s'] = watcher.painted
+
+        deadline = time.time() + CONNECT_TIMEOUT
+        while time.time() < deadline:
+            app.processEvents()
+            if _all_connected(data_plugins.plugin_modules):
+                result['connected_s'] = since_start()
+                break
+    except Exception as e:
+        result['error'] = repr(e)
+    print(json.dumps(result))
+    sys.stdout.flush()
+    return
+
+def _time_ui_loads():
+    """
+    time every Display.load_ui call from here on, the cached and pydm paths alike
+    returns the list the durations are appended to, nested super() calls count once
+    """
+    from pydm import Display
+    from core.ui_cache import CachedUIDisplay
+    times, depth = [], [0]
+
+    def timed(load_ui):
+        def wrapper(self, *args, **kwargs):
+            depth[0] += 1
+            t = time.time()
+            try:
+                return load_ui(self, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+                if not depth[0]: times.append(time.time() - t)
+        return wrapper
+
+    for klass in [Display, CachedUIDisplay]: klass.load_ui = timed(klass.load_ui)
+    return times
+
+def _all_connected(plugins):
+    for plugin in plugins.values():
+        for conn in plugin.connections.values():
+            if not conn.connected: return False
+    return True
+
+def _fake_plugin(protocol):
+    """
+    build a pydm plugin class for <protocol> whose channels connect instantly
+    and deliver a single zero value, so no IOC is needed to paint displays
+    """
+    from numpy import zeros
+    from pydm.data_plugins.plugin import PyDMPlugin, PyDMConnection
+
+    class FakeConnection(PyDMConnection):
+        def __init__(self, channel, address, protocol=None, parent=None):
+            super(FakeConnection, self).__init__(channel, address, protocol, parent)
+            self.connected = True
+            self.add_listener(channel)
+
+        def add_listener(self, channel):
+            super(FakeConnection, self).add_listener(channel)
+            self.connection_state_signal.emit(True)
+            if self.address.endswith('ArrayData'):
+                self.new_value_signal[type(zeros(1))].emit(zeros(64*64))
+            else:
+                self.new_value_signal[float].emit(0.0)
+
+    class FakePlugin(PyDMPlugin):
+        connection_class = FakeConnection
+    FakePlugin.protocol = protocol
+    return FakePlugin
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='launcher.py --bench')
+    parser.add_argument('target', nargs='?', default='all', help='CUD name or "all"')
+    parser.add_argument('--out', default='bench_output', help='report file prefix')
+    parser.add_argument('--baseline', default=None, help='previous JSON report to compare to')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    opts = parser.parse_args(args)
+
+    if opts.child: return _child(opts.target)
+
+    if opts.target == 'all':
+        targets = [CUD_ID for CUD_ID in common.CUD_IDs() if launch.is_hostable(CUD_ID)]
+    elif launch.is_hostable(opts.target):
+        targets = [opts.target]
+    else:
+        raise KeyError(f'{opts.target} cannot be benchmarked')
+    return 1 if run(targets, opts.out, opts.baseline) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
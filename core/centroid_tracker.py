@@ -0,0 +1,91 @@
+# beam centroid/ROI tracking on frames an image widget already received
+# the GUI thread only hands over a reference to the widget's latest waveform,
+# projections run on a worker thread over a decimated view of it, and an ROI
+# update is published only when the centroid leaves a hysteresis band
+
+from threading import Thread, Condition
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+# pydm ReadingOrder.Clike
+READING_ORDER_CLIKE = 1
+
+
+def centroid(image, decimation=1):
+    """
+    (cx, cy) of the brightest column/row of a row-major <image>, from the
+    projections of every <decimation>th pixel, in full-resolution pixels
+    """
+    view = image[::decimation, ::decimation]
+    px = view.sum(axis=0, dtype=np.float64)
+    py = view.sum(axis=1, dtype=np.float64)
+    return int(px.argmax())*decimation, int(py.argmax())*decimation
+
+
+class CentroidTracker(QObject):
+    """
+    tracks the centroid of the frames shown by a PyDMImageView
+    emits roi_changed(cx, cy) when it moves more than <hysteresis> pixels
+    """
+    roi_changed = pyqtSignal(int, int)
+
+    def __init__(self, image_view, interval_ms=500, decimation=4, hysteresis=20, parent=None):
+        super(CentroidTracker, self).__init__(parent)
+        self.image_view = image_view
+        self.decimation = decimation
+        self.hysteresis = hysteresis
+        self.enabled = True
+        self.last_centroid = None
+        self._last_waveform = None
+        self._pending = None
+        self._cond = Condition()
+        self._worker = Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.sample)
+
+    def start(self): self.timer.start()
+
+    def stop(self): self.timer.stop()
+
+    def set_enabled(self, enabled):
+        """ value slot for an enable PV/checkbox """
+        self.enabled = bool(enabled)
+
+    def sample(self):
+        """ queue the widget's newest frame, no copy, skipped if it hasn't changed """
+        if not self.enabled: return
+        waveform = self.image_view.image_waveform
+        if waveform is self._last_waveform or waveform.size == 0: return
+        self._last_waveform = waveform
+        frame = (waveform, self.image_view.imageWidth, self.image_view.readingOrder)
+        with self._cond:
+            self._pending = frame
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None: self._cond.wait()
+                frame, self._pending = self._pending, None
+            try:
+                cx, cy = centroid(_as_image(*frame), self.decimation)
+            except ValueError as e:
+                print(f'centroid tracking failed: {e}')
+                continue
+            if self.last_centroid is not None:
+                dx, dy = cx - self.last_centroid[0], cy - self.last_centroid[1]
+                if max(abs(dx), abs(dy)) <= self.hysteresis: continue
+            self.last_centroid = (cx, cy)
+            self.roi_changed.emit(cx, cy)
+
+
+def _as_image(waveform, width, reading_order):
+    """ 2D view of a pydm image waveform, reshaped the same way PyDMImageView does """
+    if waveform.ndim != 1: return waveform
+    if width < 1: raise ValueError('no image width yet')
+    if reading_order == READING_ORDER_CLIKE:
+        return waveform.reshape((-1, width), order='C')
+    return waveform.reshape((width, -1), order='F')
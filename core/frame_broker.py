@@ -0,0 +1,453 @@
+# host-local camera frame broker
+# subscribes once per camera over CA and writes every frame into a shared-memory
+# ring buffer, CUDs on the same host read the newest frame through the shm://
+# pydm data plugin instead of each pulling full-size frames over the network
+#
+# a ring is one shared-memory segment per camera: a header with the latest
+# sequence number, the broker's PID and a heartbeat, then <n_slots> slots of
+# (seq, width, height, dtype, nbytes) + pixel data, a slot's seq is zeroed while
+# it's being written so readers can detect torn reads and retry
+#
+# shm:// channels follow the broker: while a camera's ring is live (its broker
+# is running and beating) frames come from the ring, otherwise straight from CA,
+# so CUDs pick up a broker started after them and survive one that was killed
+#
+# usage:
+#   $ python launcher.py --frame-broker                    (cameras from config.yaml)
+#   $ python launcher.py --frame-broker --synthetic CAMR:TEST:1
+#   $ python launcher.py --frame-broker --selftest
+
+import sys
+import time
+import signal
+import argparse
+import subprocess
+from os import path, getpid, kill
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+sys.path.append(REPO_ROOT)
+
+from core import common
+
+CONFIG = common.CONFIG.get('frame_broker', {})
+CAMERAS = CONFIG.get('cameras', [])
+N_SLOTS = CONFIG.get('n_slots', 4)
+SLOT_BYTES = CONFIG.get('slot_mb', 8)*1024*1024
+POLL_HZ = CONFIG.get('poll_hz', 30)
+
+# the broker beats every HEARTBEAT_S, a ring that missed STALE_S of beats is dead
+HEARTBEAT_S = CONFIG.get('heartbeat_s', 1.0)
+STALE_S = CONFIG.get('stale_s', 3.0)
+
+# how often readers without a live ring look for one
+ATTACH_RETRY_S = 1.0
+
+PROTOCOL = 'shm'
+MAGIC = b'F2FRAME2'
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('n_slots', '<u4'),
+    ('slot_bytes', '<u8'),
+    ('latest', '<u8'),
+    ('pid', '<u4'),
+    ('connected', '<u4'),
+    ('heartbeat', '<f8'),
+    ], align=True)
+
+SLOT_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('dtype', 'S4'),
+    ('nbytes', '<u8'),
+    ], align=True)
+
+# segments created (and so tracked) by this process
+_created = set()
+
+# PV fields served for each camera, relative to the camera prefix
+FIELD_DATA = 'Image:ArrayData'
+FIELD_WIDTH = 'Image:ArraySize0_RBV'
+FIELD_HEIGHT = 'Image:ArraySize1_RBV'
+
+
+class FrameRing(object):
+    """ shared-memory ring of camera frames, one writer and any number of readers """
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        if self.header['magic'] != MAGIC: raise ValueError(f'{shm.name} is not a frame ring')
+        self.n_slots = int(self.header['n_slots'])
+        self.slot_bytes = int(self.header['slot_bytes'])
+        stride = SLOT_DTYPE.itemsize + self.slot_bytes
+        self.slots, self.data = [], []
+        for i in range(self.n_slots):
+            offset = HEADER_DTYPE.itemsize + i*stride
+            self.slots.append(np.ndarray((), dtype=SLOT_DTYPE, buffer=shm.buf, offset=offset))
+            self.data.append(np.ndarray(self.slot_bytes, dtype=np.uint8, buffer=shm.buf, offset=offset+SLOT_DTYPE.itemsize))
+
+    @classmethod
+    def create(cls, camera, n_slots=N_SLOTS, slot_bytes=SLOT_BYTES):
+        slot_bytes = -(-slot_bytes//64)*64
+        size = HEADER_DTYPE.itemsize + n_slots*(SLOT_DTYPE.itemsize + slot_bytes)
+        try:
+            shared_memory.SharedMemory(name=segment_name(camera)).unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=segment_name(camera), create=True, size=size)
+        _created.add(shm.name)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header['n_slots'], header['slot_bytes'], header['latest'] = n_slots, slot_bytes, 0
+        header['pid'], header['connected'], header['heartbeat'] = getpid(), 1, time.time()
+        header['magic'] = MAGIC
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, camera):
+        """ open an existing ring, raises FileNotFoundError if the broker isn't serving <camera> """
+        return cls(_open(camera))
+
+    def latest(self): return int(self.header['latest'])
+
+    def beat(self):
+        """ writer side, tell readers the broker is still running """
+        self.header['heartbeat'] = time.time()
+
+    def set_connected(self, connected):
+        """ writer side, whether the camera itself is connected """
+        self.header['connected'] = int(connected)
+
+    def connected(self): return bool(self.header['connected'])
+
+    def alive(self):
+        """ True if the ring's broker is still running and beat within STALE_S """
+        if time.time() - float(self.header['heartbeat']) > STALE_S: return False
+        try:
+            kill(int(self.header['pid']), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def write(self, frame, width, height):
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f'{frame.nbytes} byte frame does not fit {self.slot_bytes} byte slots')
+        seq = self.latest() + 1
+        slot, data = self.slots[seq % self.n_slots], self.data[seq % self.n_slots]
+        slot['seq'] = 0
+        data[:frame.nbytes] = frame.reshape(-1).view(np.uint8)
+        slot['width'], slot['height'] = width, height
+        slot['dtype'], slot['nbytes'] = frame.dtype.str.encode(), frame.nbytes
+        slot['seq'] = seq
+        self.header['latest'] = seq
+        self.beat()
+        return seq
+
+    def read(self, retries=3):
+        """ (seq, flat frame copy, width, height) of the newest frame, None if there isn't one """
+        for _ in range(retries):
+            seq = self.latest()
+            if seq == 0: return None
+            slot, data = self.slots[seq % self.n_slots], self.data[seq % self.n_slots]
+            if int(slot['seq']) != seq: continue
+            width, height = int(slot['width']), int(slot['height'])
+            dtype, nbytes = np.dtype(slot['dtype'].item().decode()), int(slot['nbytes'])
+            frame = data[:nbytes].copy().view(dtype)
+            if int(slot['seq']) == seq: return seq, frame, width, height
+        return None
+
+    def close(self):
+        self.header = self.slots = self.data = None
+        self.shm.close()
+        if self.owner: self.shm.unlink()
+
+
+def segment_name(camera): return 'F2CUD_' + camera.replace(':', '_')
+
+def _open(camera):
+    """
+    attach to <camera>'s segment without handing it to the resource tracker,
+    which would otherwise unlink it from under the broker when a reader exits
+    """
+    try:
+        return shared_memory.SharedMemory(name=segment_name(camera), track=False)
+    except TypeError:
+        # python < 3.13 has no track argument
+        shm = shared_memory.SharedMemory(name=segment_name(camera))
+        if shm.name not in _created: resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def split_address(address):
+    """ 'CAMR:LT10:900:Image:ArrayData' -> ('CAMR:LT10:900', 'Image:ArrayData') """
+    for field in [FIELD_DATA, FIELD_WIDTH, FIELD_HEIGHT]:
+        if address.endswith(':' + field): return address[:-len(field)-1], field
+    raise ValueError(f'{address} is not a brokered camera field')
+
+def attach_live(camera):
+    """ <camera>'s ring if a live broker is serving it, otherwise None """
+    try:
+        ring = FrameRing.attach(camera)
+    except (FileNotFoundError, ValueError):
+        return None
+    if ring.alive(): return ring
+    ring.close()
+    return None
+
+def available(camera):
+    """ True if a live broker is serving <camera> """
+    ring = attach_live(camera)
+    if ring is None: return False
+    ring.close()
+    return True
+
+def address(channel):
+    """
+    shm:// address for a camera channel the broker is configured to serve,
+    otherwise <channel> as is, shm:// channels fall back to CA by themselves
+    """
+    if not channel: return channel
+    pv = channel.split('://', 1)[-1]
+    try:
+        camera, _ = split_address(pv)
+    except ValueError:
+        return channel
+    if camera in CAMERAS: return f'{PROTOCOL}://{pv}'
+    return channel
+
+
+class BrokerLink(object):
+    """
+    a reader's view of <camera>'s ring that follows its broker coming and going
+    ring() is the ring while its broker is alive, None otherwise, looking for a
+    new one at most every ATTACH_RETRY_S
+    """
+    def __init__(self, camera):
+        self.camera = camera
+        self._ring = None
+        self._next_attach = 0.0
+
+    def ring(self):
+        if self._ring is not None and not self._ring.alive(): self.close()
+        if self._ring is None and time.monotonic() >= self._next_attach:
+            self._next_attach = time.monotonic() + ATTACH_RETRY_S
+            self._ring = attach_live(self.camera)
+        return self._ring
+
+    def close(self):
+        if self._ring is not None: self._ring.close()
+        self._ring = None
+
+def use_broker(display):
+    """ point the camera channels of every image view in <display> at the broker """
+    from pydm.widgets.image import PyDMImageView
+    for view in display.findChildren(PyDMImageView):
+        image_ch, width_ch = view.imageChannel, view.widthChannel
+        if address(image_ch) != image_ch: view.imageChannel = address(image_ch)
+        if address(width_ch) != width_ch: view.widthChannel = address(width_ch)
+    return
+
+def install_plugin():
+    """ register the shm:// pydm data plugin in this process """
+    from pydm import data_plugins
+    if PROTOCOL not in data_plugins.plugin_modules:
+        data_plugins.plugin_modules[PROTOCOL] = _shm_plugin()()
+    return
+
+
+def _shm_plugin():
+    """
+    pydm plugin class for shm:// addresses, each connection polls its ring at
+    POLL_HZ while the broker is live and monitors the camera PV over CA otherwise
+    """
+    from PyQt5.QtCore import QTimer
+    from pydm.data_plugins.plugin import PyDMPlugin, PyDMConnection
+
+    class ShmConnection(PyDMConnection):
+        def __init__(self, channel, address, protocol=None, parent=None):
+            super(ShmConnection, self).__init__(channel, address, protocol, parent)
+            self.camera, self.field = split_address(address)
+            self.link = BrokerLink(self.camera)
+            self.pv = None
+            self.seq = 0
+            self.value = None
+            # not parented, the connection may be closed after Qt has torn down its children
+            self.timer = QTimer()
+            self.timer.setInterval(int(1000/POLL_HZ))
+            self.timer.timeout.connect(self.poll)
+            self.timer.start()
+            self.add_listener(channel)
+            self.poll()
+
+        def add_listener(self, channel):
+            super(ShmConnection, self).add_listener(channel)
+            self.connection_state_signal.emit(self.connected)
+            if self.value is not None: self._send(self.value)
+
+        def poll(self):
+            ring = self.link.ring()
+            if ring is None:
+                self._monitor_CA()
+                return
+            if self.pv is not None: self._stop_CA()
+            self._set_connected(ring.connected())
+            if ring.latest() == self.seq: return
+            frame = ring.read()
+            if frame is None: return
+            self.seq, data, width, height = frame
+            if self.field == FIELD_DATA:   self._send(data)
+            elif self.field == FIELD_WIDTH:  self._send(width)
+            elif self.field == FIELD_HEIGHT: self._send(height)
+
+        def _monitor_CA(self):
+            """ no live broker, read the camera PV directly until there is one """
+            if self.pv is not None: return
+            from epics import PV
+            self.seq = 0
+            self._set_connected(False)
+            self.pv = PV(f'{self.camera}:{self.field}', auto_monitor=True, form='native',
+                callback=self._on_CA_value, connection_callback=self._on_CA_connection)
+
+        def _stop_CA(self):
+            self.pv.disconnect()
+            self.pv = None
+
+        def _on_CA_value(self, value=None, **kw):
+            # CA thread, signals are queued to the widgets
+            if value is None: return
+            if self.field == FIELD_DATA: self._send(value)
+            else:                        self._send(int(value))
+
+        def _on_CA_connection(self, conn=None, **kw): self._set_connected(bool(conn))
+
+        def _set_connected(self, connected):
+            if connected == self.connected: return
+            self.connected = connected
+            self.connection_state_signal.emit(connected)
+
+        def _send(self, value):
+            if self.field != FIELD_DATA and value == self.value: return
+            self.value = value
+            if self.field == FIELD_DATA: self.new_value_signal[np.ndarray].emit(value)
+            else:                        self.new_value_signal[int].emit(value)
+
+        def close(self):
+            self.timer.stop()
+            if self.pv is not None: self._stop_CA()
+            self.link.close()
+            super(ShmConnection, self).close()
+
+    class ShmPlugin(PyDMPlugin):
+        protocol = PROTOCOL
+        connection_class = ShmConnection
+    return ShmPlugin
+
+
+def serve(cameras=CAMERAS):
+    """ subscribe to <cameras> over CA and publish every frame to its ring until killed """
+    from epics import PV
+    rings, pvs = {}, []
+    for camera in cameras:
+        ring = FrameRing.create(camera)
+        ring.set_connected(False)
+        rings[camera] = ring
+        width_pv = PV(f'{camera}:{FIELD_WIDTH}', auto_monitor=True)
+        height_pv = PV(f'{camera}:{FIELD_HEIGHT}', auto_monitor=True)
+        def _on_frame(value=None, ring=ring, width_pv=width_pv, height_pv=height_pv, **kw):
+            if value is None or width_pv.value is None: return
+            try:
+                ring.write(value, int(width_pv.value), int(height_pv.value or 0))
+            except ValueError as e:
+                print(e)
+        def _on_connection(conn=None, ring=ring, **kw): ring.set_connected(bool(conn))
+        pvs += [width_pv, height_pv, PV(
+            f'{camera}:{FIELD_DATA}', auto_monitor=True, callback=_on_frame, connection_callback=_on_connection
+            )]
+        print(f' -> brokering {camera}')
+    _run_until_killed(rings)
+
+def synthetic(camera, shape=(1000, 1340), rate=10.0, frames=None):
+    """ publish a moving gaussian spot as uint16 frames from a fake <camera> """
+    ring = FrameRing.create(camera)
+    rows, cols = np.indices(shape)
+    n = 0
+    try:
+        while frames is None or n < frames:
+            cy = shape[0]/2 + shape[0]/4*np.sin(n/20)
+            cx = shape[1]/2 + shape[1]/4*np.cos(n/20)
+            spot = 4000*np.exp(-((rows-cy)**2 + (cols-cx)**2)/(2*40.0**2))
+            frame = spot.astype(np.uint16).reshape(-1)
+            ring.write(frame, shape[1], shape[0])
+            n += 1
+            time.sleep(1/rate)
+    finally:
+        ring.close()
+
+def selftest():
+    """ write synthetic frames to a ring and check a separate reader gets them intact """
+    camera = 'F2CUD:SELFTEST:1'
+    writer = FrameRing.create(camera, n_slots=2, slot_bytes=64*64*2)
+    reader = FrameRing.attach(camera)
+    try:
+        assert reader.read() is None and available(camera)
+        for i in range(1, 6):
+            frame = np.full(64*64, i, dtype=np.uint16)
+            assert writer.write(frame, 64, 64) == i
+            seq, got, width, height = reader.read()
+            assert (seq, width, height) == (i, 64, 64)
+            assert got.dtype == np.uint16 and np.array_equal(got, frame)
+        try:
+            writer.write(np.zeros(64*64+1, dtype=np.uint16), 64, 65)
+            raise AssertionError('oversized frame was accepted')
+        except ValueError:
+            pass
+
+        # a ring whose broker stopped beating, or died, is not live
+        writer.header['heartbeat'] = time.time() - 2*STALE_S
+        assert not reader.alive() and not available(camera)
+        writer.beat()
+        dead = subprocess.Popen([sys.executable, '-c', ''])
+        dead.wait()
+        writer.header['pid'] = dead.pid
+        assert not reader.alive() and not available(camera)
+        writer.header['pid'] = getpid()
+        assert reader.alive() and available(camera)
+    finally:
+        reader.close()
+        writer.close()
+    assert not available(camera)
+    print('frame broker selftest OK')
+    return 0
+
+def _run_until_killed(rings):
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        while True:
+            time.sleep(HEARTBEAT_S)
+            for ring in rings.values(): ring.beat()
+    finally:
+        for ring in rings.values(): ring.close()
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='launcher.py --frame-broker')
+    parser.add_argument('cameras', nargs='*', default=CAMERAS, help='camera PV prefixes')
+    parser.add_argument('--synthetic', default=None, metavar='CAMERA', help='serve a fake camera instead')
+    parser.add_argument('--rate', type=float, default=10.0, help='synthetic frame rate (Hz)')
+    parser.add_argument('--selftest', action='store_true', help='check ring writes/reads and exit')
+    opts = parser.parse_args(args)
+
+    if opts.selftest: return selftest()
+    if opts.synthetic:
+        synthetic(opts.synthetic, rate=opts.rate)
+        return 0
+    serve(opts.cameras)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
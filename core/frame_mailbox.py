@@ -0,0 +1,180 @@
+# latest-frame-wins delivery from camera channels to image views
+# pydm's epics plugin compares every incoming frame with the last one and
+# queues every frame to the GUI thread, even when the view only paints at
+# 1 Hz, a FrameFeed subscribes to the camera for a view that has no image
+# channel of its own and puts frames into a single-slot mailbox from the CA
+# thread instead, the view's redraw timer takes the newest one and frames
+# replaced before they're painted are only counted
+# shm:// (frame broker) channels are read straight from the ring when painting,
+# so frames that are never shown are never copied, and from CA while the
+# camera's broker isn't live
+
+from threading import Lock
+from PyQt5.QtCore import QObject, pyqtSignal
+from core import frame_broker
+
+
+class FrameMailbox(object):
+    """ single-slot frame handoff, put() from any thread replaces an unread frame """
+    def __init__(self):
+        self._lock = Lock()
+        self._frame = None
+        self.received = 0
+        self.dropped = 0
+        self.painted = 0
+
+    def put(self, frame):
+        with self._lock:
+            if self._frame is not None: self.dropped += 1
+            self._frame = frame
+            self.received += 1
+
+    def take(self):
+        """ newest unread frame, None if there isn't one """
+        with self._lock:
+            frame, self._frame = self._frame, None
+            if frame is not None: self.painted += 1
+        return frame
+
+    def stats(self):
+        return {'received': self.received, 'dropped': self.dropped, 'painted': self.painted}
+
+
+class RingMailbox(FrameMailbox):
+    """
+    mailbox view of a frame broker ring, frames are copied out in take()
+    while the camera has no live broker, frames are put() by a CA monitor instead
+    <on_connection>(connected) follows whichever of the two is in use
+    """
+    def __init__(self, camera, on_connection):
+        super(RingMailbox, self).__init__()
+        self.camera = camera
+        self.on_connection = on_connection
+        self.link = frame_broker.BrokerLink(camera)
+        self.pv = None
+        self.seq = 0
+        self.connected = None
+
+    def take(self):
+        ring = self.link.ring()
+        if ring is None:
+            self._monitor_CA()
+            return super(RingMailbox, self).take()
+        if self.pv is not None: self._stop_CA()
+        self._set_connected(ring.connected())
+        latest = ring.latest()
+        if latest == self.seq: return None
+        frame = ring.read()
+        if frame is None: return None
+        seq, data, _, _ = frame
+        if self.seq:
+            self.received += seq - self.seq
+            self.dropped += seq - self.seq - 1
+        else:
+            self.received += 1
+        self.seq = seq
+        self.painted += 1
+        return data
+
+    def _monitor_CA(self):
+        if self.pv is not None: return
+        from epics import PV
+        self.seq = 0
+        self._set_connected(False)
+        self.pv = PV(f'{self.camera}:{frame_broker.FIELD_DATA}', auto_monitor=True, form='native',
+            callback=self._on_frame, connection_callback=self._on_CA_connection)
+
+    def _stop_CA(self):
+        self.pv.disconnect()
+        self.pv = None
+        with self._lock: self._frame = None
+
+    def _on_frame(self, value=None, **kw):
+        # CA thread, no Qt calls
+        if value is not None and getattr(value, 'size', 0): self.put(value)
+
+    def _on_CA_connection(self, conn=None, **kw): self._set_connected(bool(conn))
+
+    def _set_connected(self, connected):
+        if connected == self.connected: return
+        self.connected = connected
+        self.on_connection(connected)
+
+    def close(self):
+        if self.pv is not None: self._stop_CA()
+        self.link.close()
+
+
+class FrameFeed(QObject):
+    """
+    feeds frames from the camera channel <address> to <image_view> through a
+    mailbox, the view's own imageChannel must be left empty (pydm connects
+    channels asynchronously, so one can't reliably be taken over), its width
+    channel & everything else about the view are unchanged
+    """
+    connection_changed = pyqtSignal(bool)
+
+    def __init__(self, image_view, address, parent=None):
+        super(FrameFeed, self).__init__(parent)
+        if image_view.imageChannel:
+            raise ValueError(f'{image_view.objectName()} already has image channel {image_view.imageChannel}')
+        self.image_view = image_view
+        self.address = frame_broker.address(address)
+        self.pv = None
+        protocol, _, pv = self.address.rpartition('://')
+
+        self.connection_changed.connect(image_view.image_connection_state_changed)
+        if protocol == frame_broker.PROTOCOL:
+            self.mailbox = RingMailbox(frame_broker.split_address(pv)[0], self.connection_changed.emit)
+        else:
+            from epics import PV
+            self.mailbox = FrameMailbox()
+            self.pv = PV(pv, auto_monitor=True, form='native',
+                callback=self._on_frame, connection_callback=self._on_connection)
+
+        renderer = image_view.__dict__.get('lut_renderer')
+        image_view.redraw_timer.timeout.disconnect(renderer.redraw if renderer else image_view.redrawImage)
+        image_view.redraw_timer.timeout.connect(self.redraw)
+        image_view.frame_feed = self
+        if self.pv is not None and self.pv.connected: self.connection_changed.emit(True)
+
+    def _on_frame(self, value=None, **kw):
+        # CA thread, no Qt calls
+        if value is not None and getattr(value, 'size', 0): self.mailbox.put(value)
+
+    def _on_connection(self, pvname=None, conn=None, **kw):
+        self.connection_changed.emit(bool(conn))
+
+    def busy(self):
+        """ True while the view is still processing the last frame """
+        for owner in [self.image_view, self.image_view.__dict__.get('lut_renderer')]:
+            thread = getattr(owner, 'thread', None)
+            if thread is not None and not thread.isFinished(): return True
+        return False
+
+    def redraw(self):
+        """ redraw timer slot, hands the newest frame (if any) to the view's drawing """
+        if self.busy(): return
+        frame = self.mailbox.take()
+        if frame is None: return
+        self.image_view.image_waveform = frame
+        self.image_view.needs_redraw = True
+        renderer = self.image_view.__dict__.get('lut_renderer')
+        if renderer is not None: renderer.redraw()
+        else:                    self.image_view.redrawImage()
+
+    def stats(self):
+        """ frames received/dropped/painted since the feed started """
+        return self.mailbox.stats()
+
+    def remove(self):
+        """ stop feeding the view, it keeps the last frame it painted """
+        view = self.image_view
+        if self.pv is not None: self.pv.disconnect()
+        else:                   self.mailbox.close()
+        view.redraw_timer.timeout.disconnect(self.redraw)
+        renderer = view.__dict__.get('lut_renderer')
+        view.redraw_timer.timeout.connect(renderer.redraw if renderer else view.redrawImage)
+        self.connection_changed.disconnect(view.image_connection_state_changed)
+        del view.frame_feed
+        self.setParent(None)
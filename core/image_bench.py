@@ -0,0 +1,222 @@
+# per-frame cost of the camera image path used by the CUDs (InvertedPyDMImage)
+# frames go through process_image and the ImageItem render offscreen, with
+# tracemalloc counting what each stage allocates
+# --delivery compares CPU use of camera frames reaching views that paint slower
+# than the camera publishes, through pydm's channel path or a FrameFeed mailbox
+# --render compares pydm's per-frame levels/colormapping with LUT rendering
+# --pipeline times each stage of a core.image_pipeline pipeline on its own,
+# either the one configured for DISPLAY/WIDGET or a demo of every stage
+#
+# usage:
+#   $ python launcher.py --image-bench [--shape 1000 1340] [--frames 50]
+#   $ python launcher.py --image-bench --render [--shape 1000 1340] [--frames 50]
+#   $ python launcher.py --image-bench --delivery [--camera-hz 30] [--paint-hz 1] [--seconds 10]
+#   $ python launcher.py --image-bench --pipeline [DISPLAY WIDGET]
+
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from os import path, environ
+from threading import Thread, Event
+import numpy as np
+
+SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+sys.path.append(REPO_ROOT)
+
+
+def bench(widget, frames, legacy_flip=False):
+    """
+    push <frames> through <widget>'s process_image + ImageItem.render
+    returns mean time and bytes allocated per frame for each stage
+    <legacy_flip> adds the old numpy.flip step for comparison
+    """
+    image_item = widget.getImageItem()
+    stats = {'process_ms': 0.0, 'process_bytes': 0, 'render_ms': 0.0, 'render_bytes': 0}
+    tracemalloc.start()
+    for frame in frames:
+        tracemalloc.reset_peak()
+        t, m0 = time.perf_counter(), tracemalloc.get_traced_memory()[0]
+        img = widget.process_image(frame)
+        if legacy_flip: img = np.flip(img)
+        stats['process_ms'] += 1e3*(time.perf_counter()-t)
+        stats['process_bytes'] += tracemalloc.get_traced_memory()[1] - m0
+
+        tracemalloc.reset_peak()
+        t, m0 = time.perf_counter(), tracemalloc.get_traced_memory()[0]
+        image_item.setImage(img, autoLevels=False, levels=[0, 255], autoDownsample=False)
+        image_item.render()
+        stats['render_ms'] += 1e3*(time.perf_counter()-t)
+        stats['render_bytes'] += tracemalloc.get_traced_memory()[1] - m0
+    tracemalloc.stop()
+    return {k: v/len(frames) for k, v in stats.items()}
+
+def bench_render(widget, frames, mode):
+    """
+    mean ms per frame from processed image to rendered QImage, for <mode>:
+      'normalize': pydm normalizeData, min/max levels then pyqtgraph rescale + colormap
+      'fixed': pydm fixed colorMapMin/Max levels, pyqtgraph rescale + colormap
+      'lut': Colormap stage into an RGBA buffer, drawn with levels=None
+      'lut_minmax': 'lut' plus the min/max pydm's ImageUpdateThread takes of
+                    the RGBA frame, which LUTRenderThread skips
+    """
+    from core.image_pipeline import Colormap
+    image_item = widget.getImageItem()
+    colormap = Colormap(colors=image_item.lut, lo=0, hi=4095)
+    colormap.configure(frames[0].shape, frames[0].dtype)
+    total = 0.0
+    for frame in frames:
+        t = time.perf_counter()
+        if mode.startswith('lut'):
+            rgba = colormap.process(frame)
+            if mode == 'lut_minmax': rgba.min(), rgba.max()
+            image_item.setImage(rgba, autoLevels=False, levels=None, autoDownsample=False)
+        else:
+            levels = [frame.min(), frame.max()] if mode == 'normalize' else [0, 4095]
+            image_item.setLevels(levels)
+            image_item.setImage(frame, autoLevels=False, autoDownsample=False)
+        image_item.render()
+        total += 1e3*(time.perf_counter()-t)
+    return total/len(frames)
+
+def bench_delivery(app, mode, shape, camera_hz, paint_hz, seconds, n_views=3):
+    """
+    process CPU % while a fake camera publishes <shape> uint16 frames at
+    <camera_hz> to <n_views> views painting at <paint_hz> in <app>, for <mode>:
+      'pydm': pydm's pyepics plugin path, compare with the last frame then a
+              queued signal per frame to the view's image_value_changed
+      'mailbox': core.frame_mailbox.FrameFeed, put from the camera thread
+    frames are copied per view in the camera thread, like pyepics does
+    """
+    from PyQt5.QtCore import QObject, QTimer, QEventLoop, pyqtSignal
+    from pydm.widgets.image import PyDMImageView
+    from core.frame_mailbox import FrameFeed
+
+    class PydmRelay(QObject):
+        new_value = pyqtSignal(np.ndarray)
+        last = None
+
+        def send(self, value=None, **kw):
+            if not np.array_equal(value, self.last):
+                self.last = value
+                self.new_value.emit(value)
+
+    views, sinks, painted = [], [], [0]
+    for i in range(n_views):
+        view = PyDMImageView()
+        view.readingOrder = 1
+        view.image_width_changed(shape[1])
+        view.maxRedrawRate = paint_hz
+        if mode == 'mailbox':
+            sinks.append(FrameFeed(view, f'ca://F2CUD:BENCH:{i}:Image:ArrayData')._on_frame)
+        else:
+            relay = PydmRelay(view)
+            relay.new_value.connect(view.image_value_changed)
+            sinks.append(relay.send)
+        view.image_connection_state_changed(True)
+        view.getImageItem().sigImageChanged.connect(lambda: painted.__setitem__(0, painted[0]+1))
+        views.append(view)
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 4096, shape[0]*shape[1], dtype=np.uint16) for _ in range(4)]
+    stop = Event()
+    def publish():
+        n = 0
+        while not stop.wait(1/camera_hz):
+            for sink in sinks: sink(value=frames[n % len(frames)].copy())
+            n += 1
+
+    camera = Thread(target=publish, daemon=True)
+    loop = QEventLoop()
+    QTimer.singleShot(int(1e3*seconds), loop.quit)
+    t, cpu = time.perf_counter(), time.process_time()
+    camera.start()
+    loop.exec_()
+    stop.set()
+    camera.join()
+    cpu_pct = 100*(time.process_time()-cpu)/(time.perf_counter()-t)
+    for view in views: view.close()
+    app.processEvents()
+    return {'cpu_pct': cpu_pct, 'painted': painted[0]}
+
+# every stage on a uint16 frame, for --pipeline without a configured one
+DEMO_PIPELINE = [
+    {'stage': 'orient', 'flip_x': True},
+    {'stage': 'crop', 'x0': 100, 'x1': -100, 'y0': 100, 'y1': -100},
+    {'stage': 'background'},
+    {'stage': 'bin', 'factor': 2},
+    {'stage': 'projections'},
+    {'stage': 'levels', 'lo': 0, 'hi': 4095},
+    ]
+
+def bench_pipeline(spec, shape, n_frames):
+    """ per-stage timing of the pipeline built from <spec> on uint16 frames """
+    from core.image_pipeline import Pipeline
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 4096, shape, dtype=np.uint16) for _ in range(4)]
+    frames = [frames[i % len(frames)] for i in range(n_frames)]
+    return Pipeline.from_spec(spec).bench(frames)
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='launcher.py --image-bench')
+    parser.add_argument('--shape', type=int, nargs=2, default=[1000, 1340], help='frame rows, cols')
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--render', action='store_true', help='compare per-frame rendering modes')
+    parser.add_argument('--delivery', action='store_true', help='compare frame delivery CPU use')
+    parser.add_argument('--camera-hz', type=float, default=30.0)
+    parser.add_argument('--paint-hz', type=int, default=1)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--pipeline', nargs='*', default=None, metavar='DISPLAY WIDGET',
+        help='time each stage of the pipeline configured for DISPLAY WIDGET (default: demo)')
+    opts = parser.parse_args(args)
+
+    if opts.pipeline is not None:
+        from core.image_pipeline import CONFIG
+        spec = DEMO_PIPELINE
+        if opts.pipeline:
+            if len(opts.pipeline) != 2: parser.error('--pipeline takes DISPLAY WIDGET')
+            spec = CONFIG[opts.pipeline[0]][opts.pipeline[1]]
+        results = {'shape': opts.shape, 'stages': bench_pipeline(spec, opts.shape, opts.frames)}
+        print(json.dumps(results, indent=2))
+        return 0
+
+    environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    from widgets.InvertedPyDMImage import InvertedPyDMImage
+    app = QApplication.instance() or QApplication([])
+
+    if opts.delivery:
+        results = {'shape': opts.shape, 'camera_hz': opts.camera_hz, 'paint_hz': opts.paint_hz}
+        for mode in ['pydm', 'mailbox']:
+            results[mode] = bench_delivery(app, mode, opts.shape, opts.camera_hz, opts.paint_hz, opts.seconds)
+        print(json.dumps(results, indent=2))
+        return 0
+
+    rng = np.random.default_rng(0)
+    if opts.render:
+        frames = [rng.integers(0, 4096, opts.shape, dtype=np.uint16) for _ in range(4)]
+        frames = [frames[i % len(frames)] for i in range(opts.frames)]
+        widget = InvertedPyDMImage(im_ch=None, w_ch=None)
+        widget.resize(400, 300)
+        results = {'shape': opts.shape, 'dtype': 'uint16'}
+        for mode in ['normalize', 'fixed', 'lut', 'lut_minmax']: results[f'{mode}_ms'] = bench_render(widget, frames, mode)
+        print(json.dumps(results, indent=2))
+        return 0
+
+    frames = [rng.integers(0, 255, opts.shape, dtype=np.uint8) for _ in range(4)]
+    frames = [frames[i % len(frames)] for i in range(opts.frames)]
+
+    widget = InvertedPyDMImage(im_ch=None, w_ch=None)
+    widget.resize(400, 300)
+    results = {
+        'shape': opts.shape,
+        'numpy.flip': bench(widget, frames, legacy_flip=True),
+        'view flip': bench(widget, frames),
+        }
+    print(json.dumps(results, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
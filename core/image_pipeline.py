@@ -0,0 +1,399 @@
+# composable processing for CUD camera images
+# a Pipeline is a list of stages run on every frame an image widget draws, in
+# the ImageUpdateThread pydm already uses for process_image (LUTRenderThread
+# for pipelines ending in a colormap)
+# stages allocate their output buffers once per input shape/dtype and write
+# into them in place, orientation & crop are numpy views and never copy
+#
+# images are the arrays pydm hands to process_image, which it draws row-major:
+# axis 0 is y (rows), axis 1 is x (columns)
+#
+# pipelines can be built in python:
+#   Pipeline([Crop(x0=100, x1=600), Bin(2), Background(), Levels(0, 4095)])
+#   Pipeline([Colormap(auto_levels=True)])   (LUT rendering, see core/image_render.py)
+# or per display/widget from the image_pipelines section of config.yaml:
+#   F2_CUD_S20:
+#     live_DTOTR2:
+#       - {stage: bin, factor: 2}
+#       - {stage: levels, lo: 0, hi: 4095}
+
+import time
+import tracemalloc
+import numpy as np
+from core import common
+
+CONFIG = common.CONFIG.get('image_pipelines') or {}
+
+# output buffers per stage, the widget may still be drawing the previous frame
+# while the next one is processed
+N_BUFFERS = 2
+
+
+class Stage(object):
+    """ one pipeline step, subclasses implement configure & process """
+    name = None
+
+    def configure(self, shape, dtype):
+        """ allocate for <shape>/<dtype> input, returns the output (shape, dtype) """
+        return shape, dtype
+
+    def process(self, image):
+        return image
+
+    def _allocate(self, shape, dtype):
+        self._buffers = [np.empty(shape, dtype=dtype) for _ in range(N_BUFFERS)]
+        self._i_buffer = 0
+
+    def _next_buffer(self):
+        self._i_buffer = (self._i_buffer + 1) % N_BUFFERS
+        return self._buffers[self._i_buffer]
+
+    def __repr__(self):
+        params = ', '.join(f'{k}={v!r}' for k, v in vars(self).items() if not k.startswith('_'))
+        return f'{type(self).__name__}({params})'
+
+
+class Orient(Stage):
+    """ transpose and/or flip the image axes, no copy """
+    name = 'orient'
+
+    def __init__(self, transpose=False, flip_x=False, flip_y=False):
+        self.transpose = transpose
+        self.flip_x = flip_x
+        self.flip_y = flip_y
+
+    def configure(self, shape, dtype):
+        return (shape[::-1] if self.transpose else shape), dtype
+
+    def process(self, image):
+        if self.transpose: image = image.T
+        return image[::-1 if self.flip_y else 1, ::-1 if self.flip_x else 1]
+
+
+class Crop(Stage):
+    """ keep x0 <= x < x1, y0 <= y < y1, no copy """
+    name = 'crop'
+
+    def __init__(self, x0=0, x1=None, y0=0, y1=None):
+        self.x0, self.x1 = x0, x1
+        self.y0, self.y1 = y0, y1
+
+    def configure(self, shape, dtype):
+        self._slices = (slice(self.y0, self.y1), slice(self.x0, self.x1))
+        out_shape = tuple(len(range(*s.indices(n))) for s, n in zip(self._slices, shape))
+        if 0 in out_shape: raise ValueError(f'{self} is outside the {shape} image')
+        return out_shape, dtype
+
+    def process(self, image):
+        return image[self._slices]
+
+
+class Bin(Stage):
+    """ sum <factor> x <factor> pixel blocks, trailing pixels are dropped """
+    name = 'bin'
+
+    def __init__(self, factor=2):
+        self.factor = factor
+
+    def configure(self, shape, dtype):
+        f = self.factor
+        self._shape = (shape[0]//f, shape[1]//f)
+        out_dtype = np.float32 if np.issubdtype(dtype, np.floating) else np.uint32
+        self._allocate(self._shape, out_dtype)
+        return self._shape, np.dtype(out_dtype)
+
+    def process(self, image):
+        f, (ny, nx) = self.factor, self._shape
+        out = self._next_buffer()
+        out[...] = 0
+        for i in range(f):
+            for j in range(f):
+                np.add(out, image[i:ny*f:f, j:nx*f:f], out=out, casting='unsafe')
+        return out
+
+
+class Background(Stage):
+    """
+    subtract a background frame, negative pixels are clipped to 0
+    capture(n) averages the next <n> frames into the background
+    """
+    name = 'background'
+
+    def __init__(self, background=None):
+        self.background = background
+        self._capture = 0
+
+    def capture(self, n_frames=10):
+        self._n_captured = 0
+        self._capture = n_frames
+
+    def configure(self, shape, dtype):
+        self._allocate(shape, np.float32)
+        if self.background is not None and np.shape(self.background) != shape:
+            print(f'background {np.shape(self.background)} does not match {shape} frames, dropped')
+            self.background = None
+        self._sum = np.zeros(shape, dtype=np.float64)
+        return shape, np.dtype(np.float32)
+
+    def process(self, image):
+        out = self._next_buffer()
+        if self._capture:
+            if self._n_captured == 0: self._sum[...] = 0
+            np.add(self._sum, image, out=self._sum)
+            self._n_captured += 1
+            if self._n_captured == self._capture:
+                self.background = (self._sum / self._n_captured).astype(np.float32)
+                self._capture = 0
+        if self.background is None:
+            out[...] = image
+            return out
+        np.subtract(image, self.background, out=out)
+        np.maximum(out, 0, out=out)
+        return out
+
+
+class Projections(Stage):
+    """
+    x/y projections and intensity-weighted centroid of each frame
+    the image passes through unchanged, results are left in px, py & centroid
+    """
+    name = 'projections'
+
+    def __init__(self):
+        self.px = self.py = None
+        self.centroid = None
+
+    def configure(self, shape, dtype):
+        self.px = np.zeros(shape[1], dtype=np.float64)
+        self.py = np.zeros(shape[0], dtype=np.float64)
+        self._x = np.arange(shape[1], dtype=np.float64)
+        self._y = np.arange(shape[0], dtype=np.float64)
+        return shape, dtype
+
+    def process(self, image):
+        np.sum(image, axis=0, dtype=np.float64, out=self.px)
+        np.sum(image, axis=1, dtype=np.float64, out=self.py)
+        total = self.px.sum()
+        if total > 0:
+            self.centroid = (np.dot(self.px, self._x)/total, np.dot(self.py, self._y)/total)
+        return image
+
+
+class Levels(Stage):
+    """
+    map [lo, hi] to 0-255 uint8 at fixed levels, integer frames go through a
+    lookup table, draw the output with colormap levels 0-255
+    """
+    name = 'levels'
+
+    def __init__(self, lo=0, hi=255):
+        self.lo, self.hi = lo, hi
+        self._lut = None
+
+    def set_levels(self, lo, hi):
+        self.lo, self.hi = lo, hi
+        if self._lut is not None: self._lut = self._make_lut(len(self._lut))
+
+    def _make_lut(self, n):
+        scale = 255.0/max(self.hi - self.lo, 1e-12)
+        return np.clip((np.arange(n) - self.lo)*scale, 0, 255).astype(np.uint8)
+
+    def configure(self, shape, dtype):
+        self._allocate(shape, np.uint8)
+        self._lut, self._scratch = None, None
+        if dtype.kind == 'u' and dtype.itemsize <= 2:
+            self._lut = self._make_lut(2**(8*dtype.itemsize))
+        else:
+            self._scratch = np.empty(shape, dtype=np.float32)
+        return shape, np.dtype(np.uint8)
+
+    def process(self, image):
+        out = self._next_buffer()
+        if self._lut is not None:
+            np.take(self._lut, image, out=out, mode='clip')
+            return out
+        np.subtract(image, self.lo, out=self._scratch, casting='unsafe')
+        np.multiply(self._scratch, 255.0/max(self.hi - self.lo, 1e-12), out=self._scratch)
+        np.clip(self._scratch, 0, 255, out=self._scratch)
+        out[...] = self._scratch
+        return out
+
+
+class Colormap(Stage):
+    """
+    map frames to RGBA through one precomputed levels + colormap LUT
+    uint8/uint16 frames are a single gather per pixel, other dtypes are first
+    scaled to 16-bit indices, the LUT is only rebuilt when levels or colors change
+    with <auto_levels>, levels come from the <quantiles> of a histogram of
+    every <subsample>th pixel, recomputed at most every <level_interval> s
+    output is C-contiguous (y, x, 4) uint8, so a row-major ImageItem wraps it
+    in a QImage without converting or copying it (draw with levels=None)
+    """
+    name = 'colormap'
+    N_BUFFERS = 3
+
+    def __init__(self, colors=None, lo=None, hi=None, auto_levels=False,
+                 quantiles=(0.001, 0.999), subsample=8, level_interval=1.0):
+        self.colors = None
+        self.lo, self.hi = lo, hi
+        self.auto_levels = auto_levels
+        self.quantiles = tuple(quantiles)
+        self.subsample = subsample
+        self.level_interval = level_interval
+        self._lut = None
+        self._levels_t = None
+        self.set_colors(colors)
+
+    def set_colors(self, colors):
+        """ (N, 3|4) uint8 colors, low to high, None for grayscale """
+        if colors is None: colors = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+        colors = np.asarray(colors, dtype=np.uint8)
+        if colors.shape[1] == 3:
+            colors = np.column_stack([colors, np.full(len(colors), 255, dtype=np.uint8)])
+        self.colors = np.ascontiguousarray(colors)
+        self._lut_dirty = True
+
+    def set_levels(self, lo, hi):
+        """ fixed levels, turns auto_levels off """
+        self.auto_levels = False
+        self.lo, self.hi = lo, hi
+        self._lut_dirty = True
+
+    def configure(self, shape, dtype):
+        self._integer = dtype.kind == 'u' and dtype.itemsize <= 2
+        self._n_lut = 2**(8*dtype.itemsize) if self._integer else 2**16
+        if not self._integer:
+            self._scratch = np.empty(shape, dtype=np.float32)
+            self._index = np.empty(shape, dtype=np.uint16)
+        # one uint32 per pixel, handed out as RGBA byte views
+        self._buffers = [np.empty(shape, dtype=np.uint32) for _ in range(self.N_BUFFERS)]
+        self._outputs = [b.view(np.uint8).reshape(shape[0], shape[1], 4) for b in self._buffers]
+        self._i_buffer = 0
+        self._levels_t = None
+        if self.lo is None or self.hi is None:
+            self.lo, self.hi = (0, self._n_lut - 1) if self._integer else (0.0, 1.0)
+        self._lut_dirty = True
+        return (shape[0], shape[1], 4), np.dtype(np.uint8)
+
+    def _update_levels(self, image):
+        now = time.monotonic()
+        if self._levels_t is not None and now - self._levels_t < self.level_interval: return
+        self._levels_t = now
+        sample = image[::self.subsample, ::self.subsample]
+        if self._integer:
+            cdf = np.cumsum(np.bincount(sample.ravel(), minlength=2))
+            lo, hi = np.searchsorted(cdf, [q*cdf[-1] for q in self.quantiles])
+        else:
+            lo, hi = np.quantile(sample, self.quantiles)
+        if hi <= lo: hi = lo + 1
+        if (lo, hi) != (self.lo, self.hi):
+            self.lo, self.hi = lo, hi
+            self._lut_dirty = True
+
+    def _build_lut(self):
+        colors = self.colors.view(np.uint32).ravel()
+        n_colors = len(colors)
+        if self._integer:
+            scale = n_colors/max(self.hi - self.lo, 1e-12)
+            index = np.clip((np.arange(self._n_lut) - self.lo)*scale, 0, n_colors - 1)
+        else:
+            # levels are applied while scaling to 16-bit indices
+            index = np.arange(self._n_lut)*(n_colors/self._n_lut)
+        self._lut = colors[index.astype(np.intp)]
+        self._lut_dirty = False
+
+    def process(self, image):
+        if self.auto_levels: self._update_levels(image)
+        if self._lut_dirty: self._build_lut()
+        if not self._integer:
+            np.subtract(image, self.lo, out=self._scratch, casting='unsafe')
+            np.multiply(self._scratch, (self._n_lut - 1)/max(self.hi - self.lo, 1e-12), out=self._scratch)
+            np.clip(self._scratch, 0, self._n_lut - 1, out=self._scratch)
+            self._index[...] = self._scratch
+            image = self._index
+        self._i_buffer = (self._i_buffer + 1) % self.N_BUFFERS
+        np.take(self._lut, image, out=self._buffers[self._i_buffer], mode='clip')
+        return self._outputs[self._i_buffer]
+
+
+STAGES = {stage.name: stage for stage in [Orient, Crop, Bin, Background, Projections, Levels, Colormap]}
+
+
+class Pipeline(object):
+    """
+    runs <stages> in order on each frame, reconfiguring when the frame shape
+    or dtype changes, callable so it can stand in for process_image
+    """
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+        self._input = None
+
+    @classmethod
+    def from_spec(cls, spec):
+        """ build from a list of {stage: <name>, <kwarg>: <value>, ...} dicts """
+        stages = []
+        for params in spec:
+            params = dict(params)
+            stages.append(STAGES[params.pop('stage')](**params))
+        return cls(stages)
+
+    def stage(self, name):
+        """ first stage called <name>, e.g. to read projections or set levels """
+        for stage in self.stages:
+            if stage.name == name: return stage
+        return None
+
+    def configure(self, shape, dtype):
+        self._input = (shape, dtype)
+        for stage in self.stages: shape, dtype = stage.configure(shape, dtype)
+
+    def __call__(self, image):
+        if (image.shape, image.dtype) != self._input: self.configure(image.shape, image.dtype)
+        for stage in self.stages: image = stage.process(image)
+        return image
+
+    def bench(self, frames):
+        """ mean ms and bytes allocated per frame for each stage over <frames> """
+        self.configure(frames[0].shape, frames[0].dtype)
+        stats = [[stage.name, 0.0, 0] for stage in self.stages]
+        tracemalloc.start()
+        for frame in frames:
+            image = frame
+            for stage, stat in zip(self.stages, stats):
+                tracemalloc.reset_peak()
+                t, m0 = time.perf_counter(), tracemalloc.get_traced_memory()[0]
+                image = stage.process(image)
+                stat[1] += 1e3*(time.perf_counter()-t)
+                stat[2] += tracemalloc.get_traced_memory()[1] - m0
+        tracemalloc.stop()
+        n = len(frames)
+        return [{'stage': name, 'ms': ms/n, 'bytes': nbytes/n} for name, ms, nbytes in stats]
+
+
+def from_config(display, widget_name):
+    """ Pipeline configured for <display>'s <widget_name> image, None if there isn't one """
+    spec = CONFIG.get(type(display).__name__, {}).get(widget_name)
+    if not spec: return None
+    return Pipeline.from_spec(spec)
+
+def attach(image_view, pipeline):
+    """
+    run <pipeline> as <image_view>'s process_image, None restores the default
+    a pipeline with a colormap stage also takes over drawing (see core/image_render.py)
+    """
+    renderer = image_view.__dict__.pop('lut_renderer', None)
+    if renderer is not None: renderer.remove()
+    if pipeline is None:
+        image_view.__dict__.pop('process_image', None)
+        return
+    image_view.process_image = pipeline
+    if pipeline.stage('colormap') is not None:
+        from core.image_render import LUTRenderer
+        image_view.lut_renderer = LUTRenderer(image_view, pipeline)
+
+def attach_configured(display):
+    """ attach config.yaml pipelines to the image views built from <display>'s .ui """
+    from pydm.widgets.image import PyDMImageView
+    for view in display.findChildren(PyDMImageView):
+        pipeline = from_config(display, view.objectName())
+        if pipeline is not None: attach(view, pipeline)
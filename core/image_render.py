@@ -0,0 +1,100 @@
+# LUT rendering for pydm image views
+# the view's pipeline ends in an image_pipeline.Colormap stage that maps each
+# frame to RGBA at fixed (or low-rate histogram) levels, frames are handed to
+# the ImageItem with levels=None so pyqtgraph wraps them in a QImage as-is,
+# instead of pydm's per-frame min/max + pyqtgraph's rescale & colormap passes
+# frames are processed in LUTRenderThread rather than pydm's ImageUpdateThread,
+# which (depending on the pydm version) takes min/max of the processed image
+# even when nothing uses them, a full pass over every RGBA frame
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+
+
+class LUTRenderThread(QThread):
+    """
+    one frame of <image_view>: reshapes image_waveform the way pydm does and
+    runs process_image, the result goes out on frameReady, no levels are taken
+    """
+    frameReady = pyqtSignal(object)
+
+    def __init__(self, image_view):
+        super(LUTRenderThread, self).__init__()
+        self.image_view = image_view
+
+    def run(self):
+        view = self.image_view
+        img = view.image_waveform
+        if not view.needs_redraw or img is None: return
+        if img.ndim == 1:
+            width = view.imageWidth
+            if width < 1: return
+            try:
+                if view.readingOrder == view.ReadingOrder.Clike: img = img.reshape((-1, width), order='C')
+                else:                                            img = img.reshape((width, -1), order='F')
+            except ValueError:
+                print(f'invalid width {width} for {img.size} pixel image')
+                return
+        if not len(img): return
+        self.frameReady.emit(view.process_image(img))
+        view.needs_redraw = False
+
+
+class LUTRenderer(QObject):
+    """
+    draws <image_view>'s frames through the Colormap stage of <pipeline>
+    colors follow the view's colormap, levels are the view's colorMapMin/Max
+    unless the stage sets its own, and normalizeData switches to histogram levels
+    """
+    def __init__(self, image_view, pipeline):
+        super(LUTRenderer, self).__init__(image_view)
+        self.image_view = image_view
+        self.pipeline = pipeline
+        self.colormap = pipeline.stage('colormap')
+        self.thread = None
+
+        if image_view.normalizeData:
+            # pydm would take min/max of every RGBA frame, levels come from the stage instead
+            self.colormap.auto_levels = True
+            image_view.normalizeData = False
+        elif self.colormap.lo is None and not self.colormap.auto_levels:
+            self.colormap.set_levels(image_view.cm_min, image_view.cm_max)
+        self._lut = None
+        self.update_colors()
+
+        # a frame feed (core/frame_mailbox.py) owns the redraw timer and calls redraw itself
+        if not self._fed():
+            image_view.redraw_timer.timeout.disconnect(image_view.redrawImage)
+            image_view.redraw_timer.timeout.connect(self.redraw)
+
+    def _fed(self): return 'frame_feed' in self.image_view.__dict__
+
+    def remove(self):
+        """ hand drawing back to the view """
+        if not self._fed():
+            self.image_view.redraw_timer.timeout.disconnect(self.redraw)
+            self.image_view.redraw_timer.timeout.connect(self.image_view.redrawImage)
+        self.setParent(None)
+
+    def update_colors(self):
+        """ pick up the view's colormap if it changed since the last frame """
+        lut = self.image_view.getImageItem().lut
+        if lut is self._lut: return
+        self._lut = lut
+        self.colormap.set_colors(lut if lut is not None and not callable(lut) else None)
+
+    def redraw(self):
+        """ same as PyDMImageView.redrawImage, but in a LUTRenderThread """
+        if self.thread is not None and not self.thread.isFinished(): return
+        self.update_colors()
+        self.thread = LUTRenderThread(self.image_view)
+        self.thread.frameReady.connect(self.show_frame)
+        self.thread.start()
+
+    @pyqtSlot(object)
+    def show_frame(self, rgba):
+        image_item = self.image_view.getImageItem()
+        image_item.setImage(
+            rgba, autoLevels=False, levels=None, autoDownsample=self.image_view.autoDownsample
+            )
+        # levels set before the item's first image are applied after it
+        if image_item.levels is not None: image_item.setLevels(None)
@@ -0,0 +1,110 @@
+# worker-pool job queue for the CUD manager
+# runs blocking remote-control actions off the GUI thread, with status lines
+# and completion delivered back to the GUI thread through Qt signals
+
+from threading import Event
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class _JobSignals(QObject):
+    status = pyqtSignal(str)
+    finished = pyqtSignal(object, object)
+
+
+class Job(QRunnable):
+    """
+    one unit of work, func(job, *args) runs on a pool thread
+    func can report progress with job.status(msg) and should call
+    job.check_cancelled() between steps, its return value ends up in job.result
+    """
+    def __init__(self, name, func, *args, monitors=(), then=None):
+        super(Job, self).__init__()
+        self.setAutoDelete(False)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.monitors = list(monitors)
+        self.then = then
+        self.result = None
+        self.signals = _JobSignals()
+        self._cancelled = Event()
+
+    def cancel(self): self._cancelled.set()
+
+    def cancelled(self): return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled(): raise JobCancelled(f'{self.name} cancelled')
+
+    def status(self, msg): self.signals.status.emit(msg)
+
+    def run(self):
+        error = None
+        try:
+            self.check_cancelled()
+            self.result = self.func(self, *self.args)
+        except Exception as e:
+            error = e
+        self.signals.finished.emit(self, error)
+
+
+class JobQueue(QObject):
+    """
+    bounded pool of Jobs, signals are emitted on the thread that owns the queue
+    job_started/job_finished let the caller lock and unlock the affected widgets
+    """
+    status = pyqtSignal(str)
+    job_started = pyqtSignal(object)
+    job_finished = pyqtSignal(object, object)
+
+    def __init__(self, max_workers, parent=None):
+        super(JobQueue, self).__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.active = []
+
+    def submit(self, name, func, *args, monitors=(), then=None):
+        """ queue func(job, *args), <then>(job, error) runs on this thread when it's done """
+        job = Job(name, func, *args, monitors=monitors, then=then)
+        job.signals.status.connect(self.status)
+        job.signals.finished.connect(self._on_finished)
+        self.active.append(job)
+        self.job_started.emit(job)
+        self.pool.start(job)
+        return job
+
+    def submit_batch(self, jobs, then=None):
+        """
+        queue several (name, func, args, monitors) jobs, <then>(errors) runs once
+        all of them are done, errors is {job name: error or None}
+        """
+        if not jobs:
+            if then is not None: then({})
+            return []
+        errors = {}
+        def _collect(job, error):
+            errors[job.name] = error
+            if len(errors) == len(jobs) and then is not None: then(errors)
+        return [
+            self.submit(name, func, *args, monitors=monitors, then=_collect)
+            for name, func, args, monitors in jobs
+            ]
+
+    def busy_monitors(self):
+        return {m for job in self.active for m in job.monitors}
+
+    def cancel_all(self):
+        """ drop queued jobs and ask running ones to stop at their next check """
+        for job in list(self.active):
+            job.cancel()
+            if self.pool.tryTake(job): job.signals.finished.emit(job, JobCancelled(f'{job.name} cancelled'))
+        return
+
+    def _on_finished(self, job, error):
+        if job in self.active: self.active.remove(job)
+        self.job_finished.emit(job, error)
+        if job.then is not None: job.then(job, error)
@@ -6,13 +6,19 @@ from os import path
 from subprocess import Popen
 import shlex
 import yaml
+from core import zygote
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 with open(path.join(REPO_ROOT, 'core', 'config.yaml'), 'r') as f:
     CONFIG = yaml.safe_load(f)
 
-COMMAND_PYDM_LAUNCH = f'pydm --hide-nav-bar --hide-menu-bar --hide-status-bar {REPO_ROOT}/{{}}'
+# .ui-only CUDs are wrapped in a display that can use the precompiled ui cache
+UI_DISPLAY = 'core/ui_display.py'
+
+# runs one or more pydm CUDs inside one python/Qt process, see host_CUDs
+# plain launches go through it too, so every CUD process gets set up by load_CUD
+COMMAND_HOST_LAUNCH = f'{sys.executable} {REPO_ROOT}/launcher.py --host {{}}'
 
 # oh god this is disgusting get rid of this once fphysics@facet-srv02 works
 TMP_MACROS = "accel_type=FACET, IOC_PREFIX=IOC:SYS1:MP01, configDB_Prefix=/usr/local/facet/epics/iocTop/MpsConfiguration-FACET/current/database/, logicDB_Prefix=/usr/local/facet/epics/iocTop/MpsConfiguration-FACET/current/algorithm/, RECENT_DB_FILE=gui/dbinteraction/recentStatesDB/recent_states_facet.sqlite, CUD=SUMMARY"
@@ -27,14 +33,100 @@ ALT_LAUNCH_COMMANDS = {
 }
 
 
-def run_CUD(CUD_ID):
+def run_CUD(CUD_ID, env=None):
+    """
+    launch <CUD_ID> in a new process
+    <env> is the environment for the new process (e.g. a different $DISPLAY),
+    defaults to this process's environment
+    """
     if CUD_ID in CONFIG['CUD_IDs'] and (CUD_ID not in ALT_LAUNCH_COMMANDS.keys()):
-        return _run_pydm_CUD(CUD_ID)
+        # fork from the zygote if one is running, otherwise start a new pydm
+        # a zygote that is listening but doesn't answer is an error, not a fallback
+        try:
+            return zygote.request_launch(CUD_ID, env=env)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return _run_pydm_CUD(CUD_ID, env=env)
     
     # special cases go here :) there better not be many >:(
-    else: return Popen(ALT_LAUNCH_COMMANDS[CUD_ID], shell=True)
+    else: return Popen(ALT_LAUNCH_COMMANDS[CUD_ID], shell=True, env=env)
+
+def run_CUD_host(CUD_IDs):
+    """
+    spawn a single host process running all of <CUD_IDs> as separate windows
+    displays in ALT_LAUNCH_COMMANDS can't be hosted and get their own process
+    returns a list of all spawned processes, host process first
+    """
+    for CUD_ID in CUD_IDs:
+        if CUD_ID not in CONFIG['CUD_IDs'] and CUD_ID not in ALT_LAUNCH_COMMANDS:
+            raise KeyError(f'invalid CUD name: {CUD_ID}')
+    hosted = [CUD_ID for CUD_ID in CUD_IDs if is_hostable(CUD_ID)]
+    procs = []
+    if hosted:
+        args = shlex.split(COMMAND_HOST_LAUNCH.format(' '.join(hosted)))
+        procs.append(Popen(args, shell=False))
+    for CUD_ID in CUD_IDs:
+        if CUD_ID not in hosted: procs.append(run_CUD(CUD_ID))
+    return procs
+
+def is_hostable(CUD_ID):
+    """ only pydm displays that live in this repo can share a host process """
+    return CUD_ID in CONFIG['CUD_IDs'] and (CUD_ID not in ALT_LAUNCH_COMMANDS.keys())
+
+def host_CUDs(CUD_IDs):
+    """
+    run each of <CUD_IDs> as a top-level window of one PyDMApplication
+    pydm data plugins are per-process singletons, so any PV used by more than
+    one hosted display is only connected once
+    blocks until the last window is closed, returns the app exit code
+    """
+    for CUD_ID in CUD_IDs:
+        if not is_hostable(CUD_ID): raise KeyError(f'{CUD_ID} cannot be hosted')
+
+    # heavy imports are deferred so plain launches don't pay for them
+    from pydm import PyDMApplication
+
+    app = PyDMApplication(
+        hide_nav_bar=True, hide_menu_bar=True, hide_status_bar=True
+        )
+    # keep references to the displays, otherwise they get garbage collected
+    app.CUD_displays = []
+    for CUD_ID in CUD_IDs:
+        display = load_CUD(CUD_ID)
+        display.show()
+        app.CUD_displays.append(display)
+    return app.exec_()
+
+def load_CUD(CUD_ID):
+    """
+    build the pydm Display for <CUD_ID> in the current process
+    the display's widgets are set up for this host (frame broker, image pipelines)
+    and the process starts reporting telemetry to the CUD manager
+    """
+    from pydm.display import load_py_file
+    from core import frame_broker, image_pipeline, telemetry
+
+    if sys.path.count(REPO_ROOT) == 0: sys.path.append(REPO_ROOT)
+    target = CONFIG[CUD_ID]['pydm']
+
+    # shm:// channels have to resolve while the display's widgets are built
+    frame_broker.install_plugin()
+    if target.endswith('.ui'):
+        display = load_py_file(path.join(REPO_ROOT, UI_DISPLAY), args=[target])
+    else:
+        display = load_py_file(path.join(REPO_ROOT, target))
+
+    # read cameras from the local frame broker when it's serving them, and
+    # attach the image pipelines configured for the display's .ui image views
+    frame_broker.use_broker(display)
+    image_pipeline.attach_configured(display)
+    telemetry.install_hook()
+
+    # .ui-only displays don't set their own window title
+    if not display.windowTitle():
+        display.setWindowTitle(f'FACET-II CUD: {CONFIG[CUD_ID]["desc"]}')
+    return display
 
-def _run_pydm_CUD(CUD_ID):
+def _run_pydm_CUD(CUD_ID, env=None):
     if CUD_ID not in CONFIG['CUD_IDs']: raise KeyError("Invalid CUD name provided")
-    args = shlex.split(COMMAND_PYDM_LAUNCH.format(CONFIG[CUD_ID]['pydm']))
-    return Popen(args, shell=False)
+    args = shlex.split(COMMAND_HOST_LAUNCH.format(CUD_ID))
+    return Popen(args, shell=False, env=env)
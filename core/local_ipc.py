@@ -0,0 +1,34 @@
+# tiny JSON-lines request/reply protocol over local unix sockets
+# shared by the zygote and the CUD supervisor daemons
+
+import json
+import socket
+from os import environ, getuid
+
+
+def socket_path(name):
+    """ per-user socket path for daemon <name>, $F2_CUD_<NAME> overrides it """
+    return environ.get(f'F2_CUD_{name.upper()}', f'/tmp/F2-CUDs-{name}-{getuid()}.sock')
+
+def request(sock_path, msg, timeout=5.0):
+    """
+    send one request and wait for its reply
+    raises OSError if nothing is listening on <sock_path>
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(sock_path)
+        send(s, msg)
+        return json.loads(recv_line(s))
+
+def send(conn, msg):
+    conn.sendall((json.dumps(msg)+'\n').encode('utf-8'))
+
+def recv_line(conn):
+    """ read one newline-terminated message from a socket """
+    buf = b''
+    while not buf.endswith(b'\n'):
+        chunk = conn.recv(4096)
+        if not chunk: break
+        buf = buf + chunk
+    return buf.decode('utf-8')
@@ -0,0 +1,177 @@
+# array-backed live orbit for OrbitView
+# BPM monitor callbacks write straight into NumPy columns (z, x, y, tmit and
+# per-axis severity), views, reference differences and RMS use whole-array ops
+
+from functools import partial
+import numpy as np
+
+AXES = ['x', 'y', 'tmit']
+
+# BPM PVs are <name>:<AXIS><suffix>, e.g. BPMS:IN10:221:XTH (EPICS BSA edef)
+# or BPMS:LI20:2050:X57 (SCP buffered)
+PV_FMT = '{name}:{axis}{suffix}'
+
+# alarm severity used until a BPM's first update
+SEVR_INVALID = 3
+
+# default number of saved shots for rms()
+RMS_WINDOW = 120
+
+
+class OrbitColumns(object):
+    """
+    live orbit as contiguous per-BPM columns, indexed by BPM name
+    every monitor update bumps <generation>, so readers can tell if anything changed
+    """
+    def __init__(self, names, z, is_energy_bpm=None, suffixes=None, name=None, sector_locations=None, rms_window=RMS_WINDOW):
+        self.name = name
+        self._names = list(names)
+        self.index = {bpm_name: i for i, bpm_name in enumerate(self._names)}
+        n = len(self._names)
+        self.z = np.asarray(z, dtype=float)
+        self.is_energy_bpm = np.zeros(n, dtype=bool) if is_energy_bpm is None else np.asarray(is_energy_bpm, dtype=bool)
+        self.suffixes = list(suffixes) if suffixes is not None else ['']*n
+        self.columns = {axis: np.full(n, np.nan) for axis in AXES}
+        self.sevr = {axis: np.full(n, SEVR_INVALID, dtype=np.int8) for axis in AXES}
+        self.reference = None
+        self.generation = 0
+        # orbit-package style fit {'zs', 'xpos', 'ypos'} set by a caller that fits the orbit
+        # itself, only drawn with core/orbit_fit.py's package_fit
+        self.fit_data = None
+        # orbit-package orbit these columns were built from, if any
+        self.source = None
+        self._sector_locations = sector_locations
+        self._rms = {axis: RunningRMS(rms_window, n) for axis in AXES}
+        self._saved_generation = None
+        self._pvs = []
+        # extra f(i, axis, value, severity) callbacks, e.g. core/orbit_stream.py's recorder
+        self.listeners = []
+
+    @classmethod
+    def from_orbit(cls, orbit, suffixes):
+        """ columns for the BPMs of an orbit-package orbit, <suffixes> is {BPM name: PV suffix} """
+        names = orbit.names()
+        columns = cls(
+            names=names,
+            z=orbit.z_vals(),
+            is_energy_bpm=[bool(bpm.is_energy_bpm) for bpm in orbit],
+            suffixes=[suffixes[n] for n in names],
+            name=orbit.name,
+            sector_locations=orbit.sector_locations(),
+            )
+        columns.source = orbit
+        return columns
+
+    def connect(self):
+        """ monitor the x/y/tmit PVs of every BPM """
+        from epics import PV
+        for i, (bpm_name, suffix) in enumerate(zip(self._names, self.suffixes)):
+            for axis in AXES:
+                pvname = PV_FMT.format(name=bpm_name, axis=axis.upper(), suffix=suffix)
+                self._pvs.append(PV(pvname, callback=partial(self._on_update, i, axis), auto_monitor=True))
+        return
+
+    def disconnect(self):
+        for pv in self._pvs: pv.disconnect()
+        self._pvs = []
+
+    def _on_update(self, i, axis, value=None, severity=SEVR_INVALID, **kw):
+        """ pyepics monitor callback """
+        self.columns[axis][i] = np.nan if value is None else value
+        self.sevr[axis][i] = severity
+        self.generation += 1
+        for listener in self.listeners: listener(i, axis, value, severity)
+
+    def set_reference(self, ref):
+        """
+        subtract a reference orbit (beam_refs.ORBIT_DTYPE array) from x/y from now on,
+        aligned to this orbit's BPMs once, BPMs missing from <ref> read NaN
+        None goes back to absolute values
+        """
+        if ref is None:
+            self.reference = None
+        else:
+            self.reference = {axis: np.full(len(self._names), np.nan) for axis in ['x', 'y']}
+            for row in ref:
+                i = self.index.get(str(row['name']))
+                if i is None: continue
+                for axis in self.reference: self.reference[axis][i] = row[axis]
+        self.generation += 1
+        return
+
+    def values(self, axis):
+        """ current column for <axis>, relative to the reference if one is set """
+        if self.reference is not None and axis in self.reference:
+            return self.columns[axis] - self.reference[axis]
+        return self.columns[axis]
+
+    def severity(self, axis): return self.sevr[axis]
+
+    def save_latest(self):
+        """ add the current orbit to the RMS windows, once per generation """
+        if self.generation == self._saved_generation: return
+        self._saved_generation = self.generation
+        for axis in AXES: self._rms[axis].push(self.values(axis))
+
+    def rms(self, axis): return self._rms[axis].rms
+
+    def set_rms_window(self, n_shots):
+        """ resize the RMS windows, this starts them over """
+        self._rms = {axis: RunningRMS(n_shots, len(self._names)) for axis in AXES}
+        self._saved_generation = None
+
+    def names(self): return self._names
+
+    def z_vals(self): return self.z
+
+    def zmin(self): return self.z.min()
+
+    def zmax(self): return self.z.max()
+
+    def sector_locations(self): return self._sector_locations or []
+
+    def __len__(self): return len(self._names)
+
+
+class RunningRMS(object):
+    """
+    per-BPM RMS over the last <window> shots, from a preallocated shots x BPMs
+    ring buffer with running sums, so each push is O(n_bpm) whatever the window
+    NaN readings are left out of their BPM's statistic
+    """
+    def __init__(self, window, n_bpm):
+        self.window = window
+        self.shots = np.zeros((window, n_bpm))
+        self.valid = np.zeros((window, n_bpm), dtype=bool)
+        self.total = np.zeros(n_bpm)
+        self.total_sq = np.zeros(n_bpm)
+        self.count = np.zeros(n_bpm)
+        self.rms = np.zeros(n_bpm)
+        self.head = 0
+
+    def push(self, values):
+        old, old_valid = self.shots[self.head], self.valid[self.head]
+        self.total -= old
+        self.total_sq -= old*old
+        self.count -= old_valid
+
+        valid = np.isfinite(values)
+        new = np.where(valid, values, 0.0)
+        self.shots[self.head] = new
+        self.valid[self.head] = valid
+        self.total += new
+        self.total_sq += new*new
+        self.count += valid
+
+        self.head = (self.head + 1) % self.window
+
+        # re-add from scratch once per window so rounding errors can't build up
+        if self.head == 0:
+            self.total = self.shots.sum(axis=0)
+            self.total_sq = (self.shots*self.shots).sum(axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.total/self.count
+            var = self.total_sq/self.count - mean*mean
+        self.rms = np.sqrt(np.clip(np.nan_to_num(var), 0.0, None))
+        return
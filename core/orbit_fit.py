@@ -0,0 +1,121 @@
+# orbit fitting off the GUI thread
+# views hand in orbit snapshots, a worker thread fits the newest one (older
+# snapshots that are still waiting are dropped) and publishes zs/xpos/ypos
+# through a queued signal, views sharing an orbit share one fitter
+# the default fit is linear_fit, computed on the worker from the snapshot's
+# BPM readings, package_fit only republishes a fit made elsewhere
+
+from threading import Thread, Condition
+from weakref import WeakKeyDictionary
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# points along z in a published fit
+FIT_POINTS = 200
+
+_fitters = WeakKeyDictionary()
+
+
+def package_fit(snapshot):
+    """
+    the orbit package's fit_data, set on the orbit itself or on the orbit-package
+    orbit it was built from, for callers that keep that orbit fitted themselves:
+      OrbitFitter.for_orbit(orbit, fit_func=package_fit)
+    returns {'zs', 'xpos', 'ypos'} or None if there's no fit
+    """
+    fit_data = snapshot['fit_data']
+    if fit_data is None: return None
+    return {key: np.asarray(fit_data[key]) for key in ['zs', 'xpos', 'ypos']}
+
+def linear_fit(snapshot):
+    """
+    straight-line least squares of x and y vs z over the BPMs with good readings,
+    returns {'zs', 'xpos', 'ypos'} or None with too few BPMs
+    """
+    z, valid = snapshot['z'], snapshot['valid']
+    zs = np.linspace(z.min(), z.max(), FIT_POINTS)
+    fit_data = {'zs': zs}
+    for axis, values in [('xpos', snapshot['x']), ('ypos', snapshot['y'])]:
+        ok = valid & np.isfinite(values)
+        if ok.sum() < 2: return None
+        A = np.vstack([z[ok], np.ones(ok.sum())]).T
+        (slope, offset), *_ = np.linalg.lstsq(A, values[ok], rcond=None)
+        fit_data[axis] = slope*zs + offset
+    return fit_data
+
+
+class OrbitFitter(QObject):
+    """
+    fits snapshots of one OrbitColumns orbit on a worker thread
+    <fit_func>(snapshot) gets a dict of z, x, y, valid & fit_data (the orbit's own)
+    the worker stops when the last view using the fitter lets go of it
+    """
+    fit_ready = pyqtSignal(object)
+
+    def __init__(self, fit_func=linear_fit, parent=None):
+        super(OrbitFitter, self).__init__(parent)
+        self.fit_func = fit_func
+        self.result = None
+        self.result_generation = None
+        self._pending = None
+        self._pending_generation = None
+        self._users = 0
+        self._stopped = False
+        self._cond = Condition()
+        self._worker = Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def for_orbit(cls, orbit, fit_func=linear_fit):
+        """ the shared fitter for <orbit>, created with <fit_func> by the first caller """
+        if orbit not in _fitters: _fitters[orbit] = cls(fit_func=fit_func)
+        return _fitters[orbit]
+
+    def add_user(self): self._users += 1
+
+    def remove_user(self, *args):
+        """ a view stopped using this fitter (or was destroyed), the last one stops it """
+        self._users -= 1
+        if self._users <= 0: self.stop()
+
+    def stop(self):
+        """ end the worker thread, for_orbit hands out a new fitter after this """
+        for orbit, fitter in list(_fitters.items()):
+            if fitter is self: del _fitters[orbit]
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def submit(self, orbit):
+        """ queue a fit of <orbit>'s current values, no-op if this generation is done or queued """
+        generation = orbit.generation
+        if generation in (self.result_generation, self._pending_generation): return
+        fit_data = orbit.fit_data
+        if fit_data is None and orbit.source is not None: fit_data = getattr(orbit.source, 'fit_data', None)
+        snapshot = {
+            'z': orbit.z_vals(),
+            'x': orbit.values('x').copy(),
+            'y': orbit.values('y').copy(),
+            'valid': (orbit.severity('x') == 0) & (orbit.severity('y') == 0),
+            'fit_data': fit_data,
+            }
+        with self._cond:
+            self._pending = (generation, snapshot)
+            self._pending_generation = generation
+            self._cond.notify()
+        return
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopped: self._cond.wait()
+                if self._stopped: return
+                generation, snapshot = self._pending
+                self._pending = None
+            try:
+                result = self.fit_func(snapshot)
+            except Exception as e:
+                print(f'orbit fit failed: {e}')
+                result = None
+            self.result, self.result_generation = result, generation
+            self.fit_ready.emit(result)
@@ -0,0 +1,248 @@
+# BPM stream recorder/replayer for profiling OrbitView without live BPMs
+# recordings are append-only binary files: a JSON header describing the orbit
+# followed by one fixed-size record per BPM monitor update
+#
+# usage:
+#   $ python launcher.py --orbit-stream record injector inj.f2orb --seconds 60
+#   $ python launcher.py --orbit-stream bench inj.f2orb --speed 4
+#   $ python launcher.py --orbit-stream bench --bpms 400 --rate 30
+
+import sys
+import json
+import time
+import struct
+import argparse
+import importlib.util
+from os import path, environ
+from threading import Thread, Lock, Event
+import numpy as np
+
+SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+sys.path.append(REPO_ROOT)
+
+from core.orbit_columns import OrbitColumns, AXES
+
+MAGIC = b'F2ORBIT1'
+
+# t (s since the recording started), BPM index, axis index, severity, value
+RECORD_DTYPE = np.dtype([
+    ('t', '<f8'),
+    ('bpm', '<u2'),
+    ('axis', 'u1'),
+    ('sevr', 'i1'),
+    ('value', '<f8'),
+    ])
+RECORD_STRUCT = struct.Struct('<dHBbd')
+
+# displays with a module-level make_orbit_data()
+ORBIT_CUDS = {
+    'injector': path.join(REPO_ROOT, 'injector', 'main.py'),
+    'S20': path.join(REPO_ROOT, 'S20', 'main.py'),
+    }
+
+
+class OrbitRecorder(object):
+    """ appends every monitor update of an OrbitColumns orbit to <fpath> """
+    def __init__(self, orbit, fpath):
+        self.orbit = orbit
+        self.n_records = 0
+        self._lock = Lock()
+        self._f = open(fpath, 'wb')
+        _write_header(self._f, orbit)
+        self._t0 = time.monotonic()
+        orbit.listeners.append(self.record)
+
+    def record(self, i, axis, value, severity):
+        value = np.nan if value is None else value
+        rec = RECORD_STRUCT.pack(time.monotonic()-self._t0, i, AXES.index(axis), severity, value)
+        with self._lock:
+            self._f.write(rec)
+            self.n_records += 1
+
+    def close(self):
+        self.orbit.listeners.remove(self.record)
+        with self._lock: self._f.close()
+
+
+class OrbitReplayer(object):
+    """
+    feeds a recording into a fresh (unconnected) OrbitColumns orbit, through the
+    same update path the live PV callbacks use
+    <speed> is a multiple of real time, 0 replays as fast as possible
+    """
+    def __init__(self, fpath):
+        with open(fpath, 'rb') as f:
+            header, offset = _read_header(f)
+        self.records = np.fromfile(fpath, dtype=RECORD_DTYPE, offset=offset)
+        self.orbit = OrbitColumns(
+            names=header['names'], z=header['z'],
+            is_energy_bpm=header['is_energy_bpm'], name=header['name'],
+            )
+        self.duration = float(self.records['t'][-1]) if len(self.records) else 0.0
+        self._stop = Event()
+        self._thread = None
+
+    def play(self, speed=1.0, loop=False, block=True):
+        self._stop.clear()
+        self._thread = Thread(target=self._play, args=(speed, loop), daemon=True)
+        self._thread.start()
+        if block: self._thread.join()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None: self._thread.join()
+
+    def _play(self, speed, loop):
+        update = self.orbit._on_update
+        while not self._stop.is_set():
+            t_start = time.monotonic()
+            for t, i, axis, sevr, value in self.records.tolist():
+                if self._stop.is_set(): return
+                if speed > 0:
+                    delay = t/speed - (time.monotonic()-t_start)
+                    if delay > 0: time.sleep(delay)
+                update(i, AXES[axis], value, sevr)
+            if not loop: return
+
+
+def synthesize(fpath, n_bpm, rate, seconds, seed=0):
+    """ write a recording of <n_bpm> noisy BPMs updating at <rate> Hz """
+    rng = np.random.default_rng(seed)
+    names = [f'BPMS:SYNTH:{i:04d}' for i in range(n_bpm)]
+    orbit = OrbitColumns(names=names, z=np.linspace(0.0, 1000.0, n_bpm), name='synthetic orbit')
+    n_shots = int(rate*seconds)
+    records = np.zeros(n_shots*n_bpm*len(AXES), dtype=RECORD_DTYPE)
+    records['t'] = np.repeat(np.arange(n_shots)/rate, n_bpm*len(AXES))
+    records['bpm'] = np.tile(np.repeat(np.arange(n_bpm), len(AXES)), n_shots)
+    records['axis'] = np.tile(np.arange(len(AXES)), n_shots*n_bpm)
+    records['value'] = rng.normal(0.0, 0.2, len(records))
+    records['value'][records['axis'] == AXES.index('tmit')] = 1.0e10
+    with open(fpath, 'wb') as f:
+        _write_header(f, orbit)
+        records.tofile(f)
+    return fpath
+
+def record(CUD_ID, fpath, seconds):
+    """ record the live BPM stream of one of ORBIT_CUDS """
+    spec = importlib.util.spec_from_file_location(f'F2_CUD_{CUD_ID}_main', ORBIT_CUDS[CUD_ID])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    orbit = module.make_orbit_data()
+    recorder = OrbitRecorder(orbit, fpath)
+    orbit.connect()
+    time.sleep(seconds)
+    orbit.disconnect()
+    recorder.close()
+    print(f'{recorder.n_records} updates from {len(orbit)} BPMs written to {fpath}')
+    return
+
+def bench(fpath, speed=1.0, draw_rate=10, seconds=None):
+    """
+    replay <fpath> into an x/y pair of OrbitViews offscreen, returns frame times
+    (one redraw pass over both views + painting the ones that changed) and
+    process CPU, which includes the replay thread
+    """
+    environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+    from widgets.orbit_view import OrbitView, OrbitDrawGroup
+
+    app = QApplication.instance() or QApplication([])
+    replayer = OrbitReplayer(fpath)
+    orbit = replayer.orbit
+
+    draw_timer = QTimer()
+    views = [OrbitView(axis=axis, name=axis.upper(), draw_timer=draw_timer, max_draw_rate=draw_rate) for axis in 'xy']
+    views[1].setXLink(views[0])
+    group = OrbitDrawGroup.for_timer(draw_timer)
+    frame_times = []
+    def _timed_redraw():
+        drawn = [view.drawn_generation for view in views]
+        t = time.perf_counter()
+        group.redraw()
+        changed = [view for view, generation in zip(views, drawn) if view.drawn_generation != generation]
+        if not changed: return
+        for view in changed: view.repaint()
+        frame_times.append(time.perf_counter()-t)
+    draw_timer.timeout.disconnect()
+    draw_timer.timeout.connect(_timed_redraw)
+    for view in views:
+        view.resize(800, 300)
+        view.set_orbit(orbit)
+        view.show()
+
+    wall = seconds or (replayer.duration/speed if speed > 0 else None)
+    cpu0, t0 = time.process_time(), time.monotonic()
+    replayer.play(speed=speed, loop=seconds is not None, block=False)
+    while True:
+        app.processEvents()
+        if wall is not None and time.monotonic()-t0 > wall: break
+        if wall is None and not replayer._thread.is_alive(): break
+        time.sleep(0.001)
+    replayer.stop()
+    elapsed, cpu = time.monotonic()-t0, time.process_time()-cpu0
+
+    ms = 1e3*np.array(frame_times) if frame_times else np.zeros(1)
+    return {
+        'n_bpm': len(orbit),
+        'updates': len(replayer.records),
+        'draw_rate': draw_rate,
+        'speed': speed,
+        'elapsed_s': elapsed,
+        'frames': len(frame_times),
+        'frame_ms_mean': float(ms.mean()),
+        'frame_ms_p50': float(np.percentile(ms, 50)),
+        'frame_ms_p95': float(np.percentile(ms, 95)),
+        'frame_ms_max': float(ms.max()),
+        'cpu_pct': 100*cpu/elapsed,
+        }
+
+def _write_header(f, orbit):
+    header = json.dumps({
+        'name': orbit.name,
+        'names': list(orbit.names()),
+        'z': [float(z) for z in orbit.z_vals()],
+        'is_energy_bpm': [bool(e) for e in orbit.is_energy_bpm],
+        }).encode('utf-8')
+    f.write(MAGIC)
+    f.write(struct.pack('<I', len(header)))
+    f.write(header)
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC: raise ValueError(f'{f.name} is not an orbit recording')
+    (n,) = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(n).decode('utf-8'))
+    return header, len(MAGIC) + 4 + n
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='launcher.py --orbit-stream')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_rec = sub.add_parser('record', help='record live BPMs of a display')
+    p_rec.add_argument('CUD_ID', choices=list(ORBIT_CUDS))
+    p_rec.add_argument('file')
+    p_rec.add_argument('--seconds', type=float, default=60.0)
+
+    p_bench = sub.add_parser('bench', help='replay a recording into OrbitView offscreen')
+    p_bench.add_argument('file', nargs='?', default=None, help='recording, synthesized if not given')
+    p_bench.add_argument('--bpms', type=int, default=200, help='synthetic BPM count')
+    p_bench.add_argument('--rate', type=float, default=10.0, help='synthetic update rate (Hz)')
+    p_bench.add_argument('--seconds', type=float, default=None, help='bench length, loops the recording')
+    p_bench.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 is as fast as possible')
+    p_bench.add_argument('--draw-rate', type=float, default=10.0, help='OrbitView max_draw_rate')
+    opts = parser.parse_args(args)
+
+    if opts.command == 'record':
+        record(opts.CUD_ID, opts.file, opts.seconds)
+        return 0
+
+    fpath = opts.file
+    if fpath is None:
+        fpath = f'/tmp/F2-CUDs-synth-{opts.bpms}bpm-{opts.rate:g}hz.f2orb'
+        synthesize(fpath, opts.bpms, opts.rate, opts.seconds or 10.0)
+    print(json.dumps(bench(fpath, opts.speed, opts.draw_rate, opts.seconds), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,196 @@
+# batched PV writer for the ACR CUD PVs
+# keeps one long-lived channel open and applies (pv, value) writes in batches,
+# instead of a fresh 'ssh physics@lcls-srv01 caput' per PV
+#
+# usage:
+#   $ python launcher.py --pv-writer PV=VALUE [PV=VALUE ...]
+#   $ python launcher.py --pv-writer --selftest
+
+import sys
+import shlex
+import argparse
+from os import environ, read
+from select import select
+from subprocess import Popen, PIPE, DEVNULL
+from threading import Lock
+from time import time
+from core import common
+
+# marker lines used by the ssh backend to frame replies from the remote shell
+STATUS_MARK = '@@F2CUD'
+END_MARK = '@@F2CUD_END'
+
+BATCH_TIMEOUT = 20.0
+
+# 'ssh' writes as physics@lcls-srv01, 'epics' writes directly with pyepics
+# (e.g. against a stand-in IOC), $F2_CUD_PV_WRITER overrides config.yaml
+WRITER_CONFIG = common.CONFIG.get('pv_writer', {})
+
+
+class SSHCaputBackend(object):
+    """
+    runs caput on a remote host through one persistent ssh session
+    the session is (re)opened on demand if it drops
+    """
+    def __init__(self, host):
+        self.host = host
+        self.proc = None
+        self._buffer = b''
+
+    def write_batch(self, writes):
+        """ write all of <writes> in one round trip, returns {pv: ok} """
+        try:
+            return self._write_batch(writes)
+        except (OSError, RuntimeError):
+            # stale connection, try once more on a fresh one
+            self.close()
+            return self._write_batch(writes)
+
+    def close(self):
+        if self.proc is None: return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=2)
+        except Exception:
+            self.proc.kill()
+        self.proc = None
+        self._buffer = b''
+
+    def _write_batch(self, writes):
+        if self.proc is None or self.proc.poll() is not None: self._connect()
+        script = ''
+        for pv, value in writes:
+            script = script + (
+                f'caput -t {shlex.quote(pv)} {shlex.quote(str(value))} >/dev/null 2>&1; '
+                f'echo "{STATUS_MARK} {pv} $?"\n'
+                )
+        script = script + f'echo "{END_MARK}"\n'
+        self.proc.stdin.write(script.encode())
+        self.proc.stdin.flush()
+
+        status = {pv: False for pv, _ in writes}
+        deadline = time() + BATCH_TIMEOUT
+        while True:
+            line = self._read_line(deadline).strip()
+            if line == END_MARK: break
+            if line.startswith(STATUS_MARK):
+                _, pv, code = line.split()
+                status[pv] = (code == '0')
+        return status
+
+    def _read_line(self, deadline):
+        # replies are read from the fd into our own buffer, several lines can
+        # arrive in one chunk and select() can't see lines a file object buffered
+        fd = self.proc.stdout.fileno()
+        while b'\n' not in self._buffer:
+            if not select([fd], [], [], max(0, deadline-time()))[0]:
+                raise RuntimeError(f'no reply from {self.host} within {BATCH_TIMEOUT}s')
+            chunk = read(fd, 65536)
+            if not chunk: raise RuntimeError(f'connection to {self.host} closed')
+            self._buffer = self._buffer + chunk
+        line, _, self._buffer = self._buffer.partition(b'\n')
+        return line.decode()
+
+    def _shell_args(self):
+        return [
+            'ssh', '-T', '-o', 'BatchMode=yes', '-o', 'ServerAliveInterval=30',
+            self.host, 'sh'
+            ]
+
+    def _connect(self):
+        self._buffer = b''
+        self.proc = Popen(self._shell_args(), stdin=PIPE, stdout=PIPE, stderr=DEVNULL, bufsize=0)
+
+
+class EpicsBackend(object):
+    """ writes with pyepics from this process, for local testing against a stand-in IOC """
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+
+    def write_batch(self, writes):
+        from epics import caput
+        return {pv: bool(caput(pv, value, wait=True, timeout=self.timeout)) for pv, value in writes}
+
+    def close(self): return
+
+
+class PVWriter(object):
+    """ thread-safe front end, serializes batches onto one backend """
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = Lock()
+
+    def write(self, writes):
+        """ apply a batch of (pv, value) writes, returns {pv: ok} """
+        writes = list(writes)
+        if not writes: return {}
+        with self._lock: return self.backend.write_batch(writes)
+
+    def close(self):
+        with self._lock: self.backend.close()
+
+
+_writer = None
+_writer_lock = Lock()
+
+def get_writer():
+    """ the shared PVWriter for this process, created on first use """
+    global _writer
+    with _writer_lock:
+        if _writer is None: _writer = PVWriter(make_backend())
+    return _writer
+
+def make_backend(name=None):
+    name = name or environ.get('F2_CUD_PV_WRITER', WRITER_CONFIG.get('backend', 'ssh'))
+    if name == 'ssh':   return SSHCaputBackend(WRITER_CONFIG.get('host', 'physics@lcls-srv01'))
+    if name == 'epics': return EpicsBackend()
+    raise KeyError(f'unknown PV writer backend: {name}')
+
+# stands in for the remote shell in selftest: answers every status echo with
+# exit code 0 (1 for PVs containing FAIL) but holds the replies back until the
+# end marker, then sends the whole batch's replies in one write
+STAND_IN_SHELL = r"""
+import os, re, sys
+replies = []
+for line in sys.stdin:
+    m = re.search(r'echo "(\S+)(?: (\S+) \$\?)?"', line)
+    if m is None: continue
+    if m.group(2) is None:
+        replies.append(m.group(1))
+        os.write(1, ('\n'.join(replies) + '\n').encode())
+        replies = []
+    else:
+        replies.append(f'{m.group(1)} {m.group(2)} {int("FAIL" in m.group(2))}')
+"""
+
+class _StandInBackend(SSHCaputBackend):
+    def _shell_args(self): return [sys.executable, '-c', STAND_IN_SHELL]
+
+def selftest():
+    """ batches through a stand-in shell that sends all of a batch's replies at once """
+    backend = _StandInBackend('stand-in')
+    try:
+        for i in range(20):
+            writes = [(f'F2CUD:SELFTEST:{i}:{j}', j) for j in range(5)] + [(f'F2CUD:SELFTEST:{i}:FAIL', 0)]
+            t = time()
+            status = backend._write_batch(writes)
+            assert time() - t < 1, f'batch {i} stalled'
+            assert status == {pv: not pv.endswith('FAIL') for pv, _ in writes}, status
+            assert backend._buffer == b''
+    finally:
+        backend.close()
+    print('PV writer selftest OK')
+    return 0
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='launcher.py --pv-writer')
+    parser.add_argument('writes', nargs='*', metavar='PV=VALUE')
+    parser.add_argument('--selftest', action='store_true', help='check batch replies with a stand-in shell and exit')
+    opts = parser.parse_args(args)
+
+    if opts.selftest: return selftest()
+    writes = [w.split('=', 1) for w in opts.writes]
+    if not writes or any(len(w) != 2 for w in writes): parser.error('expected PV=VALUE writes')
+    status = get_writer().write(writes)
+    for pv, ok in status.items(): print(f'{pv}: {"ok" if ok else "FAILED"}')
+    return 0 if all(status.values()) else 1
@@ -0,0 +1,308 @@
+# CUD process supervisor daemon
+# owns the processes sent to ACR monitors, notices when they exit (pidfd),
+# restarts crashed displays with backoff and publishes liveness/restart
+# counts through the CUD:ACR0:<monitor> PVs
+
+import os
+import json
+import signal
+import selectors
+from os import path, pipe, read, write, close, kill, unlink
+from time import time, sleep
+from threading import Thread, RLock
+from socketserver import ThreadingUnixStreamServer, StreamRequestHandler
+from subprocess import Popen
+from core import local_ipc, common
+from core import ACR_remote_control as rctrl
+
+SOCKET_PATH = local_ipc.socket_path('supervisor')
+
+# restart delay doubles with each quick crash, up to BACKOFF_MAX
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 120.0
+
+# a display that stayed up this long resets its backoff
+STABLE_TIME = 300.0
+
+# grace period between SIGTERM and SIGKILL
+TERM_TIMEOUT = 5.0
+
+# how often terminate checks on the process where pidfds aren't available
+TERM_POLL_INTERVAL = 0.1
+
+# launches can take up to ~30s waiting for the window manager
+REQUEST_TIMEOUT = 60.0
+
+
+def available():
+    """ True if a supervisor daemon is listening """
+    try:
+        local_ipc.request(SOCKET_PATH, {'cmd': 'ping'})
+        return True
+    except OSError:
+        return False
+
+def request_launch(monitor, CUD_ID):
+    """ have the supervisor send <CUD_ID> to <monitor> and keep it running """
+    return _request({'cmd': 'launch', 'monitor': monitor, 'CUD_ID': CUD_ID})
+
+def request_kill(monitor):
+    """ have the supervisor stop <monitor>'s display and stop restarting it """
+    return _request({'cmd': 'kill', 'monitor': monitor})
+
+def request_status():
+    """ {monitor: {CUD_ID, pid, alive, restarts}} for every supervised monitor """
+    return _request({'cmd': 'status'})
+
+def terminate(pid, timeout=TERM_TIMEOUT):
+    """
+    SIGTERM <pid>, SIGKILL it if it's still around after <timeout>
+    waits on a pidfd, so it works for processes that aren't our children,
+    or polls the PID where pidfds aren't available
+    returns False if there was no such process or it isn't ours to signal
+    """
+    try:
+        pidfd = _pidfd_open(pid)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pidfd = None
+    try:
+        kill(pid, signal.SIGTERM)
+        if not _wait_exit(pid, pidfd, timeout):
+            kill(pid, signal.SIGKILL)
+            _wait_exit(pid, pidfd, timeout)
+    except ProcessLookupError:
+        # without a pidfd, the first kill is also the check that it exists
+        if pidfd is None: return False
+    except PermissionError:
+        print(f'not allowed to signal pid {pid}')
+        return False
+    finally:
+        if pidfd is not None: close(pidfd)
+    return True
+
+def _pidfd_open(pid):
+    """ os.pidfd_open, which only exists on linux with python 3.9+, OSError elsewhere """
+    if not hasattr(os, 'pidfd_open'): raise OSError('pidfd_open is not available')
+    return os.pidfd_open(pid)
+
+def _wait_exit(pid, pidfd, timeout):
+    """ wait for <pid> to exit, on its pidfd if there is one, returns False on timeout """
+    if pidfd is not None:
+        with selectors.DefaultSelector() as sel:
+            sel.register(pidfd, selectors.EVENT_READ)
+            return bool(sel.select(timeout))
+    deadline = time() + timeout
+    while time() < deadline:
+        try:
+            kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        sleep(TERM_POLL_INTERVAL)
+    return False
+
+def _request(msg):
+    reply = local_ipc.request(SOCKET_PATH, msg, timeout=REQUEST_TIMEOUT)
+    if 'error' in reply: raise RuntimeError(f'supervisor: {reply["error"]}')
+    return reply
+
+
+class SupervisedCUD(object):
+    """ bookkeeping for one monitor's display """
+    def __init__(self, monitor, CUD_ID):
+        self.monitor = monitor
+        self.CUD_ID = CUD_ID
+        self.proc = None
+        self.pidfd = None
+        self.started = 0.0
+        self.restarts = 0
+        self.quick_failures = 0
+        self.restart_at = None
+
+    def alive(self): return self.proc is not None and self.restart_at is None
+
+    def summary(self):
+        return {
+            'CUD_ID': self.CUD_ID,
+            'pid': self.proc.pid if self.proc is not None else None,
+            'alive': self.alive(),
+            'restarts': self.restarts,
+            }
+
+
+class CUDSupervisor(object):
+
+    def __init__(self):
+        self.lock = RLock()
+        self.monitors = {}
+        self.sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = pipe()
+        self.sel.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def launch(self, monitor, CUD_ID):
+        """ (re)launch <CUD_ID> on <monitor> and start watching it """
+        self.kill(monitor, clear_PVs=False)
+        entry = SupervisedCUD(monitor, CUD_ID)
+        proc = rctrl.start_on_monitor(monitor, CUD_ID)
+        with self.lock:
+            self.monitors[monitor] = entry
+            watched = self._watch(entry, proc)
+        if watched: self._publish(entry)
+        else:       self._exited_early(entry)
+        return entry.summary()
+
+    def kill(self, monitor, clear_PVs=True):
+        """
+        stop supervising <monitor> and terminate its display
+        a display this supervisor doesn't own (started without it, or before it
+        was restarted) is terminated through the PID in its :PID PV
+        """
+        with self.lock:
+            entry = self.monitors.pop(monitor, None)
+            if entry is not None: self._unwatch(entry)
+        if entry is None:
+            _, pid = rctrl.get_monitor_state(monitor)
+            if pid: terminate(pid)
+        elif entry.proc is not None:
+            terminate(entry.proc.pid)
+            if isinstance(entry.proc, Popen): entry.proc.wait()
+        rctrl.release_win_IDs(monitor)
+        if clear_PVs:
+            rctrl.set_monitor_PVs(monitor, '', '', '')
+            self._publish(SupervisedCUD(monitor, None))
+        return {}
+
+    def status(self):
+        with self.lock: return {m: e.summary() for m, e in self.monitors.items()}
+
+    def run(self):
+        """ watch supervised processes forever """
+        while True:
+            for key, _ in self.sel.select(self._next_timeout()):
+                if key.data is None: read(self._wake_r, 512)
+                else:                self._on_exit(key.data)
+            self._start_due_restarts()
+
+    def _watch(self, entry, proc):
+        """ start watching <proc> for <entry>, False if it already exited (and was reaped) """
+        try:
+            pidfd = _pidfd_open(proc.pid)
+        except ProcessLookupError:
+            pidfd = None
+        entry.proc = proc
+        entry.started = time()
+        if pidfd is None: return False
+        entry.restart_at = None
+        entry.pidfd = pidfd
+        self.sel.register(entry.pidfd, selectors.EVENT_READ, entry)
+        self._wake()
+        return True
+
+    def _exited_early(self, entry):
+        """ <entry>'s display exited before it could be watched, restart it like any exit """
+        self._on_exit(entry)
+        self._wake()
+
+    def _unwatch(self, entry):
+        if entry.pidfd is None: return
+        self.sel.unregister(entry.pidfd)
+        close(entry.pidfd)
+        entry.pidfd = None
+
+    def _on_exit(self, entry):
+        """ a supervised display went away, schedule its restart """
+        with self.lock:
+            if self.monitors.get(entry.monitor) is not entry: return
+            self._unwatch(entry)
+            # only our own children can be reaped, zygote children are reaped by the zygote
+            code = entry.proc.wait() if isinstance(entry.proc, Popen) else None
+            if time() - entry.started < STABLE_TIME: entry.quick_failures += 1
+            else:                                    entry.quick_failures = 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE*2**(entry.quick_failures-1))
+            entry.restart_at = time() + delay
+        print(f'{entry.monitor}: {entry.CUD_ID} (pid {entry.proc.pid}) exited ({code}), restarting in {delay:.0f}s')
+        rctrl.release_win_IDs(entry.monitor)
+        try:
+            rctrl.set_monitor_PVs(entry.monitor, common.CUD_desc(entry.CUD_ID), '', '')
+        except RuntimeError as e:
+            print(f'{entry.monitor}: {e}')
+        self._publish(entry)
+
+    def _start_due_restarts(self):
+        now = time()
+        with self.lock:
+            due = [e for e in self.monitors.values() if e.restart_at is not None and e.restart_at <= now]
+            # push the deadline out while the restart runs so it's only started once
+            for entry in due: entry.restart_at = now + BACKOFF_MAX
+        for entry in due: Thread(target=self._restart, args=(entry,), daemon=True).start()
+
+    def _restart(self, entry):
+        try:
+            proc = rctrl.start_on_monitor(entry.monitor, entry.CUD_ID)
+        except Exception as e:
+            print(f'{entry.monitor}: restart failed ({e!r})')
+            with self.lock:
+                entry.quick_failures += 1
+                entry.restart_at = time() + min(BACKOFF_MAX, BACKOFF_BASE*2**(entry.quick_failures-1))
+            self._wake()
+            return
+        with self.lock:
+            released = self.monitors.get(entry.monitor) is not entry
+            if not released:
+                entry.restarts += 1
+                watched = self._watch(entry, proc)
+        # the monitor was killed or relaunched while we were restarting
+        if released:
+            terminate(proc.pid)
+            return
+        if watched: self._publish(entry)
+        else:       self._exited_early(entry)
+
+    def _next_timeout(self):
+        with self.lock:
+            deadlines = [e.restart_at for e in self.monitors.values() if e.restart_at is not None]
+        if not deadlines: return None
+        return max(0.0, min(deadlines) - time())
+
+    def _wake(self): write(self._wake_w, b'x')
+
+    def _publish(self, entry):
+        try:
+            rctrl.set_monitor_health_PVs(entry.monitor, int(entry.alive()), entry.restarts)
+        except RuntimeError as e:
+            print(f'{entry.monitor}: {e}')
+
+
+class _RequestHandler(StreamRequestHandler):
+    def handle(self):
+        sup = self.server.supervisor
+        try:
+            msg = json.loads(self.rfile.readline().decode('utf-8'))
+            cmd = msg['cmd']
+            if   cmd == 'ping':   reply = {}
+            elif cmd == 'status': reply = sup.status()
+            elif cmd == 'launch': reply = sup.launch(msg['monitor'], msg['CUD_ID'])
+            elif cmd == 'kill':   reply = sup.kill(msg['monitor'])
+            else: raise KeyError(f'unknown command {cmd}')
+        except Exception as e:
+            reply = {'error': repr(e)}
+        local_ipc.send(self.connection, reply)
+
+
+def serve():
+    """ run the supervisor daemon, requests are handled on their own threads """
+    # exits of processes that aren't our children are only noticed through pidfds
+    if not hasattr(os, 'pidfd_open'): raise RuntimeError('the supervisor needs os.pidfd_open (linux, python 3.9+)')
+    supervisor = CUDSupervisor()
+    if path.exists(SOCKET_PATH): unlink(SOCKET_PATH)
+    server = ThreadingUnixStreamServer(SOCKET_PATH, _RequestHandler)
+    server.daemon_threads = True
+    server.supervisor = supervisor
+    Thread(target=server.serve_forever, daemon=True).start()
+    print(f'supervisor listening on {SOCKET_PATH}')
+    try:
+        supervisor.run()
+    finally:
+        server.server_close()
+        unlink(SOCKET_PATH)
@@ -0,0 +1,158 @@
+# per-CUD resource telemetry
+# CPU, RSS and thread count come from /proc/<pid>, CA channel count and Qt
+# event-loop lag come from a hook running inside each CUD process, which
+# drops a small JSON file that the manager picks up
+
+import json
+from os import path, makedirs, replace, getpid, getuid, sysconf
+from time import time, monotonic
+from collections import deque
+
+TELEMETRY_DIR = f'/tmp/F2-CUDs-telemetry-{getuid()}'
+
+# sample/report period for both the in-process hook and the manager
+INTERVAL_MS = 2000
+
+# number of samples kept per monitor for trend plots (1h at 2s)
+HISTORY_LEN = 1800
+
+# hook reports older than this belong to a dead or hung process
+STALE_AGE = 5*INTERVAL_MS/1000
+
+CLOCK_TICKS = sysconf('SC_CLK_TCK')
+PAGE_SIZE = sysconf('SC_PAGE_SIZE')
+
+FIELDS = ['cpu_pct', 'rss_mb', 'threads', 'ca_channels', 'loop_lag_ms']
+
+
+class ProcSampler(object):
+    """ CPU%/RSS/threads for arbitrary PIDs, CPU% is averaged between calls """
+    def __init__(self):
+        self._last = {}
+
+    def sample(self, pid):
+        """ returns a dict of FIELDS (hook fields are None if unavailable), {} if no such pid """
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f: stat = f.read()
+            with open(f'/proc/{pid}/statm', 'r') as f: statm = f.read().split()
+        except (FileNotFoundError, ProcessLookupError):
+            self._last.pop(pid, None)
+            return {}
+
+        # comm (field 2) may contain spaces, so split after its closing paren
+        fields = stat[stat.rindex(')')+2:].split()
+        cpu_ticks = int(fields[11]) + int(fields[12])
+        now = monotonic()
+        cpu_pct = None
+        if pid in self._last:
+            last_ticks, last_t = self._last[pid]
+            cpu_pct = 100.0*(cpu_ticks-last_ticks)/CLOCK_TICKS/max(now-last_t, 1e-6)
+        self._last[pid] = (cpu_ticks, now)
+
+        result = {
+            'cpu_pct': cpu_pct,
+            'rss_mb': int(statm[1])*PAGE_SIZE/2**20,
+            'threads': int(fields[17]),
+            'ca_channels': None,
+            'loop_lag_ms': None,
+            }
+        result.update(read_hook(pid))
+        return result
+
+
+class TelemetryHistory(object):
+    """ fixed-length time series of samples for one monitor """
+    def __init__(self, maxlen=HISTORY_LEN):
+        self.t = deque(maxlen=maxlen)
+        self.data = {k: deque(maxlen=maxlen) for k in FIELDS}
+
+    def append(self, sample):
+        self.t.append(time())
+        for k in FIELDS: self.data[k].append(sample.get(k))
+
+    def clear(self):
+        self.t.clear()
+        for k in FIELDS: self.data[k].clear()
+
+
+def short_summary(sample):
+    """ compact CPU/RSS text for the manager's CUD summary rows """
+    if not sample: return ''
+    cpu = f'{sample["cpu_pct"]:.0f}%' if sample['cpu_pct'] is not None else '--'
+    return f'{cpu} {sample["rss_mb"]:.0f}M'
+
+def summary(sample):
+    """ one-line text with every field, used as the summary tooltip """
+    if not sample: return ''
+    parts = []
+    if sample['cpu_pct'] is not None:     parts.append(f'{sample["cpu_pct"]:.0f}%')
+    parts.append(f'{sample["rss_mb"]:.0f} MB')
+    parts.append(f'{sample["threads"]} thr')
+    if sample['ca_channels'] is not None: parts.append(f'{sample["ca_channels"]} CA')
+    if sample['loop_lag_ms'] is not None: parts.append(f'lag {sample["loop_lag_ms"]:.0f} ms')
+    return ' | '.join(parts)
+
+def read_hook(pid):
+    """ latest in-process report for <pid>, {} if missing or stale """
+    try:
+        with open(_hook_file(pid), 'r') as f: report = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if time() - report.pop('t', 0) > STALE_AGE: return {}
+    return report
+
+def install_hook():
+    """
+    start reporting CA channels & event-loop lag for this process
+    only the first call in a process does anything (host mode runs several displays)
+    """
+    global _hook
+    if _hook is None: _hook = _TelemetryHook()
+    return _hook
+
+def _hook_file(pid): return path.join(TELEMETRY_DIR, f'{pid}.json')
+
+def _count_CA_channels():
+    """ open channel access channels in this process: pydm connections + bare pyepics PVs """
+    n = 0
+    try:
+        from pydm.data_plugins import plugin_modules
+        for protocol in ['ca', 'pva']:
+            if protocol in plugin_modules: n = n + len(plugin_modules[protocol].connections)
+    except ImportError:
+        pass
+    try:
+        from epics import ca
+        n = n + sum(len(chans) for chans in ca._cache.values())
+    except (ImportError, AttributeError):
+        pass
+    return n
+
+
+_hook = None
+
+class _TelemetryHook(object):
+    """ QTimer-driven reporter living in a CUD process """
+    def __init__(self):
+        from PyQt5.QtCore import QTimer, QCoreApplication
+        makedirs(TELEMETRY_DIR, exist_ok=True)
+        self.fname = _hook_file(getpid())
+        # parented to the app so it outlives any single display
+        self.timer = QTimer(QCoreApplication.instance())
+        self.timer.setInterval(INTERVAL_MS)
+        self.timer.timeout.connect(self.report)
+        self.expected = monotonic() + INTERVAL_MS/1000
+        self.timer.start()
+
+    def report(self):
+        # a busy event loop delivers the timeout late, that delay is the lag
+        now = monotonic()
+        lag_ms = max(0.0, (now - self.expected)*1000)
+        self.expected = now + INTERVAL_MS/1000
+        report = {'t': time(), 'ca_channels': _count_CA_channels(), 'loop_lag_ms': lag_ms}
+        tmp = f'{self.fname}.tmp'
+        try:
+            with open(tmp, 'w') as f: json.dump(report, f)
+            replace(tmp, self.fname)
+        except OSError:
+            pass
@@ -0,0 +1,97 @@
+# precompiled .ui cache
+# each .ui is compiled once to a python module keyed by the .ui file's hash,
+# so displays skip the uic XML parse on every launch
+
+from os import path, listdir, makedirs, replace, remove, getpid
+from io import StringIO
+from functools import partial
+from hashlib import sha1
+from importlib.util import spec_from_file_location, module_from_spec
+from pydm import Display
+
+SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+CACHE_PATH = path.join(REPO_ROOT, '.ui_cache')
+
+
+class CachedUIDisplay(Display):
+    """
+    pydm Display that builds its ui from the precompiled cache
+    falls back to pydm's own .ui loading if the cache can't be used
+    """
+    def load_ui(self, macros=None):
+        if self.ui: return self.ui
+        ui_file = self.ui_filepath()
+        # macro substitution happens on the XML, so macros always use pydm
+        klass = None
+        if ui_file and not macros: klass = load_ui_class(ui_file)
+        if klass is None:
+            return super(CachedUIDisplay, self).load_ui(macros=macros)
+        # same as pydm: widgets become attributes of the display & self.ui is the display
+        self._loaded_file = ui_file
+        self.retranslateUi = partial(klass.retranslateUi, self)
+        klass.setupUi(self, self)
+        self.ui = self
+        return self.ui
+
+
+def load_ui_class(ui_file):
+    """
+    return the compiled Ui_ class for <ui_file>, building the cache entry if needed
+    returns None if the cache can't be read or written
+    """
+    try:
+        module_file = cache_file(ui_file)
+        if not path.exists(module_file): build(ui_file)
+        spec = spec_from_file_location(path.basename(module_file)[:-3], module_file)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        for name, obj in vars(module).items():
+            if name.startswith('Ui_'): return obj
+    except Exception as e:
+        print(f'ui cache unusable for {ui_file}: {e!r}')
+    return None
+
+def cache_file(ui_file):
+    """ path of the cached module for the current contents of <ui_file> """
+    with open(ui_file, 'rb') as f: digest = sha1(f.read()).hexdigest()[:16]
+    return path.join(CACHE_PATH, f'{_cache_stem(ui_file)}_{digest}.py')
+
+def build(ui_file):
+    """ compile <ui_file> into the cache, removing entries for older versions """
+    from PyQt5 import uic
+    makedirs(CACHE_PATH, exist_ok=True)
+    module_file = cache_file(ui_file)
+    code = StringIO()
+    uic.compileUi(ui_file, code)
+
+    # write-then-rename so concurrent launches never import a partial file
+    tmp_file = f'{module_file}.{getpid()}.tmp'
+    with open(tmp_file, 'w') as f: f.write(code.getvalue())
+    replace(tmp_file, module_file)
+
+    stem = _cache_stem(ui_file)
+    for fname in listdir(CACHE_PATH):
+        old_file = path.join(CACHE_PATH, fname)
+        if fname.startswith(f'{stem}_') and fname.endswith('.py') and old_file != module_file:
+            remove(old_file)
+    return module_file
+
+def build_all():
+    """ compile every .ui file in the repo """
+    for ui_file in _repo_ui_files():
+        print(f' -> {path.relpath(ui_file, REPO_ROOT)}')
+        build(ui_file)
+    return
+
+def _repo_ui_files():
+    for d in sorted(listdir(REPO_ROOT)):
+        dpath = path.join(REPO_ROOT, d)
+        if d.startswith('.') or not path.isdir(dpath): continue
+        for fname in sorted(listdir(dpath)):
+            if fname.endswith('.ui'): yield path.join(dpath, fname)
+
+def _cache_stem(ui_file):
+    """ e.g. /.../F2-CUDs/wfh/main.ui -> wfh_main """
+    rel = path.relpath(path.abspath(ui_file), REPO_ROOT)
+    return rel[:-3].replace(path.sep, '_').replace('.', '_')
@@ -0,0 +1,22 @@
+# generic display for CUDs that are just a .ui file
+# lets .ui-only entries in config.yaml use the precompiled ui cache
+# the .ui path (relative to the repo root) is the first display argument
+
+import sys
+from os import path
+
+SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+sys.path.append(REPO_ROOT)
+
+from core import ui_cache
+
+
+class F2_CUD_ui_file(ui_cache.CachedUIDisplay):
+
+    def __init__(self, parent=None, args=None, macros=None):
+        self._ui_path = path.join(REPO_ROOT, args[0])
+        super(F2_CUD_ui_file, self).__init__(parent=parent, args=args, macros=macros)
+        return
+
+    def ui_filename(self): return self._ui_path
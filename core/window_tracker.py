@@ -0,0 +1,141 @@
+# event-driven X window discovery for newly launched CUDs
+# watches the root window's _NET_CLIENT_LIST instead of polling wmctrl, and
+# places/fullscreens the window over the same X connection
+# needs python-xlib, callers fall back to wmctrl if it's unavailable
+
+from select import select
+from time import time
+
+try:
+    from Xlib import X, Xatom
+    from Xlib.display import Display as XDisplay
+    from Xlib.error import XError, DisplayError
+    from Xlib.protocol.event import ClientMessage
+except ImportError:
+    XDisplay = None
+
+# _NET_MOVERESIZE_WINDOW flags: x, y, width & height are all set
+MOVERESIZE_XYWH = (1 << 8) | (1 << 9) | (1 << 10) | (1 << 11)
+
+# _NET_WM_STATE actions
+NET_WM_STATE_ADD = 1
+
+# longest wait_for sleeps between calls to its <check> callback
+CHECK_INTERVAL = 0.25
+
+
+def available(): return XDisplay is not None
+
+def open_tracker(display_name):
+    """ returns a WindowTracker for <display_name>, or None if X can't be reached """
+    if not available(): return None
+    try:
+        return WindowTracker(display_name)
+    except (DisplayError, XError, OSError) as e:
+        print(f'window tracking unavailable on {display_name}: {e!r}')
+        return None
+
+
+class WindowTracker(object):
+    """
+    tracks top-level client windows on one X display
+    windows already mapped when the tracker is created are never reported,
+    so create it before launching the CUD
+    """
+    def __init__(self, display_name):
+        self.d = XDisplay(display_name)
+        self.root = self.d.screen().root
+        self.root.change_attributes(event_mask=X.PropertyChangeMask)
+
+        self.atom = {}
+        for name in [
+            '_NET_CLIENT_LIST', '_NET_WM_PID', '_NET_WM_NAME', 'UTF8_STRING',
+            '_NET_WM_STATE', '_NET_WM_STATE_FULLSCREEN', '_NET_MOVERESIZE_WINDOW',
+            ]:
+            self.atom[name] = self.d.intern_atom(name)
+
+        self.known = {win.id for win in self._client_list()}
+        self.candidates = set()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *args): self.close()
+
+    def close(self): self.d.close()
+
+    def wait_for(self, pid=None, titles=(), timeout=30.0, accept=None, check=None):
+        """
+        block until a new client window with _NET_WM_PID == <pid>, or with a title
+        containing one of <titles> if it doesn't set _NET_WM_PID, is mapped;
+        returns its ID as wmctrl-style hex
+        <accept>(win_ID) can veto a match (e.g. a window claimed elsewhere)
+        <check>() is called at least every CHECK_INTERVAL and can raise to stop waiting
+        returns '' on timeout
+        """
+        deadline = time() + timeout
+        while True:
+            if check is not None: check()
+            self._scan_clients()
+            for win in list(self.candidates):
+                if not self._matches(win, pid, titles): continue
+                win_ID = f'0x{win.id:08x}'
+                if accept is not None and not accept(win_ID): continue
+                self.candidates.discard(win)
+                return win_ID
+
+            # sleep until the X server has something for us, the events themselves
+            # don't matter since the client list is rescanned on every wake-up
+            remaining = deadline - time()
+            if remaining <= 0: return ''
+            if check is not None: remaining = min(remaining, CHECK_INTERVAL)
+            if not self.d.pending_events():
+                select([self.d.fileno()], [], [], remaining)
+            while self.d.pending_events(): self.d.next_event()
+
+    def place(self, win_ID, x, y, w, h, fullscreen=True):
+        """ move/resize <win_ID> and optionally fullscreen it, via the window manager """
+        win = self.d.create_resource_object('window', int(win_ID, 16))
+        self._send_wm_message(win, '_NET_MOVERESIZE_WINDOW', [MOVERESIZE_XYWH, x, y, w, h])
+        if fullscreen:
+            self._send_wm_message(win, '_NET_WM_STATE', [
+                NET_WM_STATE_ADD, self.atom['_NET_WM_STATE_FULLSCREEN'], 0, 1, 0
+                ])
+        self.d.sync()
+        return
+
+    def _scan_clients(self):
+        """ add newly managed windows to the candidate list, watching them for title changes """
+        for win in self._client_list():
+            if win.id in self.known: continue
+            self.known.add(win.id)
+            try:
+                win.change_attributes(event_mask=X.PropertyChangeMask)
+            except XError:
+                continue
+            self.candidates.add(win)
+
+    def _client_list(self):
+        prop = self.root.get_full_property(self.atom['_NET_CLIENT_LIST'], Xatom.WINDOW)
+        if prop is None: return []
+        return [self.d.create_resource_object('window', w) for w in prop.value]
+
+    def _matches(self, win, pid, titles):
+        try:
+            # a window that reports its PID is only ours if the PID matches, several
+            # monitors share one display so titles alone can pick another launch's window
+            if pid is not None:
+                prop = win.get_full_property(self.atom['_NET_WM_PID'], Xatom.CARDINAL)
+                if prop is not None: return prop.value[0] == pid
+            prop = win.get_full_property(self.atom['_NET_WM_NAME'], self.atom['UTF8_STRING'])
+            title = prop.value.decode('utf-8') if prop is not None else win.get_wm_name()
+        except XError:
+            # window went away
+            self.candidates.discard(win)
+            return False
+        return bool(title) and any(t in title for t in titles)
+
+    def _send_wm_message(self, win, type_name, data):
+        ev = ClientMessage(window=win, client_type=self.atom[type_name], data=(32, data))
+        self.root.send_event(
+            ev, event_mask=X.SubstructureRedirectMask | X.SubstructureNotifyMask
+            )
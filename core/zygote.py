@@ -0,0 +1,120 @@
+# pre-forked "zygote" launch server
+# imports the heavy CUD stack once, then forks a child per launch request
+# so each new display only pays for loading its own .ui and Display
+
+import sys
+import json
+import signal
+import socket
+from os import path, environ, fork, setsid, unlink, kill, _exit
+from core import local_ipc
+
+SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+
+# override with $F2_CUD_ZYGOTE to run more than one zygote per user
+SOCKET_PATH = local_ipc.socket_path('zygote')
+
+# env vars a launch request is allowed to set in the child
+CHILD_ENV_KEYS = ['DISPLAY', 'XAUTHORITY']
+
+# modules the zygote imports up front, shared copy-on-write with every child
+# pyepics only creates its CA context on first use, so importing it pre-fork is safe
+PRELOAD_MODULES = [
+    'numpy',
+    'yaml',
+    'matplotlib',
+    'PyQt5.QtCore',
+    'PyQt5.QtGui',
+    'PyQt5.QtWidgets',
+    'pyqtgraph',
+    'epics',
+    'pydm',
+    'pydm.widgets',
+    ]
+
+
+class ZygoteChild(object):
+    """ stand-in for the Popen object returned by launch.run_CUD """
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        """ children are reaped by the zygote, so only liveness is known """
+        try:
+            kill(self.pid, 0)
+        except ProcessLookupError:
+            self.returncode = -1
+        return self.returncode
+
+    def kill(self):
+        try:
+            kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def request_launch(CUD_ID, env=None, timeout=5.0):
+    """
+    ask a running zygote to fork <CUD_ID>, returns a ZygoteChild
+    raises FileNotFoundError/ConnectionRefusedError if there is no zygote listening
+    on SOCKET_PATH, socket.timeout if the zygote doesn't reply within <timeout>
+    """
+    if env is None: env = environ
+    request = {
+        'CUD_ID': CUD_ID,
+        'env': {k: env[k] for k in CHILD_ENV_KEYS if k in env},
+        }
+    reply = local_ipc.request(SOCKET_PATH, request, timeout)
+    if 'error' in reply: raise RuntimeError(f'zygote: {reply["error"]}')
+    return ZygoteChild(reply['pid'])
+
+def serve():
+    """ preload the CUD stack and fork a child per request, forever """
+    from importlib import import_module
+    for module in PRELOAD_MODULES: import_module(module)
+    from core import launch
+
+    # children are reaped automatically, they are watched by PID from then on
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    if path.exists(SOCKET_PATH): unlink(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    server.listen(8)
+    print(f'zygote listening on {SOCKET_PATH}')
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    request = json.loads(local_ipc.recv_line(conn))
+                    if not launch.is_hostable(request['CUD_ID']):
+                        raise KeyError(f'{request["CUD_ID"]} cannot be forked')
+                    pid = fork()
+                    if pid == 0:
+                        server.close()
+                        conn.close()
+                        _run_child(request)
+                    reply = {'pid': pid}
+                except Exception as e:
+                    reply = {'error': repr(e)}
+                local_ipc.send(conn, reply)
+    finally:
+        server.close()
+        unlink(SOCKET_PATH)
+
+def _run_child(request):
+    """ runs in the forked child, never returns """
+    code = 1
+    try:
+        setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        environ.update(request['env'])
+        from core import launch
+        code = launch.host_CUDs([request['CUD_ID']])
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        _exit(code)
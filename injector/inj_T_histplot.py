@@ -1,6 +1,5 @@
 import sys
 from os import path
-from pydm import Display
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QColor, QPen
 import pyqtgraph as pg
@@ -8,6 +7,9 @@ from matplotlib import colormaps as cm
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+sys.path.append(REPO_ROOT)
+from core import ui_cache
+
 sys.path.append('/usr/local/facet/tools/python/')
 from F2_pytools import inj_T_hist
 
@@ -29,7 +31,7 @@ for p in PENS:
     p.setCosmetic(True)
     p.setWidth(1)
 
-class F2_inj_T_plot(Display):
+class F2_inj_T_plot(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(F2_inj_T_plot, self).__init__(parent=parent, args=args)
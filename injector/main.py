@@ -1,16 +1,18 @@
 import sys
 from os import path
 from functools import partial
-from pydm import Display
 from pydm.widgets.channel import PyDMChannel
 from PyQt5.QtCore import QTimer
-from orbit import FacetOrbit, DiffOrbit, BaseOrbit, BPM
+from epics import get_pv
+from orbit import FacetOrbit, BPM
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 sys.path.append(REPO_ROOT)
 
-from core import beam_refs
+from core import beam_refs, image_pipeline
+from core.orbit_columns import OrbitColumns
+from core import ui_cache
 from widgets.orbit_view import OrbitView
 from widgets.InvertedPyDMImage import InvertedPyDMImage
 
@@ -20,7 +22,34 @@ ORBIT_TMIT_MAX = 1.4e10
 
 PV_REF_UPDATE = 'SIOC:SYS1:ML03:AO976'
 
-class F2_CUD_injector(Display):
+# IN10 - L1 orbit BPMs, all read through the TH BSA edef
+INJ_BPMS = [
+    "BPMS:IN10:221", "BPMS:IN10:371", "BPMS:IN10:425", "BPMS:IN10:511",
+    "BPMS:IN10:525", "BPMS:IN10:581", "BPMS:IN10:631", "BPMS:IN10:651",
+    "BPMS:IN10:731", "BPMS:IN10:771", "BPMS:IN10:781", "BPMS:LI11:132",
+    "BPMS:LI11:201", "BPMS:LI11:265", "BPMS:LI11:301", "BPMS:LI11:312",
+    "BPMS:LI11:333", "BPMS:LI11:358", "BPMS:LI11:362", "BPMS:LI11:393"
+    ]
+
+def make_orbit_data():
+    """ unconnected IN10 - L1 orbit, also used by core/orbit_stream.py """
+    live_orbit = FacetOrbit(
+        ignore_bad_bpms=True, rate_suffix='TH', scp_suffix='57',
+        name='FACET-II IN10 - L1 orbit'
+        )
+    live_orbit.bpms = []
+    for bpm_name in INJ_BPMS:
+        bpm = BPM(bpm_name, edef='TH')
+        if bpm.name in FacetOrbit.energy_bpms(): bpm.is_energy_bpm = True
+        live_orbit.append(bpm)
+
+    # the orbit object only supplies BPM metadata, live values are
+    # monitored straight into columns
+    return OrbitColumns.from_orbit(
+        live_orbit, suffixes={bpm_name: 'TH' for bpm_name in INJ_BPMS}
+        )
+
+class F2_CUD_injector(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(F2_CUD_injector, self).__init__(parent=parent, args=args)
@@ -28,27 +57,35 @@ class F2_CUD_injector(Display):
         VCCF_image = InvertedPyDMImage(
             im_ch='CAMR:LT10:900:Image:ArrayData',
             w_ch='CAMR:LT10:900:Image:ArraySize0_RBV',
-            parent=self.ui.frame_vccf
+            parent=self.ui.frame_vccf,
+            pipeline=image_pipeline.from_config(self, 'VCCF_image'),
             )
         VCCF_image.readingOrder = 1
         VCCF_image.colorMap = 1
         VCCF_image.showAxes = True
         VCCF_image.maxRedrawRate = 10
+        VCCF_image.lutRendering = True
         VCCF_image.setGeometry(0,0,382,327)
+        # limits are in camera pixels, the flip only inverts the view:
+        # the 1340x1000 pixels that were at the origin of the flipped frame (all of it at 1340x1000)
+        VCC_W = get_pv('CAMR:LT10:900:Image:ArraySize0_RBV').get()
+        VCC_H = get_pv('CAMR:LT10:900:Image:ArraySize1_RBV').get()
         VCCF_image.getView().getViewBox().setLimits(
-            xMin=0, xMax=1340, yMin=0, yMax=1000
+            xMin=VCC_W-1340, xMax=VCC_W, yMin=VCC_H-1000, yMax=VCC_H
             )
 
         CATH_image = InvertedPyDMImage(
             im_ch='CTHD:IN10:111:Image:ArrayData',
             w_ch='CTHD:IN10:111:Image:ArraySize0_RBV',
-            parent=self.ui.frame_cathodef
+            parent=self.ui.frame_cathodef,
+            pipeline=image_pipeline.from_config(self, 'CATH_image'),
             )
         CATH_image.readingOrder = 1
         CATH_image.colorMap = 1
         CATH_image.showAxes = True
         CATH_image.maxRedrawRate = 10
         CATH_image.normalizeData = True
+        CATH_image.lutRendering = True
         CATH_image.setGeometry(0,0,382,327)
         # CATH_image.getView().getViewBox().setLimits(
         #     xMin=90, xMax=280, yMin=90, yMax=280
@@ -57,27 +94,11 @@ class F2_CUD_injector(Display):
         # setup IN10 - TD11 orbit
         self.draw_orbit = QTimer(self)
 
-        inj_BPMs = [
-            "BPMS:IN10:221", "BPMS:IN10:371", "BPMS:IN10:425", "BPMS:IN10:511",
-            "BPMS:IN10:525", "BPMS:IN10:581", "BPMS:IN10:631", "BPMS:IN10:651",
-            "BPMS:IN10:731", "BPMS:IN10:771", "BPMS:IN10:781", "BPMS:LI11:132",
-            "BPMS:LI11:201", "BPMS:LI11:265", "BPMS:LI11:301", "BPMS:LI11:312",
-            "BPMS:LI11:333", "BPMS:LI11:358", "BPMS:LI11:362", "BPMS:LI11:393"
-            ]
-
-        self.live_orbit = FacetOrbit(
-            ignore_bad_bpms=True, rate_suffix='TH', scp_suffix='57',
-            name='FACET-II IN10 - L1 orbit'
-            )
-        self.live_orbit.bpms = []
-        for bpm_name in inj_BPMs:
-            bpm = BPM(bpm_name, edef='TH')
-            if bpm.name in FacetOrbit.energy_bpms(): bpm.is_energy_bpm = True
-            self.live_orbit.append(bpm)
-        self.live_orbit.connect()
+        self.orbit_data = make_orbit_data()
+        self.orbit_data.connect()
         cud_orbit = partial(OrbitView,
-            parent=self, draw_timer=self.draw_orbit.start(),
-            units="mm",  ymin=-ORBIT_POS_SCALE, ymax=ORBIT_POS_SCALE, orbit=self.live_orbit
+            parent=self, draw_timer=self.draw_orbit, max_draw_rate=ORBIT_DRAW_RATE,
+            units="mm",  ymin=-ORBIT_POS_SCALE, ymax=ORBIT_POS_SCALE, orbit=self.orbit_data
             )
 
         self.xOrbitView = cud_orbit(axis="x", name="X", label="X")
@@ -96,7 +117,7 @@ class F2_CUD_injector(Display):
         self.setWindowTitle('FACET-II CUD: Injector')
 
         self.reference_orbit = None
-        self.difference_orbit = None
+        self.ref_watcher = beam_refs.RefWatcher(['orbit_inj'])
         ref_update_flag = PyDMChannel(address=PV_REF_UPDATE, value_slot=self.update_ref_orbit)
         ref_update_flag.connect()
 
@@ -106,26 +127,26 @@ class F2_CUD_injector(Display):
         return path.join(SELF_PATH, 'main.ui')
 
     def update_ref_orbit(self):
-        ref_dict = beam_refs.read_current_refs()
-        orbit_fpath, ftype = ref_dict['orbit_inj'], 'Absolute'
+        # only reload when the orbit_inj reference was republished
+        changed = self.ref_watcher.changed()
+        if 'orbit_inj' not in changed: return
+        orbit_fpath, ftype = changed['orbit_inj']['path'], 'Absolute'
         if orbit_fpath != 'NOTSET':
             try:
-                self.reference_orbit = BaseOrbit.from_MATLAB_file(orbit_fpath)
-                fname = path.split(orbit_fpath)[-1]
+                self.reference_orbit = beam_refs.load_orbit_array(orbit_fpath)
                 ftype = 'Diff'
-                self.difference_orbit = DiffOrbit(self.live_orbit, self.reference_orbit)
                 print(f"Reference orbit loaded from file {orbit_fpath}")
             except Exception as e:
-                print("Couldn't load orbit from MATLAB file.")
-                print("Only MATLAB files created by Orbit Display are supported\n")
+                print("Couldn't load reference orbit file.")
+                print("Only MATLAB/JSON files created by Orbit Display are supported\n")
                 raise(e)
         self.ui.ref_orbit_name.setText(path.split(orbit_fpath)[-1])
         self.ui.label_orbit_type.setText(ftype)
 
-        orbit = self.live_orbit
-        if ftype == 'Diff': orbit = DiffOrbit(self.live_orbit, self.reference_orbit)
-        self.xOrbitView.set_orbit(orbit)
-        self.yOrbitView.set_orbit(orbit)
+        # the reference is aligned to the live BPMs once here, the views
+        # subtract it from the live columns on every redraw
+        if ftype != 'Diff': self.reference_orbit = None
+        self.orbit_data.set_reference(self.reference_orbit)
         return
 
 
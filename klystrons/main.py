@@ -1,12 +1,13 @@
 import os, sys
 from os import path
-from pydm import Display
 from PyQt5.QtWidgets import QGridLayout
 from PyQt5.QtGui import QFont
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 sys.path.append(REPO_ROOT)
+
+from core import ui_cache
 from widgets.klystronStatusIndicator import sbstIndicator, klysIndicator
 
 # L2: S11-S14, L3: S15-S19, 8x klys per sector
@@ -23,7 +24,7 @@ STATUS_FONT.setBold(True)
 STATUS_FONT.setPointSize(22)
 
 
-class F2_CUD_klystrons(Display):
+class F2_CUD_klystrons(ui_cache.CachedUIDisplay):
     def __init__(self, parent=None, args=None):
         super(F2_CUD_klystrons, self).__init__(parent=parent, args=args)
 
@@ -1,18 +1,76 @@
 # launcher script to spawn FACET-II CUDs
-# desired display to launch is 1st (and only) arg
+# desired display to launch is 1st arg, several displays are spawned into one shared host process
+# with --host, all following displays are run in one shared process
+# with --zygote, starts the pre-forked launch server used by launch.run_CUD
+# with --supervise, starts the daemon that owns & restarts ACR monitor CUDs
+# with --bench, times start-up of one or all CUDs offscreen (see core/bench.py)
+# with --build-ui-cache, precompiles every .ui file (see core/ui_cache.py)
+# with --image-bench, times/counts allocations of the camera image path (see core/image_bench.py)
+# with --orbit-stream, records/replays BPM streams & benchmarks OrbitView (see core/orbit_stream.py)
+# with --frame-broker, serves camera frames to local CUDs over shared memory (see core/frame_broker.py)
+# with --pv-writer, writes PVs through the batched ACR PV writer (see core/pv_writer.py)
 
-from sys import argv
-from core import launch, common
+from sys import argv, exit
+from core import launch, common, zygote, bench
 
 def show_help():
     print('Usage:')
     print('  $ python launcher.py [CUD_NAME]')
+    print('  $ python launcher.py [CUD_NAME] [CUD_NAME] ...')
+    print('  $ python launcher.py --host [CUD_NAME] [CUD_NAME] ...')
+    print('  $ python launcher.py --zygote')
+    print('  $ python launcher.py --supervise')
+    print('  $ python launcher.py --bench [CUD_NAME|all] [--baseline report.json]')
+    print('  $ python launcher.py --build-ui-cache')
+    print('  $ python launcher.py --image-bench [--shape ROWS COLS] [--frames N] [--render|--delivery] [--pipeline [DISPLAY WIDGET]]')
+    print('  $ python launcher.py --orbit-stream record [injector|S20] [FILE] [--seconds N]')
+    print('  $ python launcher.py --orbit-stream bench [FILE] [--bpms N --rate HZ] [--speed X]')
+    print('  $ python launcher.py --frame-broker [CAMERA ...] [--synthetic CAMERA] [--selftest]')
+    print('  $ python launcher.py --pv-writer [PV=VALUE ...] [--selftest]')
     print('  where [CUD_NAME] is one of:')
     for name in common.CUD_IDs(): print(f'  * {name}')
     print()
 
 def main():
     try:
+        if argv[1] == '--zygote':
+            zygote.serve()
+            return
+        if argv[1] == '--build-ui-cache':
+            # imports pydm, so only pay for it when asked
+            from core import ui_cache
+            ui_cache.build_all()
+            return
+        if argv[1] == '--supervise':
+            # pulls in pyepics & the remote control setup, only import when asked
+            from core import supervisor
+            supervisor.serve()
+            return
+        if argv[1] == '--image-bench':
+            from core import image_bench
+            exit(image_bench.main(argv[2:]))
+        if argv[1] == '--orbit-stream':
+            # needs numpy/Qt/pyqtgraph, only import when asked
+            from core import orbit_stream
+            exit(orbit_stream.main(argv[2:]))
+        if argv[1] == '--frame-broker':
+            from core import frame_broker
+            exit(frame_broker.main(argv[2:]))
+        if argv[1] == '--pv-writer':
+            from core import pv_writer
+            exit(pv_writer.main(argv[2:]))
+        if argv[1] == '--bench':
+            exit(bench.main(argv[2:]))
+        if argv[1] == '--host':
+            targets = argv[2:]
+            if not targets: raise IndexError
+            print(f' -> Hosting FACET-II CUDs: {", ".join(targets)}')
+            exit(launch.host_CUDs(targets))
+        targets = argv[1:]
+        if len(targets) > 1:
+            print(f' -> Launching FACET-II CUDs: {", ".join(targets)}')
+            launch.run_CUD_host(targets)
+            return
         target = argv[1]
         print(f' -> Launching FACET-II {target} CUD')
         launch.run_CUD(target)
@@ -3,13 +3,14 @@ from os import path
 from epics import get_pv
 from datetime import datetime as dt
 from functools import partial
-from pydm import Display
 from pydm.widgets.channel import PyDMChannel
 from PyQt5.QtGui import QFont
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 sys.path.append(REPO_ROOT)
+
+from core import ui_cache
 from widgets.bitStatusLabel import bitStatusLabel
 from widgets.SCPSteeringFBIndicator import SCPSteeringFBIndicator
 
@@ -48,7 +49,7 @@ PyDMLabel[alarmSensitiveBorder="true"][alarmSeverity="0"] {
 """
 
 
-class F2_CUD_linac(Display):
+class F2_CUD_linac(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(F2_CUD_linac, self).__init__(parent=parent, args=args)
@@ -2,7 +2,6 @@ import sys
 from os import path
 from sys import exit
 from functools import partial
-from pydm import Display
 from PyQt5.QtCore import QTimer, Qt
 from PyQt5.QtGui import QColor, QPen
 import pyqtgraph as pg
@@ -12,6 +11,8 @@ SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 sys.path.append(REPO_ROOT)
 
+from core import ui_cache
+
 sys.path.append('/usr/local/facet/tools/python/')
 from F2_pytools.dpmdl import normed_pmdl_history, temp_prs_history
 
@@ -34,7 +35,7 @@ for p in PENS:
     p.setCosmetic(True)
     p.setWidth(2)
 
-class F2_dpmdl_plot(Display):
+class F2_dpmdl_plot(ui_cache.CachedUIDisplay):
     def __init__(self, parent=None, args=None):
         super(F2_dpmdl_plot, self).__init__(parent=parent, args=args)
         self.update_hist = QTimer(self)
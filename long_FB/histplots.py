@@ -1,12 +1,13 @@
 import sys
 from os import path
-from pydm import Display
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 sys.path.append(REPO_ROOT)
 
-class F2longHist(Display):
+from core import ui_cache
+
+class F2longHist(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(F2longHist, self).__init__(parent=parent, args=args)
@@ -4,11 +4,13 @@ import sys
 from os import path
 import yaml
 from PyQt5.QtGui import QFont
-from pydm import Display
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 sys.path.append(REPO_ROOT)
+
+from core import ui_cache
+
 sys.path.append('/usr/local/facet/tools/python/')
 from F2_long_feedback.loop_stat_label import lfbLoopStatusLabel
 
@@ -54,7 +56,7 @@ LOOP_STATUS_STYLESHEETS = {
 STATUS_FONT = QFont()
 STATUS_FONT.setPointSize(18)
 
-class facetFeedbackCUD(Display):
+class facetFeedbackCUD(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(facetFeedbackCUD, self).__init__(parent=parent, args=args)
@@ -2,13 +2,14 @@ import sys
 from os import path, environ
 from functools import partial
 from socket import gethostname
+from time import time
 import yaml
 from epics import caget
 from pydm import Display
 from pydm.widgets.label import PyDMLabel
 from pydm.widgets.channel import PyDMChannel
-from PyQt5.QtWidgets import QPushButton, QComboBox, QFileDialog
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QPushButton, QComboBox, QFileDialog, QLabel
+from PyQt5.QtCore import Qt, QTimer
 
 SELF_PATH = path.dirname(path.abspath(__file__))
 REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
@@ -17,7 +18,8 @@ with open(path.join(REPO_ROOT, 'core', 'config.yaml'), 'r') as f:
 
 sys.path.append(REPO_ROOT)
 
-from core import launch, common, beam_refs
+from core import launch, common, beam_refs, telemetry
+from core.job_queue import JobQueue, JobCancelled
 import core.ACR_remote_control as rctrl
 
 
@@ -32,6 +34,11 @@ color: rgb(200,200,200);
 }
 """
 
+STYLE_DEAD = """
+background-color: rgb(180,0,0);
+color: rgb(255,255,255);
+"""
+
 STYLE_LAUNCH = """
 QPushButton[enabled="true"] {
 background-color: rgb(144,194,255);
@@ -61,15 +68,37 @@ class F2CUDManager(Display):
         self.SM_names = rctrl.SM_names()
 
         self.default_displays = _load_ACR_defaults()
+        self.layouts = rctrl.get_layouts()
 
         self.CUD_selectors = {}
         self.kill_buttons = {}
         self.launch_buttons = {}
+        self.PID_labels = {}
+        self.telemetry_labels = {}
+
+        # remote launches/kills run on a worker pool, rows with a job in flight
+        # stay disabled until it finishes
+        self.busy_monitors = set()
+        self.monitor_has_display = {}
+        self.jobs = JobQueue(rctrl.MAX_LAUNCH_WORKERS, parent=self)
+        self.jobs.status.connect(self.status)
+        self.jobs.job_started.connect(self._on_job_started)
+        self.jobs.job_finished.connect(self._on_job_finished)
+
+        # per-monitor resource use, sampled from the PIDs in the :PID PVs
+        self.monitor_PIDs = {}
+        self.telemetry_history = {}
+        self.proc_sampler = telemetry.ProcSampler()
 
         self.init_CUD_summary(monitors=self.LM_names, layout=self.ui.LM_control.layout())
         self.init_CUD_summary(monitors=self.SM_names, layout=self.ui.SM_control.layout())
         self.init_local_launch_buttons()
 
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.setInterval(telemetry.INTERVAL_MS)
+        self.telemetry_timer.timeout.connect(self.update_telemetry)
+        self.telemetry_timer.start()
+
         self.ui.autosetup_LM.clicked.connect(
             partial(self.launch_monitors, monitors=self.LM_names)
             )
@@ -78,9 +107,13 @@ class F2CUDManager(Display):
             )
         self.ui.autosetup_all.clicked.connect(self.launch_full_quadrant)
 
+        self.ui.layout_select.addItems(list(self.layouts))
+        self.ui.apply_layout.clicked.connect(self.apply_selected_layout)
+
         self.ui.kill_LM.clicked.connect(partial(self.kill_monitors, monitors=self.LM_names))
         self.ui.kill_SM.clicked.connect(partial(self.kill_monitors, monitors=self.SM_names))
         self.ui.kill_all.clicked.connect(self.kill_everything)
+        self.ui.cancel_jobs.clicked.connect(self.cancel_jobs)
 
         self.ref_labels = {
             'orbit_inj': self.ui.ref_ts_orbit_inj,
@@ -123,8 +156,12 @@ class F2CUDManager(Display):
         * 'kill' button for current display, if any
         * dropdown menu to select CUDs, populated from ACR_defaults.csv
         * 'launch' button to send displays to LM/SMs
+        * resource use of the running display (see core/telemetry.py)
         """
 
+        # full CPU/RSS/threads/CA/loop lag readout is in each row's tooltip
+        layout.addWidget(QLabel('Usage'), 0, 7)
+
         for i_monitor, monitor in enumerate(monitors):
 
             label_disp = PyDMLabel(init_channel=rctrl.CUD_PV_disp(monitor))
@@ -143,12 +180,28 @@ class F2CUDManager(Display):
             launch_button = QPushButton('Launch')
             launch_button.clicked.connect(partial(self.remote_CUD_launch, monitor=monitor))
 
-            # watch the :PID PV and enable controls accordingly
+            # watch the :DISPLAY PV and enable controls accordingly
+            # the supervisor keeps it set while it restarts a crashed display
+            monitor_disp_channel = PyDMChannel(
+                address=rctrl.CUD_PV_disp(monitor),
+                value_slot=partial(self.set_control_enable_states, monitor=monitor))
+            monitor_disp_channel.connect()
+
+            # keep track of the PID for resource telemetry
             monitor_PID_channel = PyDMChannel(
                 address=rctrl.CUD_PV_pid(monitor),
-                value_slot=partial(self.set_control_enable_states, monitor=monitor))
+                value_slot=partial(self.set_monitor_PID, monitor=monitor))
             monitor_PID_channel.connect()
 
+            # flag displays the supervisor reports as dead/restarting
+            monitor_alive_channel = PyDMChannel(
+                address=rctrl.CUD_PV_alive(monitor),
+                value_slot=partial(self.set_liveness, monitor=monitor))
+            monitor_alive_channel.connect()
+
+            label_telemetry = QLabel('')
+            label_telemetry.setFixedWidth(70)
+
             label_disp.setMinimumWidth(130)
             label_pid.setFixedWidth(80)
             label_wid.setFixedWidth(100)
@@ -170,6 +223,7 @@ class F2CUDManager(Display):
                 kill_button,
                 CUD_select,
                 launch_button,
+                label_telemetry,
                 ]):
                 layout.addWidget(elem, i_row, i_elem+1)
 
@@ -178,25 +232,64 @@ class F2CUDManager(Display):
             self.CUD_selectors[monitor]  = CUD_select
             self.kill_buttons[monitor]   = kill_button
             self.launch_buttons[monitor] = launch_button
+            self.PID_labels[monitor]     = label_pid
+            self.telemetry_labels[monitor] = label_telemetry
+            self.telemetry_history[monitor] = telemetry.TelemetryHistory()
 
             current_disp = bool(caget(rctrl.CUD_PV_disp(monitor)))
+            self.monitor_has_display[monitor] = current_disp
             kill_button.setEnabled(current_disp)
             launch_button.setEnabled(not current_disp)
 
         return
 
+    def set_monitor_PID(self, new_value, monitor):
+        """ slot for :PID PV changes, a new process starts a fresh history """
+        try:
+            pid = int(new_value)
+        except (TypeError, ValueError):
+            pid = None
+        if pid != self.monitor_PIDs.get(monitor):
+            self.telemetry_history[monitor].clear()
+            self.telemetry_labels[monitor].setText('')
+        self.monitor_PIDs[monitor] = pid
+        return
+
+    def update_telemetry(self):
+        """ sample CPU/RSS/threads/CA channels/loop lag for every running CUD """
+        for monitor, pid in self.monitor_PIDs.items():
+            if pid is None: continue
+            sample = self.proc_sampler.sample(pid)
+            if sample: self.telemetry_history[monitor].append(sample)
+            self.telemetry_labels[monitor].setText(telemetry.short_summary(sample))
+            self.telemetry_labels[monitor].setToolTip(telemetry.summary(sample))
+        return
+
     def set_control_enable_states(self, new_value, monitor):
         """
-        disable/enable the launch/kill buttons if the ACR monitor's PID PV is set 
+        disable/enable the launch/kill buttons if the ACR monitor's DISPLAY PV is set 
         """
-        monitor_has_display = bool(new_value)
-        self.kill_buttons[monitor].setEnabled(monitor_has_display)
-        self.CUD_selectors[monitor].setEnabled(not monitor_has_display)
-        self.launch_buttons[monitor].setEnabled(not monitor_has_display)
+        self.monitor_has_display[monitor] = bool(new_value)
+        self._update_row_controls(monitor)
+        return
+
+    def _update_row_controls(self, monitor):
+        """ the whole row is disabled while a job for this monitor is running """
+        monitor_has_display = self.monitor_has_display.get(monitor, False)
+        idle = monitor not in self.busy_monitors
+        self.kill_buttons[monitor].setEnabled(idle and monitor_has_display)
+        self.CUD_selectors[monitor].setEnabled(idle and not monitor_has_display)
+        self.launch_buttons[monitor].setEnabled(idle and not monitor_has_display)
         self.kill_buttons[monitor].setStyleSheet(STYLE_KILL)
         self.launch_buttons[monitor].setStyleSheet(STYLE_LAUNCH)
         return
 
+    def set_liveness(self, new_value, monitor):
+        """ highlight the PID of a display the supervisor reports as not running """
+        style = STYLE_DEAD if (new_value == 0 and self.monitor_has_display.get(monitor)) else ''
+        self.PID_labels[monitor].setStyleSheet(style)
+        return
+
     def init_local_launch_buttons(self):
         """ connect each button on the 'run locally' tab to a launch method """
         buttons = {
@@ -235,51 +328,143 @@ class F2CUDManager(Display):
         CUD_desc = self.CUD_selectors[monitor].currentText()
         CUD_ID = common.CUD_ID(CUD_desc)
         self.status(f'Launching display: [{CUD_desc}] on: {monitor} ({mon_ID}) ...')
-        rctrl.send_to_monitor(monitor, CUD_ID)
+        self.jobs.submit(
+            f'launch {monitor}', _launch_job, monitor, CUD_ID,
+            monitors=[monitor],
+            )
         return
 
     def kill_CUD(self, monitor):
         mon_ID = rctrl.get_display_name(monitor)
         self.status(f'Killing display on: {monitor} ({mon_ID}) ...')
-        # TO DO: disable buttons when working and when done
-        rctrl.kill_monitor(monitor)
+        self.jobs.submit(
+            f'kill {monitor}', _kill_job, monitor,
+            monitors=[monitor],
+            )
         return
 
-    def launch_monitors(self, monitors):
-        """ launch default displays on all monitors (LM or SM) """
-        i_mon = 1 if (monitors == self.LM_names) else 2
-        self.ui.CUD_summary.setCurrentIndex(i_mon)
-        self._update_CUD_summary()
+    def launch_monitors(self, monitors, then=None):
+        """ launch selected displays on all monitors (LM or SM) at once """
+        self._show_monitor_tab(monitors)
+        assignments = {}
         for monitor in monitors:
-            self.remote_CUD_launch(monitor)
-            self._update_CUD_summary()
-        self.ui.CUD_summary.setCurrentIndex(0)
-        self.status('Done.')
+            assignments[monitor] = common.CUD_ID(self.CUD_selectors[monitor].currentText())
+        self._launch_assignments(assignments, then)
         return
 
-    def kill_monitors(self, monitors):
-        """ kill displays on all monitors (LM or SM) """
-        i_mon = 1 if (monitors == self.LM_names) else 2
-        self.ui.CUD_summary.setCurrentIndex(i_mon)
-        self._update_CUD_summary()
-        for monitor in monitors:
-            self.kill_CUD(monitor)
-            self._update_CUD_summary()
-        self.ui.CUD_summary.setCurrentIndex(0)
-        self.status('Done.')
+    def _launch_assignments(self, assignments, then=None):
+        """ one launch job per {monitor: CUD_ID} entry, skipping rows that are busy """
+        jobs = []
+        for monitor, CUD_ID in assignments.items():
+            if monitor in self.busy_monitors: continue
+            jobs.append((f'launch {monitor}', _launch_job, (monitor, CUD_ID), [monitor]))
+            self.status(f'Launching display: [{common.CUD_desc(CUD_ID)}] on: {monitor} ...')
+        self._submit_batch(jobs, then)
+        return
 
-    def _update_CUD_summary(self):
-        self.ui.CUD_summary.repaint()
+    def kill_monitors(self, monitors, then=None):
+        """ kill displays on all monitors (LM or SM) at once """
+        self._show_monitor_tab(monitors)
+        jobs = []
+        for monitor in monitors:
+            if monitor in self.busy_monitors: continue
+            jobs.append((f'kill {monitor}', _kill_job, (monitor,), [monitor]))
+            self.status(f'Killing display on: {monitor} ...')
+        self._submit_batch(jobs, then)
+        return
 
     def launch_full_quadrant(self):
-        self.kill_everything()
-        self.launch_monitors(monitors=self.LM_names)
-        self.launch_monitors(monitors=self.SM_names)
+        """ get every monitor showing what its dropdown says, relaunching only the ones that differ """
+        layout = {}
+        for monitor in self.LM_names + self.SM_names:
+            layout[monitor] = common.CUD_ID(self.CUD_selectors[monitor].currentText())
+        self.apply_layout(layout)
+
+    def apply_selected_layout(self):
+        """ set the dropdowns from the selected preset and apply it """
+        name = self.ui.layout_select.currentText()
+        layout = {}
+        for monitor, CUD_ID in self.layouts[name].items():
+            if monitor not in self.CUD_selectors: continue
+            if CUD_ID is not None: _set_dropdown_default(self.CUD_selectors[monitor], CUD_ID)
+            layout[monitor] = CUD_ID
+        self.status(f'Applying layout: {name}')
+        self.apply_layout(layout)
+
+    def apply_layout(self, layout):
+        """
+        compare <layout> ({monitor: CUD_ID}) against the :DISPLAY/:PID PVs,
+        kill and launch only the monitors that differ, then check the rest are still alive
+        """
+        self.jobs.submit(
+            'plan layout', _plan_job, layout,
+            monitors=list(layout), then=self._apply_plan,
+            )
+        return
+
+    def _apply_plan(self, job, error):
+        """ kill phase -> launch phase -> liveness check of untouched monitors """
+        if error is not None: return
+        plan = job.result
+        self.status(
+            f'Layout: {len(plan["keep"])} unchanged, '
+            f'{len(plan["kill"])} to kill, {len(plan["launch"])} to launch.'
+            )
+        def _launch_phase(errors):
+            if self._batch_cancelled(errors): return
+            self._launch_assignments(plan['launch'], then=_verify_phase)
+        def _verify_phase(errors):
+            if self._batch_cancelled(errors) or not plan['keep']: return
+            self.jobs.submit('check unchanged', _check_alive_job, plan['keep'])
+        self.kill_monitors(plan['kill'], then=_launch_phase)
+        return
 
-    def kill_everything(self):
+    def kill_everything(self, then=None):
         self.status('Commencing hostilities.')
-        self.kill_monitors(monitors=self.LM_names)
-        self.kill_monitors(monitors=self.SM_names)
+        self.kill_monitors(monitors=self.LM_names + self.SM_names, then=then)
+
+    def cancel_jobs(self):
+        """ drop queued jobs, running ones stop before their next step """
+        self.status('Cancelling ...')
+        self.jobs.cancel_all()
+        return
+
+    def _submit_batch(self, jobs, then=None):
+        """ queue a batch of per-monitor jobs and report the total time when they're all done """
+        t0 = time()
+        def _batch_done(errors):
+            if errors: self.status(f'Done ({time()-t0:.1f}s).')
+            if then is not None: then(errors)
+        self.jobs.submit_batch(jobs, then=_batch_done)
+        return
+
+    def _show_monitor_tab(self, monitors):
+        """ switch to the LM/SM tab so progress on each row is visible """
+        if monitors == self.LM_names:   self.ui.CUD_summary.setCurrentIndex(1)
+        elif monitors == self.SM_names: self.ui.CUD_summary.setCurrentIndex(2)
+
+    def _batch_cancelled(self, errors):
+        return any(isinstance(e, JobCancelled) for e in errors.values())
+
+    def _on_job_started(self, job):
+        self.busy_monitors.update(job.monitors)
+        for monitor in job.monitors: self._update_row_controls(monitor)
+        self.ui.cancel_jobs.setEnabled(True)
+        return
+
+    def _on_job_finished(self, job, error):
+        self._report_job_done(job, error)
+        self.busy_monitors = self.jobs.busy_monitors()
+        for monitor in job.monitors: self._update_row_controls(monitor)
+        self.ui.cancel_jobs.setEnabled(bool(self.jobs.active))
+        return
+
+    def _report_job_done(self, job, error):
+        """ per-job completion line """
+        if error is None:                       self.status(f'  {job.name}: OK')
+        elif isinstance(error, JobCancelled):   self.status(f'  {job.name}: cancelled')
+        else:                                   self.status(f'  {job.name}: FAILED ({error})')
+        return
 
     def refresh_beam_refs(self):
         # set the beam ref labels appropriately from current_refs.csv
@@ -309,6 +494,25 @@ class F2CUDManager(Display):
         filename = str(QFileDialog.getOpenFileName(self, "Open File", matlab_data_dir, "Orbit data files (*.mat *.json)")[0])
         return filename
 
+def _launch_job(job, monitor, CUD_ID):
+    """ worker-pool side of a remote launch """
+    job.status(f'  {monitor}: starting [{CUD_ID}] ...')
+    rctrl.send_to_monitor(monitor, CUD_ID, check=job.check_cancelled)
+
+def _kill_job(job, monitor):
+    """ worker-pool side of a remote kill """
+    job.status(f'  {monitor}: killing ...')
+    rctrl.kill_monitor(monitor)
+
+def _plan_job(job, layout):
+    """ worker-pool side of apply_layout, reads the current state of every monitor """
+    job.status(f'  reading the state of {len(layout)} monitors ...')
+    return rctrl.plan_layout(layout)
+
+def _check_alive_job(job, monitors):
+    dead = rctrl.check_alive(monitors)
+    if dead: raise RuntimeError(f'not running: {", ".join(dead)}')
+
 def _load_ACR_defaults():
     """" load default display setting for each LM/SM from config file """
     defaults = {}
@@ -1,11 +1,15 @@
+import sys
 from os import path
-from pydm import Display
 from matplotlib.pyplot import get_cmap
 from numpy import linspace
 
 SELF_PATH = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
+sys.path.append(REPO_ROOT)
 
-class F2Transport(Display):
+from core import ui_cache
+
+class F2Transport(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(F2Transport, self).__init__(parent=parent, args=args)
@@ -56,4 +60,4 @@ class F2Transport(Display):
         return
 
     def ui_filename(self):
-        return os.path.join(SELF_PATH, 'main.ui')
+        return path.join(SELF_PATH, 'main.ui')
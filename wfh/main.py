@@ -4,9 +4,8 @@ from functools import partial
 from epics import get_pv
 from datetime import datetime as dt
 from PyQt5.QtWidgets import QGridLayout
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QFont
-from pydm import Display
 from pydm.widgets.channel import PyDMChannel
 
 SELF_PATH = path.dirname(path.abspath(__file__))
@@ -14,6 +13,9 @@ REPO_ROOT = path.join(*path.split(SELF_PATH)[:-1])
 
 sys.path.append(REPO_ROOT)
 
+from core import image_pipeline
+from core.frame_mailbox import FrameFeed
+from core import ui_cache
 from widgets.bitStatusLabel import bitStatusLabel
 from widgets.klystronStatusIndicator import sbstIndicator, klysIndicator
 from widgets.InvertedPyDMImage import InvertedPyDMImage
@@ -44,17 +46,19 @@ NONEXISTANT_RFS = ['11-3', '14-7', '15-2', '19-7', '19-8']
 
 STAT_REG  = QFont('Sans Serif', 18)
 
-class F2_WFH(Display):
+class F2_WFH(ui_cache.CachedUIDisplay):
 
     def __init__(self, parent=None, args=None):
         super(F2_WFH, self).__init__(parent=parent, args=args)
 
         self.setWindowTitle('FACET-II work-from-home CUD')
 
+        # frames reach the camera views through FrameFeeds set up below
         self.SYAG_image = InvertedPyDMImage(
-            im_ch='CAMR:LI20:100:Image:ArrayData',
+            im_ch=None,
             w_ch='CAMR:LI20:100:Image:ArraySize0_RBV',
-            parent=self.ui.frame_SYAG
+            parent=self.ui.frame_SYAG,
+            pipeline=image_pipeline.from_config(self, 'SYAG_image'),
             )
         self.SYAG_image.setScaleXAxis(get_pv(f'CAMR:LI20:100:RESOLUTION').value*1e-3)
         self.SYAG_image.setScaleYAxis(get_pv(f'CAMR:LI20:100:RESOLUTION').value*1e-3)
@@ -64,9 +68,10 @@ class F2_WFH(Display):
         self.SYAG_image.setGeometry(0,0, 446,177)
 
         self.VCCF_image = InvertedPyDMImage(
-            im_ch='CAMR:LT10:900:Image:ArrayData',
+            im_ch=None,
             w_ch='CAMR:LT10:900:Image:ArraySize0_RBV',
-            parent=self.ui.frame_vcc
+            parent=self.ui.frame_vcc,
+            pipeline=image_pipeline.from_config(self, 'VCCF_image'),
             )
         self.SYAG_image.setScaleXAxis(get_pv(f'CAMR:LT10:900:RESOLUTION').value*1e-3)
         self.SYAG_image.setScaleYAxis(get_pv(f'CAMR:LT10:900:RESOLUTION').value*1e-3)
@@ -129,6 +134,17 @@ class F2_WFH(Display):
         self.ui.fps_DTOTR2.setCurrentText('10')
         self.update_camera_FPS()
 
+        # cameras publish faster than these views paint, only the newest frame
+        # is handed over at each redraw, frame counts go in the FPS tooltips
+        self.camera_feeds = {
+            self.ui.fps_VCC: FrameFeed(self.VCCF_image, 'CAMR:LT10:900:Image:ArrayData', parent=self),
+            self.ui.fps_SYAG: FrameFeed(self.SYAG_image, 'CAMR:LI20:100:Image:ArrayData', parent=self),
+            self.ui.fps_DTOTR2: FrameFeed(self.ui.live_DTOTR2, 'CAMR:LI20:107:Image:ArrayData', parent=self),
+            }
+        self.camera_stats = QTimer(self)
+        self.camera_stats.timeout.connect(self.show_camera_stats)
+        self.camera_stats.start(5000)
+
         ind_XTCAVF = klysIndicator('20-4', parent=self.ui.cont_XTCAVF, mini=True)
         ind_XTCAVF.setGeometry(0,0,60,50)
 
@@ -156,6 +172,14 @@ class F2_WFH(Display):
         self.ui.live_DTOTR2.maxRedrawRate = int(self.ui.fps_DTOTR2.currentText())
         return
 
+    def show_camera_stats(self):
+        for fps_select, feed in self.camera_feeds.items():
+            stats = feed.stats()
+            fps_select.setToolTip(
+                f'frames received: {stats["received"]}, painted: {stats["painted"]}, dropped: {stats["dropped"]}'
+                )
+        return
+
     def msmt_ts(self, PV_msmt_obj, label_obj, value=None, char_value=None, **kw):
         """ sets the text of <label_obj> to the update timestamp of PV_msmt_obj """
         ts_str = str(dt.fromtimestamp(PV_msmt_obj.timestamp).strftime('%d-%b-%Y %H:%M'))
@@ -1,11 +1,57 @@
 from pydm.widgets.image import PyDMImageView
-from numpy import flip
+from PyQt5.QtCore import pyqtProperty
+from core import frame_broker, image_pipeline
 
 class InvertedPyDMImage(PyDMImageView):
     """
-    subclass to flip iamge in X/Y - performance intensive :(
+    subclass to flip image in X/Y
+    flips are done by inverting the view's axes, pixel data is never copied or
+    reordered, so ROI limits and axis scaling stay in camera pixel coordinates
+    transposition is the existing readingOrder property
+    other processing goes in an optional core.image_pipeline.Pipeline
+    lutRendering draws frames through a precomputed colormap LUT instead of
+    per-frame levels & colormapping, set it after normalizeData/colorMap limits
     """
-    def __init__(self, im_ch, w_ch, parent=None, args=None):
+    def __init__(self, im_ch, w_ch, parent=None, args=None, flip_x=True, flip_y=True, pipeline=None):
+        frame_broker.install_plugin()
+        im_ch, w_ch = frame_broker.address(im_ch), frame_broker.address(w_ch)
         PyDMImageView.__init__(self, parent=parent, image_channel=im_ch, width_channel=w_ch)
+        # ImageView already inverts Y (image rows go down), flips are relative to that
+        view_box = self.getView().getViewBox()
+        self._base_inverted = (view_box.xInverted(), view_box.yInverted())
+        self._flip_x = self._flip_y = None
+        self.flipX = flip_x
+        self.flipY = flip_y
+        self.setPipeline(pipeline)
 
-    def process_image(self, image): return flip(image)
\ No newline at end of file
+    def setPipeline(self, pipeline):
+        """ run <pipeline> on each frame before it's drawn, None for no processing """
+        self.pipeline = pipeline
+        image_pipeline.attach(self, pipeline)
+
+    @pyqtProperty(bool)
+    def lutRendering(self):
+        return self.pipeline is not None and self.pipeline.stage('colormap') is not None
+
+    @lutRendering.setter
+    def lutRendering(self, enable):
+        if enable == self.lutRendering: return
+        stages = [s for s in (self.pipeline.stages if self.pipeline else []) if s.name != 'colormap']
+        if enable: stages.append(image_pipeline.Colormap())
+        self.setPipeline(image_pipeline.Pipeline(stages) if stages else None)
+
+    @pyqtProperty(bool)
+    def flipX(self): return self._flip_x
+
+    @flipX.setter
+    def flipX(self, flip):
+        self._flip_x = bool(flip)
+        self.getView().getViewBox().invertX(self._base_inverted[0] != self._flip_x)
+
+    @pyqtProperty(bool)
+    def flipY(self): return self._flip_y
+
+    @flipY.setter
+    def flipY(self, flip):
+        self._flip_y = bool(flip)
+        self.getView().getViewBox().invertY(self._base_inverted[1] != self._flip_y)
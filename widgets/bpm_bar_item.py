@@ -0,0 +1,61 @@
+import numpy as np
+from PyQt5.QtCore import QRectF
+from PyQt5.QtGui import QPainterPath
+from pyqtgraph import GraphicsObject, arrayToQPath
+
+class BPMBarItem(GraphicsObject):
+    """
+    every BPM bar of an OrbitView as one graphics item
+    bars run from (z, 0) to (z, value) and are drawn as one path per pen,
+    so the number of Qt calls per frame doesn't depend on the number of BPMs
+    """
+    def __init__(self, names, z, pens, parent=None):
+        super(BPMBarItem, self).__init__(parent)
+        self.pens = list(pens)
+        self.paths = [QPainterPath() for _ in self.pens]
+        self.bounds = QRectF()
+        self.names = list(names)
+        self.z = np.asarray(z, dtype=float)
+
+        # bar endpoints, x is fixed and y is refilled on every setData
+        self._x = np.repeat(self.z, 2)
+        self._y = np.zeros(2*len(self.z))
+
+        # z-sorted copy for tooltip lookups
+        self._z_order = np.argsort(self.z)
+        self._z_sorted = self.z[self._z_order]
+
+    def setData(self, values, pen_classes):
+        """ <values> and <pen_classes> (index into self.pens) are per-BPM arrays in orbit order """
+        values = np.nan_to_num(np.asarray(values, dtype=float))
+        pen_classes = np.repeat(np.asarray(pen_classes), 2)
+        self._y[1::2] = values
+        self.prepareGeometryChange()
+        for i in range(len(self.pens)):
+            mask = (pen_classes == i)
+            self.paths[i] = arrayToQPath(self._x[mask], self._y[mask], connect='pairs')
+        if len(self.z):
+            ymin, ymax = min(values.min(), 0.0), max(values.max(), 0.0)
+            self.bounds = QRectF(self.z.min(), ymin, self.z.max()-self.z.min(), ymax-ymin)
+        self.update()
+
+    def setPen(self, pen_class, pen):
+        self.pens[pen_class] = pen
+        self.update()
+
+    def bpm_at(self, z, tolerance):
+        """ name of the BPM closest to <z>, if it's within <tolerance> """
+        if not len(self.z): return None
+        i = np.searchsorted(self._z_sorted, z)
+        candidates = [j for j in (i-1, i) if 0 <= j < len(self._z_sorted)]
+        j = min(candidates, key=lambda j: abs(self._z_sorted[j]-z))
+        if abs(self._z_sorted[j]-z) > tolerance: return None
+        return self.names[self._z_order[j]]
+
+    def paint(self, p, *args):
+        for pen, path in zip(self.pens, self.paths):
+            p.setPen(pen)
+            p.drawPath(path)
+
+    def boundingRect(self):
+        return self.bounds
@@ -1,10 +1,12 @@
 import math
 import numpy as np
-from PyQt5.QtWidgets import QGraphicsView, QGraphicsLineItem, QApplication, QMenu, QAction
-from PyQt5.QtGui import QColor, QBrush, QPen
-from PyQt5.QtCore import pyqtSlot, QLineF, QRectF, QPoint, QPointF, Qt, Q_ENUMS
+from PyQt5.QtWidgets import QGraphicsView, QGraphicsLineItem, QApplication, QMenu, QAction, QToolTip
+from PyQt5.QtGui import QColor, QBrush, QPen, QCursor
+from PyQt5.QtCore import pyqtSlot, QObject, QLineF, QRectF, QPoint, QPointF, Qt, Q_ENUMS
+from PyQt5 import sip
 from pyqtgraph import GraphicsLayoutWidget, PlotItem, ViewBox, GraphicsItem, GraphicsView, PlotDataItem, TextItem, ButtonItem, FillBetweenItem
-from widgets.bpm_line_item import BPMLineItem
+from widgets.bpm_bar_item import BPMBarItem
+from core.orbit_fit import OrbitFitter
 # from magnet_view import MagnetView
 from PyQt5.QtCore import QTimer
 
@@ -13,12 +15,55 @@ class RMSMode(object):
     FilledLine = 1
     Bars = 2
 
+# pen classes for BPMBarItem
+PEN_BPM = 0
+PEN_ENERGY_BPM = 1
+PEN_NO_BEAM = 2
+
+# default max redraw rate (Hz), redraws only happen when the orbit changed
+DEFAULT_DRAW_RATE = 60
+
+# how close (in pixels) the cursor has to be to a bar for its tooltip
+TOOLTIP_PIXELS = 4
+
+class OrbitDrawGroup(QObject):
+    """
+    the OrbitViews driven by one draw timer, redrawn together in one pass per tick
+    each orbit's generation is read once per pass, so linked views of one orbit
+    are skipped together and always draw the same update
+    """
+    def __init__(self, timer):
+        super(OrbitDrawGroup, self).__init__(timer)
+        self.views = []
+        timer.timeout.connect(self.redraw)
+
+    @classmethod
+    def for_timer(cls, timer):
+        """ the group for <timer>, created on first use """
+        return timer.findChild(cls) or cls(timer)
+
+    def add(self, view):
+        if view not in self.views: self.views.append(view)
+
+    def remove(self, view):
+        if view in self.views: self.views.remove(view)
+
+    @pyqtSlot()
+    def redraw(self):
+        self.views = [view for view in self.views if not sip.isdeleted(view)]
+        generations = {}
+        for view in self.views:
+            if view.orbit is None: continue
+            key = id(view.orbit)
+            if key not in generations: generations[key] = view.orbit.generation
+            view.redraw_bpms(generations[key])
+
 class OrbitView(GraphicsLayoutWidget):
 
     RMSMode = RMSMode
     Q_ENUMS(RMSMode)
 
-    def __init__(self, orbit=None, axis="X", use_sector_ticks=True, parent=None, ymin=-1.0, ymax=1.0, name=None, label=None, units=None, draw_timer=None, magnet_list=None):
+    def __init__(self, orbit=None, axis="X", use_sector_ticks=True, parent=None, ymin=-1.0, ymax=1.0, name=None, label=None, units=None, draw_timer=None, magnet_list=None, max_draw_rate=DEFAULT_DRAW_RATE):
         super(OrbitView, self).__init__(parent=parent)
         axis = axis.lower()
         if axis not in ["x", "y", "tmit"]:
@@ -93,17 +138,23 @@ class OrbitView(GraphicsLayoutWidget):
         self.axis_line = QGraphicsLineItem(0.0,0.0,1.0,0.0)
         self.axis_line.setPen(self.axis_pen)
         self.plotItem.addItem(self.axis_line, ignoreBounds=True)
-        self.lines = {}
+        self.bar_item = None
+        self.is_energy_bpm = None
         self.orbit = None
         self.needs_initial_range = True
+        # orbit generation last drawn, None forces the next redraw
+        self.drawn_generation = None
+        self.max_draw_rate = max_draw_rate
         self.set_draw_timer(draw_timer)
         self._display_fit = False
         self._rms_mode = RMSMode.Off
         self.fit_data_item = None
+        self.fitter = None
         self.rms_data_item = None
         self.zero_data_item = None
         self.rms_fill_item = None
         self.fit_options = {}
+        self.plotItem.scene().sigMouseMoved.connect(self.show_bpm_tooltip)
         if orbit is not None:
             self.set_orbit(orbit)
     
@@ -133,26 +184,31 @@ class OrbitView(GraphicsLayoutWidget):
             self.rms_fill_item = None
             self.zero_data_item = None
         self._rms_mode = rms_mode
+        self.drawn_generation = None
 
     def display_fit(self, enabled=True):
         if enabled and self.fit_data_item is None:
             self.fit_data_item = PlotDataItem(pen=self.fit_pen)
             self.plotItem.addItem(self.fit_data_item)
+            self.connect_fitter()
         elif not enabled:
+            self.disconnect_fitter()
             self.plotItem.removeItem(self.fit_data_item)
             self.fit_data_item = None
         self._display_fit = enabled
+        self.drawn_generation = None
         
     def set_draw_timer(self, new_timer, start=False):
         try:
-            self.draw_timer.timeout.disconnect(self.redraw_bpms)
-        except:
+            OrbitDrawGroup.for_timer(self.draw_timer).remove(self)
+        except AttributeError:
             pass
         if new_timer is None:
             new_timer = QTimer(self)
-            new_timer.setInterval(int(1000/60))
+        # a timer shared by linked views drives all of them in one pass
+        new_timer.setInterval(int(1000/self.max_draw_rate))
         self.draw_timer = new_timer
-        self.draw_timer.timeout.connect(self.redraw_bpms)
+        OrbitDrawGroup.for_timer(self.draw_timer).add(self)
         if start:
             self.draw_timer.start()
             
@@ -168,18 +224,22 @@ class OrbitView(GraphicsLayoutWidget):
             old_zmin = self.orbit.zmin()
         self.clear_orbit()
         self.orbit = orbit
+        self.drawn_generation = None
+        if self._display_fit:
+            self.connect_fitter()
         extent = self.orbit.zmax() - self.orbit.zmin()
         self.plotItem.setLimits(xMin=self.orbit.zmin()-(0.02*extent), xMax=self.orbit.zmax()+(0.02*extent))
         self.plotItem.enableAutoRange(enable=False)
         self.axis_line.setLine(self.orbit.zmin(),0.0,self.orbit.zmax(),0.0)
         if show_title and self.orbit.name:
             self.plotItem.setTitle("<h2>{}</h2>".format(self.orbit.name))
-        for bpm in self.orbit:
-            line = BPMLineItem(bpm)
-            self.lines[bpm.name] = line
-            self.set_pen_for_bpm(bpm)
-            self.plotItem.addItem(self.lines[bpm.name])
-            self.lines[bpm.name].setZValue(50.0)
+        self.bar_item = BPMBarItem(
+            names=self.orbit.names(), z=self.orbit.z_vals(),
+            pens=[self.bpm_pen, self.energy_bpm_pen, self.no_beam_pen],
+            )
+        self.is_energy_bpm = self.orbit.is_energy_bpm
+        self.plotItem.addItem(self.bar_item)
+        self.bar_item.setZValue(50.0)
         if self.use_sector_ticks:
             self.sector_ticks = [[],[]]
             self.sector_ticks[0] = self.orbit.sector_locations()
@@ -236,49 +296,79 @@ class OrbitView(GraphicsLayoutWidget):
         self.plotItem.enableAutoRange(enable=False)
         if self.orbit is None:
             return
-        for bpm in self.orbit:
-            self.plotItem.removeItem(self.lines[bpm.name])
+        self.disconnect_fitter()
+        self.plotItem.removeItem(self.bar_item)
         self.plotItem.enableAutoRange(x=auto_range_x_enabled, y=auto_range_y_enabled)
-        self.lines = {}
+        self.bar_item = None
             
-    @pyqtSlot()
-    def redraw_bpms(self):
+    def redraw_bpms(self, generation=None):
+        # nothing to do unless a BPM updated since the last frame
+        # <generation> is the orbit generation read by the view's draw group
+        if generation is None:
+            generation = self.orbit.generation
+        if generation == self.drawn_generation:
+            return
+        self.drawn_generation = generation
         if self._rms_mode == RMSMode.Bars:
-            for bpm in self.orbit:
-                self.set_pen_for_bpm(bpm)
-                self.lines[bpm.name].setLine(bpm.z,0.0,bpm.z,bpm.rms(self.axis))
+            values = self.orbit.rms(self.axis)
         else:
-            for bpm in self.orbit:
-                self.set_pen_for_bpm(bpm)
-                self.lines[bpm.name].setLine(bpm.z,0.0,bpm.z,bpm[self.axis])
+            values = self.orbit.values(self.axis)
+        no_beam = self.orbit.severity(self.axis) != 0
+        self.bar_item.setData(values, self.pen_classes(no_beam))
         if self._rms_mode != RMSMode.Off:
             self.orbit.save_latest()
             self.update_rms()
         self.update_fit()
 
-    def set_pen_for_bpm(self, bpm):
-        if bpm.severity(self.axis) != 0:
-            self.lines[bpm.name].setPen(self.no_beam_pen)
+    def pen_classes(self, no_beam):
+        pen_classes = np.where(self.is_energy_bpm, PEN_ENERGY_BPM, PEN_BPM)
+        pen_classes[no_beam] = PEN_NO_BEAM
+        return pen_classes
+
+    def show_bpm_tooltip(self, scene_pos):
+        if self.bar_item is None or not self.plotItem.sceneBoundingRect().contains(scene_pos):
+            return
+        z = self.plotItem.vb.mapSceneToView(scene_pos).x()
+        tolerance = TOOLTIP_PIXELS*self.plotItem.vb.viewPixelSize()[0]
+        name = self.bar_item.bpm_at(z, tolerance)
+        if name is None:
+            QToolTip.hideText()
         else:
-            if bpm.is_energy_bpm:
-                self.lines[bpm.name].setPen(self.energy_bpm_pen)
-            else:
-                self.lines[bpm.name].setPen(self.bpm_pen)
+            QToolTip.showText(QCursor.pos(), name, self)
+
+    def connect_fitter(self):
+        # x and y views of one orbit share a fitter, so each snapshot is fit once
+        if self.orbit is None or self.fitter is not None:
+            return
+        self.fitter = OrbitFitter.for_orbit(self.orbit)
+        self.fitter.add_user()
+        self.fitter.fit_ready.connect(self.show_fit)
+        # the fitter's worker thread stops once no view uses it
+        self.destroyed.connect(self.fitter.remove_user)
+        self.show_fit(self.fitter.result)
+
+    def disconnect_fitter(self):
+        if self.fitter is None:
+            return
+        self.fitter.fit_ready.disconnect(self.show_fit)
+        self.destroyed.disconnect(self.fitter.remove_user)
+        self.fitter.remove_user()
+        self.fitter = None
 
     def update_fit(self):
         if not self._display_fit:
             return
-        if self.orbit.fit_data is None:
-            if self.fit_data_item is not None:
-                self.fit_data_item.hide()
+        self.fitter.submit(self.orbit)
+
+    @pyqtSlot(object)
+    def show_fit(self, fit_data):
+        if self.fit_data_item is None:
+            return
+        if fit_data is None or self.axis not in ['x', 'y']:
+            self.fit_data_item.hide()
             return
-        fit_data = None
-        if self.axis == 'x':
-            fit_data = self.orbit.fit_data['xpos']
-        elif self.axis == 'y':
-            fit_data = self.orbit.fit_data['ypos']
         self.fit_data_item.show()
-        self.fit_data_item.setData(x=self.orbit.fit_data['zs'], y=fit_data)
+        self.fit_data_item.setData(x=fit_data['zs'], y=fit_data[f'{self.axis}pos'])
 
     def update_rms(self):
         if self._rms_mode != RMSMode.FilledLine:
@@ -300,6 +390,9 @@ class OrbitView(GraphicsLayoutWidget):
         self.bpm_pen = QPen(self.bpm_brush, 2)
         self.bpm_pen.setCosmetic(True)
         self.bpm_pen.setCapStyle(Qt.FlatCap)
+        if self.bar_item is not None:
+            self.bar_item.setPen(PEN_BPM, self.bpm_pen)
+        self.drawn_generation = None
         
     def setXLink(self, view):
         return self.plotItem.setXLink(view.plotItem)